@@ -2,7 +2,8 @@ import os
 import asyncio
 import re
 import time
-from datetime import datetime, timezone
+import uuid
+from datetime import datetime, timedelta, timezone
 from lib import browser_cookie3
 import logging
 import mimetypes
@@ -25,26 +26,84 @@ from googleapiclient.http import MediaFileUpload
 from googleapiclient.errors import HttpError
 from generate_cookies import export_youtube_cookies_to_txt
 
-from redis_lock import acquire_user_lock, release_user_lock
+from redis_lock import acquire_user_lock, release_user_lock, UserLock
 from clients.async_user_actioner import AsyncUserActioner
 from clients.pg_client import AsyncPostgresClient
-from clients.storage_client import storage_client
+from clients.storage_client import storage_client, file_sha256
+from clients.async_file_cache_actioner import AsyncFileCacheActioner
+from clients.async_storage_object_actioner import AsyncStorageObjectActioner
+from metadata_cache import metadata_cache, extract_video_id
+from download_coalescer import coalescer
+from download_scheduler import download_scheduler, ScheduledJob
+from process_pool import YtdlpProcessPool
+from ytdlp_worker import run_ytdlp, is_ffmpeg_start
+from job_queue import enqueue_job, RetryableJobError
+from storage_lifecycle import StorageLifecycleManager
+from subscription_cache import SubscriptionCache
+from clients.redis_client import redis_client
+from telegram_api import create_bot, file_input
+from telegram_governor import TelegramRateGovernor, DELIVERY, PROGRESS, BACKGROUND
+from metrics import PROBE_SECONDS, DOWNLOAD_SECONDS, DOWNLOAD_BYTES, DOWNLOAD_THROUGHPUT, POSTPROCESS_SECONDS
+from metrics import TELEGRAM_SEND_SECONDS, JOB_SECONDS
+from tracing import tracer, span, current_span, DownloadTimeline
 
-from config import TOKEN, ADMIN_CHAT_ID, ADMIN_USER_ID, DB_DSN, REQUIRED_CHANNELS, COOKIE_FILE
+from config import TOKEN, ADMIN_CHAT_ID, ADMIN_USER_ID, DB_DSN, REQUIRED_CHANNELS, COOKIE_FILE, CACHE_CHANNEL_ID, CACHE_WARM_FORMATS
+from config import YTDLP_EXECUTOR, YTDLP_PROCESS_WORKERS, YTDLP_JOB_TIMEOUT, DISPATCH_MODE, STREAM_UPLOADS
+from config import TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST, TELEGRAM_MAX_RETRIES
+from config import TELEGRAM_UPLOAD_LIMIT, DOWNLOAD_DIR, SUBSCRIPTION_CACHE_TTL, SUBSCRIPTION_NEGATIVE_CACHE_TTL
+from config import USER_CACHE_SIZE, USER_CACHE_TTL, USER_NEGATIVE_CACHE_TTL
+from config import DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_STATEMENT_CACHE_SIZE
+from config import USER_MAX_JOBS, PRIORITY_USER_IDS, PRIORITY_USER_WEIGHT
+from config import STORAGE_QUOTA_BYTES, STORAGE_OBJECT_TTL, STORAGE_GC_INTERVAL, STORAGE_GC_BATCH_SIZE
 from constants import FORMATS
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Лимит размера файла для прямой отправки (49 МБ для надежности)
-MAX_FILE_SIZE = 49 * 1024 * 1024
+# Лимит размера файла для прямой отправки: 49 МБ для api.telegram.org, до 2 ГБ для локального сервера Bot API
+MAX_FILE_SIZE = TELEGRAM_UPLOAD_LIMIT
 
+STAGE_TITLES = {
+    "download": "скачивание",
+    "postprocess": "обработка",
+    "upload": "отправка",
+}
 
-bot = Bot(token=TOKEN)
+YDL_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
 
-db = AsyncPostgresClient(dsn=DB_DSN)
-user_actioner = AsyncUserActioner(db)
+
+bot = create_bot(TOKEN)
+# Глобальный лимит общий для бота и воркеров через Redis
+telegram_governor = TelegramRateGovernor(
+    TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST, TELEGRAM_MAX_RETRIES, redis=redis_client
+)
+os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+
+db = AsyncPostgresClient(
+    dsn=DB_DSN,
+    min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE, statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+)
+user_actioner = AsyncUserActioner(
+    db, redis_client,
+    cache_size=USER_CACHE_SIZE, cache_ttl=USER_CACHE_TTL, negative_ttl=USER_NEGATIVE_CACHE_TTL,
+)
+file_cache = AsyncFileCacheActioner(db)
+storage_objects = AsyncStorageObjectActioner(db)
+subscription_cache = SubscriptionCache(redis_client, SUBSCRIPTION_CACHE_TTL, SUBSCRIPTION_NEGATIVE_CACHE_TTL)
+storage_lifecycle = StorageLifecycleManager(
+    storage_client, storage_objects,
+    quota_bytes=STORAGE_QUOTA_BYTES, ttl=STORAGE_OBJECT_TTL,
+    interval=STORAGE_GC_INTERVAL, batch_size=STORAGE_GC_BATCH_SIZE,
+)
+ytdlp_pool = YtdlpProcessPool(size=YTDLP_PROCESS_WORKERS, job_timeout=YTDLP_JOB_TIMEOUT) if YTDLP_EXECUTOR == "process" else None
+
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+background_tasks: set[asyncio.Task] = set()
+# Блокировки пользователей, чьи задачи ждут в очереди; их снимает воркер по токену
+queued_user_locks: set[UserLock] = set()
+# Прогрев кэша выполняется по одному видео, чтобы не конкурировать с пользователями
+warm_semaphore = asyncio.Semaphore(1)
 
 class DownloadState(StatesGroup):
     waiting_for_format = State()
@@ -88,37 +147,128 @@ def is_youtube_url(url: str) -> bool:
         r'(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})')
     return re.match(youtube_regex, url) is not None
 
-async def estimate_video_size(url: str, format_config: dict) -> int:
+
+async def _extract_video_info(url: str) -> dict:
     ydl_opts = {
         'quiet': True,
         'simulate': True,
-        'format': format_config['format'],
         'cookiefile': COOKIE_FILE,
-        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'user-agent': YDL_USER_AGENT,
     }
-    
-    if 'postprocessors' in format_config:
-        ydl_opts['postprocessors'] = format_config['postprocessors']
 
+    with YoutubeDL(ydl_opts) as ydl, PROBE_SECONDS.time():
+        return await asyncio.to_thread(ydl.extract_info, url, download=False)
+
+
+async def probe_video(url: str) -> dict:
+    """
+    Returns the yt-dlp info dict for the URL with the complete list of
+    available formats. Results are shared through the metadata cache.
+    """
+    with span("extract_info"):
+        return await metadata_cache.get_info(url, _extract_video_info)
+
+
+def _format_size(fmt: dict, duration: float) -> int:
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return int(size)
+    tbr = fmt.get('tbr') or 0
+    return int((tbr * 1000 * (duration or 1)) / 8)
+
+
+def _select_format(ydl: YoutubeDL, info: dict, format_spec: str) -> dict | None:
+    """Resolves a format selector locally against the already extracted formats."""
+    formats = info.get('formats') or [info]
+    # Документированный контекст селектора форматов yt-dlp
+    ctx = {
+        'formats': formats,
+        'has_merged_format': any('none' not in (f.get('acodec'), f.get('vcodec')) for f in formats),
+        'incomplete_formats': (
+            all(f.get('vcodec') == 'none' for f in formats) or all(f.get('acodec') == 'none' for f in formats)
+        ),
+    }
+    selected = list(ydl.build_format_selector(format_spec)(ctx))
+    return selected[-1] if selected else None
+
+
+def _selected_size(selected: dict, duration: float) -> int:
+    # Для склеиваемых форматов (video+audio) суммируем размеры всех потоков
+    parts = selected.get('requested_formats') or (selected,)
+    return sum(_format_size(part, duration) for part in parts)
+
+
+def estimate_format_sizes(info: dict) -> dict[str, int]:
+    """
+    Estimates the size of every entry in FORMATS from one probe result.
+
+    Formats that cannot be satisfied are omitted, as are video qualities that
+    resolve to the same streams as a lower one (e.g. /1080 for a 720p video).
+    """
+    duration = info.get('duration')
+    sizes = {}
+    seen_streams = set()
+
+    with YoutubeDL({'quiet': True}) as ydl:
+        for format_key, format_config in FORMATS.items():
+            try:
+                selected = _select_format(ydl, info, format_config['format'])
+            except Exception as e:
+                logger.warning(f"Не удалось разобрать формат {format_key}: {e}")
+                continue
+
+            if not selected:
+                continue
+
+            if format_config['send_method'] == 'send_video':
+                stream_id = selected.get('format_id')
+                if stream_id in seen_streams:
+                    continue
+                seen_streams.add(stream_id)
+
+            sizes[format_key] = _selected_size(selected, duration)
+
+    return sizes
+
+
+async def estimate_video_size(url: str, format_config: dict) -> int:
     try:
-        with YoutubeDL(ydl_opts) as ydl:
-            info = await asyncio.to_thread(ydl.extract_info, url, download=False)
-            
-            if 'requested_downloads' in info and info['requested_downloads']:
-                filesize = info['requested_downloads'][0].get('filesize')
-                if filesize:
-                    return filesize
-                    
-            tbr = info.get('tbr') or 0
-            duration = info.get('duration') or 1
-            
-            estimated_size = (tbr * 1000 * duration) / 8
-            return int(estimated_size)
-            
+        info = await probe_video(url)
+        with YoutubeDL({'quiet': True}) as ydl:
+            selected = _select_format(ydl, info, format_config['format'])
+        if not selected:
+            return 0
+        return _selected_size(selected, info.get('duration'))
+
     except Exception as e:
         logger.error(f"Ошибка оценки размера: {e}")
         return 0
 
+async def streamable_extension(url: str, format_config: dict, estimated_size: int | None = None) -> str | None:
+    """
+    Returns the file extension if the format is a single large file that
+    yt-dlp writes sequentially (no merge, no postprocessing), so it can be
+    uploaded to storage while it is still being downloaded. A known size
+    estimate within the Telegram limit answers without probing.
+    """
+    if not STREAM_UPLOADS or 'postprocessors' in format_config:
+        return None
+    if estimated_size and estimated_size <= MAX_FILE_SIZE:
+        return None
+    try:
+        info = await probe_video(url)
+        with YoutubeDL({'quiet': True}) as ydl:
+            selected = _select_format(ydl, info, format_config['format'])
+    except Exception as e:
+        logger.warning(f"Не удалось определить формат для потоковой выгрузки: {e}")
+        return None
+
+    if not selected or selected.get('requested_formats'):
+        return None
+    if _selected_size(selected, info.get('duration')) <= MAX_FILE_SIZE:
+        return None
+    return selected.get('ext')
+
 async def send_subscription_request(chat_id: int):
     """
     Sends a message with inline buttons for required channel subscriptions.
@@ -183,35 +333,441 @@ async def ensure_user_exists(message_or_query: types.Message | types.CallbackQue
         
     return False
 
-async def is_user_subscribed(user_id: int) -> bool:
-    """Checks if the user is subscribed to all required channels."""
+async def _check_channel_membership(channel_name: str, user_id: int) -> bool | None:
+    """Returns whether the user is a channel member, or None if the check failed."""
+    try:
+        member = await bot.get_chat_member(chat_id=channel_name, user_id=user_id)
+        return member.status in ("member", "administrator", "creator")
+    except Exception as e:
+        logger.warning(f"Ошибка при проверке подписки на {channel_name}: {e}")
+        return None
+
+async def is_user_subscribed(user_id: int, use_cache: bool = True) -> bool:
+    """
+    Checks if the user is subscribed to all required channels. Results are
+    cached in Redis; pass use_cache=False to force a fresh check.
+    """
+    channels = [c.strip() for c in REQUIRED_CHANNELS if c.strip()]
     # Skip check if the list is not defined or contains only empty strings
-    if not REQUIRED_CHANNELS or not any(c.strip() for c in REQUIRED_CHANNELS):
+    if not channels:
         return True
 
-    for channel in REQUIRED_CHANNELS:
-        channel_name = channel.strip()
-        if not channel_name:
-            continue  # Skip any empty entries in the list
+    if use_cache:
+        cached = await subscription_cache.get(user_id)
+        if cached is not None:
+            return cached
+
+    # Каналы проверяются параллельно
+    results = await asyncio.gather(*(_check_channel_membership(channel, user_id) for channel in channels))
+    if None in results:
+        # If we can't check one channel, we assume failure for security, but don't cache it.
+        return False
+
+    subscribed = all(results)
+    await subscription_cache.set(user_id, subscribed)
+    return subscribed
+
+
+async def find_output_file(format_config: dict, base_filename: str, summary: dict) -> str:
+    """Locates the file yt-dlp produced for the job after downloading and postprocessing."""
+    if 'postprocessors' in format_config:
+        ext = format_config['extension']
+        final_path = f"{base_filename}.{ext}"
+        
+        for i in range(15):
+            if os.path.exists(final_path):
+                break
+            logger.info(f"Ожидание файла ({i+1}/15): {final_path}")
+            await asyncio.sleep(1)
+        else:
+            raise FileNotFoundError(f"Конвертированный файл не найден: {final_path}")
+    else:
+        ext = summary.get('ext') or 'mp4'
+        final_path = f"{base_filename}.{ext}"
+        
+        if not os.path.exists(final_path):
+            candidates = glob.glob(f"{base_filename}*")
+            logger.info(f"Файл не найден, кандидаты: {candidates}")
+            
+            filtered_candidates = [
+                f for f in candidates 
+                if not re.search(r'\.f\d+\.', f)
+                and not f.endswith('.part')        
+                and not f.endswith('.ytdl')                             ]
+            
+            logger.info(f"Отфильтрованные кандидаты: {filtered_candidates}")
+            
+            if filtered_candidates:
+                filtered_candidates.sort(key=os.path.getmtime, reverse=True)
+                final_path = filtered_candidates[0]
+                logger.info(f"Выбран файл по дате изменения: {final_path}")
+            
+            if not os.path.exists(final_path) and candidates:
+                final_path = candidates[0]
+                logger.info(f"Выбран первый кандидат: {final_path}")
 
+    if not os.path.exists(final_path):
+        raise FileNotFoundError(f"Файл не найден после скачивания: {final_path}")
+    return final_path
+
+
+async def download_media(
+    url: str,
+    format_config: dict,
+    base_filename: str,
+    progress_hooks: list | None = None,
+    job: ScheduledJob | None = None,
+) -> str:
+    """
+    Downloads the URL in the given format to `base_filename.<ext>` and
+    returns the path of the finished file. If a scheduler job is given,
+    ffmpeg postprocessing waits for a postprocess slot.
+
+    yt-dlp runs in a worker thread, or in the process pool when
+    YTDLP_EXECUTOR is "process".
+    """
+    extension = format_config['extension']
+    # Границы этапов для метрик: конец скачивания и начало работы ffmpeg
+    marks = {}
+    timeline = DownloadTimeline()
+    hooks = [*(progress_hooks or []), timeline]
+
+    def postprocessor_hook(d):
+        if is_ffmpeg_start(d):
+            marks.setdefault('downloaded', time.monotonic())
+            if job is not None:
+                job.enter_from_thread("postprocess")
+            marks.setdefault('postprocess', time.monotonic())
+        timeline.postprocessor(d)
+
+    async def on_postprocess(d):
+        if is_ffmpeg_start(d):
+            marks.setdefault('downloaded', time.monotonic())
+            if job is not None:
+                await job.enter("postprocess")
+            marks.setdefault('postprocess', time.monotonic())
+        timeline.postprocessor(d)
+
+    def on_progress(d):
+        for hook in hooks:
+            hook(d)
+
+    ydl_opts = {
+        'outtmpl': f"{base_filename}.%(ext)s",
+        'quiet': True,
+        'format': format_config['format'],
+        'buffersize': 1024 * 1024 * 16,
+        'http_chunk_size': 1048576,
+        'continuedl': True,
+        'noprogress': True, 
+        'verbose': False,
+        'cookiefile': COOKIE_FILE,
+        'user-agent': YDL_USER_AGENT,
+    }
+
+    if 'postprocessors' in format_config:
+        ydl_opts['postprocessors'] = format_config['postprocessors']
+        ydl_opts['keepvideo'] = True  
+
+    info = await probe_video(url)
+
+    started = time.monotonic()
+    try:
+        if ytdlp_pool is not None:
+            summary, reextracted = await ytdlp_pool.run(ydl_opts, info, url, on_progress, on_postprocess)
+        else:
+            ydl_opts['progress_hooks'] = hooks
+            ydl_opts['postprocessor_hooks'] = [postprocessor_hook]
+            summary, reextracted = await asyncio.to_thread(run_ytdlp, ydl_opts, info, url)
+    except BaseException as e:
+        timeline.close(e)
+        raise
+    timeline.close()
+
+    finished = time.monotonic()
+    if reextracted:
+        await metadata_cache.invalidate(url)
+    logger.info(f"Информация о видео: {summary.get('title')}")
+    logger.info(f"Расширение: {summary.get('ext')}")
+    logger.info(f"Запрошенная загрузка: {summary.get('format_id')} -> {summary.get('filepath')}")
+
+    with span("file_discovery"):
+        final_path = await find_output_file(format_config, base_filename, summary)
+
+    download_seconds = marks.get('downloaded', finished) - started
+    size = os.path.getsize(final_path)
+    DOWNLOAD_SECONDS.labels(extension).observe(download_seconds)
+    DOWNLOAD_BYTES.labels(extension).inc(size)
+    if download_seconds > 0:
+        DOWNLOAD_THROUGHPUT.observe(size / download_seconds)
+    if 'postprocess' in marks:
+        POSTPROCESS_SECONDS.labels(extension).observe(finished - marks['postprocess'])
+
+    return final_path
+
+
+def cleanup_temp_files(base_filename: str, final_path: str | None = None):
+    if final_path and os.path.exists(final_path):
         try:
-            member = await bot.get_chat_member(chat_id=channel_name, user_id=user_id)
-            if member.status not in ("member", "administrator", "creator"):
-                return False
+            os.remove(final_path)
+            logger.info(f"Удален временный файл: {final_path}")
         except Exception as e:
-            logger.warning(f"Ошибка при проверке подписки на {channel_name}: {e}")
-            # If we can't check one channel, we assume failure for security.
-            return False
+            logger.warning(f"Ошибка при удалении {final_path}: {e}")
+
+    temp_files = glob.glob(f"{base_filename}*")
+    for temp_file in temp_files:
+        if temp_file != final_path and os.path.exists(temp_file):
+            try:
+                os.remove(temp_file)
+                logger.info(f"Удален временный файл: {temp_file}")
+            except Exception as e:
+                logger.warning(f"Ошибка удаления временного файла {temp_file}: {e}")
+
+
+async def send_media(
+    chat_id: int, media: types.InputFile | str, send_method: str, priority: int = DELIVERY
+) -> types.Message:
+    """Sends a local file or an existing file_id with the method configured for the format."""
+    if send_method == 'send_audio':
+        method = bot.send_audio
+    elif send_method == 'send_video':
+        method = bot.send_video
+    else:
+        method = bot.send_document
+
+    async def send():
+        with TELEGRAM_SEND_SECONDS.labels(send_method).time():
+            return await method(chat_id, media)
+
+    return await telegram_governor.submit(chat_id, send, priority)
+
+
+def sent_file_id(sent: types.Message) -> str | None:
+    media = sent.audio or sent.video or sent.document
+    return media.file_id if media else None
+
+
+async def remember_file_id(video_id: str | None, format_key: str, send_method: str, sent: types.Message):
+    file_id = sent_file_id(sent)
+    if not video_id or file_id is None:
+        return
+    try:
+        await file_cache.save_file_id(video_id, format_key, file_id, send_method, datetime.now(timezone.utc))
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить file_id для {video_id}/{format_key}: {e}")
+
+
+async def send_cached_file(chat_id: int, video_id: str | None, format_key: str, format_config: dict) -> bool:
+    """
+    Re-sends a previously delivered file by its Telegram file_id.
+    Returns False if there is no usable cached file.
+    """
+    if not video_id:
+        return False
+
+    try:
+        file_id = await file_cache.get_file_id(video_id, format_key)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать кэш файлов для {video_id}/{format_key}: {e}")
+        return False
+
+    if not file_id:
+        return False
+
+    try:
+        await send_media(chat_id, file_id, format_config['send_method'])
+    except TelegramBadRequest as e:
+        logger.warning(f"Кэшированный file_id для {video_id}/{format_key} недействителен: {e}")
+        try:
+            await file_cache.delete_file_id(video_id, format_key)
+        except Exception as e:
+            logger.warning(f"Не удалось удалить file_id для {video_id}/{format_key}: {e}")
+        return False
+
+    logger.info(f"Отправлен кэшированный файл {video_id}/{format_key}")
     return True
 
-async def process_download(message: types.Message, format_key: str, state: FSMContext):
+
+async def warm_file_cache(url: str, video_id: str, format_keys: list[str]):
+    """Pre-uploads the given formats of a video into the private cache channel."""
+    async with warm_semaphore:
+        try:
+            sizes = estimate_format_sizes(await probe_video(url))
+        except Exception as e:
+            logger.warning(f"Прогрев кэша {video_id} пропущен: {e}")
+            return
+
+        for format_key in format_keys:
+            format_config = FORMATS.get(format_key)
+            if not format_config or not 0 < sizes.get(format_key, 0) <= MAX_FILE_SIZE:
+                continue
+
+            timestamp = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')
+            base_filename = os.path.join(DOWNLOAD_DIR, f"cache_{video_id}_{format_key}_{timestamp}")
+            final_path = None
+            job = download_scheduler.job()
+            try:
+                if await file_cache.get_file_id(video_id, format_key):
+                    continue
+
+                await job.enter("download")
+                final_path = await download_media(url, format_config, base_filename, job=job)
+                if os.path.getsize(final_path) > MAX_FILE_SIZE:
+                    continue
+
+                await job.enter("upload")
+                sent = await send_media(
+                    CACHE_CHANNEL_ID, file_input(bot, final_path), format_config['send_method'], BACKGROUND
+                )
+                await remember_file_id(video_id, format_key, format_config['send_method'], sent)
+                logger.info(f"Кэш прогрет: {video_id}/{format_key}")
+            except Exception as e:
+                logger.warning(f"Ошибка прогрева кэша {video_id}/{format_key}: {e}")
+            finally:
+                await job.close()
+                cleanup_temp_files(base_filename, final_path)
+
+
+def storage_object_name(video_id: str, format_key: str, content_hash: str, local_path: str) -> str:
+    """Content-addressed name of a file on the storage host."""
+    ext = os.path.splitext(local_path)[1]
+    return f"{video_id}_{format_key}_{content_hash[:16]}{ext}"
+
+
+async def stored_object_url(video_id: str | None, format_key: str) -> str | None:
+    """Returns the public URL of this video and format if it is already on the storage host."""
+    if not video_id:
+        return None
+    now = datetime.now(timezone.utc)
+    # Объекты старше TTL вот-вот удалит сборщик мусора
+    created_after = now - timedelta(seconds=STORAGE_OBJECT_TTL) if STORAGE_OBJECT_TTL else datetime.fromtimestamp(0, timezone.utc)
+    try:
+        stored = await storage_objects.get_latest(video_id, format_key, created_after)
+        if not stored:
+            return None
+        await storage_objects.touch(stored['remote_name'], now)
+    except Exception as e:
+        logger.warning(f"Не удалось проверить хранилище для {video_id}/{format_key}: {e}")
+        return None
+    return storage_client.public_url(stored['remote_name'])
+
+
+async def save_stored_object(remote_name: str, video_id: str, format_key: str, content_hash: str, size: int):
+    try:
+        await storage_objects.save_object(remote_name, video_id, format_key, content_hash, size, datetime.now(timezone.utc))
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить объект хранилища {remote_name}: {e}")
+
+
+async def store_large_file(final_path: str, video_id: str | None, format_key: str) -> str:
+    """
+    Uploads a file to the storage host under its content address and returns
+    the public URL. If an identical object is already stored, the upload is
+    skipped.
+    """
+    if not video_id:
+        public_url = await storage_client.upload_file(final_path)
+        # Файл без ID видео не переиспользуется, но учитывается в квоте хранилища
+        await save_stored_object(os.path.basename(final_path), "", format_key, "", os.path.getsize(final_path))
+        return public_url
+
+    content_hash = await asyncio.to_thread(file_sha256, final_path)
+    remote_name = storage_object_name(video_id, format_key, content_hash, final_path)
+    try:
+        existing = await storage_objects.get_object(remote_name)
+    except Exception as e:
+        logger.warning(f"Не удалось проверить объект хранилища {remote_name}: {e}")
+        existing = None
+    if existing:
+        logger.info(f"Файл {remote_name} уже есть на хранилище, загрузка пропущена")
+        await save_stored_object(remote_name, video_id, format_key, content_hash, existing['size'])
+        return storage_client.public_url(remote_name)
+
+    public_url = await storage_client.upload_file(final_path, remote_name)
+    await save_stored_object(remote_name, video_id, format_key, content_hash, os.path.getsize(final_path))
+    return public_url
+
+
+class ChatReporter:
+    """Reports the progress and outcome of a download job straight to the user's chat."""
+
+    def __init__(self, chat_id: int, status_message_id: int):
+        self.chat_id = chat_id
+        self.status_message_id = status_message_id
+
+    async def progress(self, text: str):
+        try:
+            # Правки одного сообщения склеиваются, отправляется только последний текст
+            await telegram_governor.submit(
+                self.chat_id,
+                lambda: bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.status_message_id),
+                PROGRESS,
+                coalesce_key=(self.chat_id, self.status_message_id),
+            )
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                logger.warning(f"Could not edit progress message: {e}")
+        except Exception as e:
+            logger.warning(f"Could not edit progress message: {e}")
+
+    async def link(self, public_url: str):
+        await self.progress("Отправка ссылки на файл...")
+        await telegram_governor.submit(self.chat_id, lambda: bot.send_message(
+            self.chat_id,
+            f"Файл слишком большой для автоматической отправки.\n\n"
+            f"Вы можете скачать его по прямой ссылке (отладочный режим):\n"
+            f"{public_url}"
+        ))
+        # Запоздавшие правки удаляемого статуса больше не нужны
+        telegram_governor.discard((self.chat_id, self.status_message_id))
+        await telegram_governor.submit(
+            self.chat_id, lambda: bot.delete_message(self.chat_id, self.status_message_id)
+        )
+
+    async def error(self, text: str):
+        try:
+            await telegram_governor.submit(self.chat_id, lambda: bot.send_message(self.chat_id, text))
+        except TelegramForbiddenError:
+            logger.warning(f"Bot is blocked by chat {self.chat_id}. Could not send final error message.")
+
+
+async def deliver_shared_result(job: dict, reporter, result: dict):
+    """Delivers the result of a download performed by another request."""
+    kind = result.get("kind")
+    if kind == "file_id":
+        await send_media(job["chat_id"], result["file_id"], result["send_method"])
+    elif kind == "url":
+        await reporter.link(result["url"])
+    else:
+        await reporter.error(result.get("error") or "Произошла ошибка при загрузке.")
+
+
+def schedule_cache_warmup(url: str, video_id: str | None):
+    """Starts a background pre-upload of CACHE_WARM_FORMATS if a cache channel is configured."""
+    if CACHE_CHANNEL_ID is None or not CACHE_WARM_FORMATS or not video_id:
+        return
+    task = asyncio.create_task(warm_file_cache(url, video_id, CACHE_WARM_FORMATS))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+def user_weight(user_id: int) -> float:
+    """Share of the pipeline stages a user's jobs get relative to other users."""
+    if user_id == ADMIN_USER_ID or user_id in PRIORITY_USER_IDS:
+        return PRIORITY_USER_WEIGHT
+    return 1.0
+
+
+async def process_download(
+    message: types.Message, format_key: str, state: FSMContext, user_data: dict | None = None
+):
     user_id = message.from_user.id
-    chat_id = message.chat.id
 
     if not await ensure_user_exists(message):
         return
 
-    user_data = await state.get_data()
+    if user_data is None:
+        user_data = await state.get_data()
     url = user_data.get("last_url")
 
     if not url:
@@ -227,38 +783,157 @@ async def process_download(message: types.Message, format_key: str, state: FSMCo
         await message.answer("Неподдерживаемый формат.")
         return
 
-    if not await is_user_subscribed(user_id):
+    job_id = uuid.uuid4().hex
+    video_id = user_data.get("video_id") or extract_video_id(url)
+    async with tracer.trace(
+        "process_download",
+        **{"job.id": job_id, "user.id": user_id, "job.format": format_key, "video.id": video_id},
+    ):
+        await start_download(message, job_id, url, video_id, format_key, format_config, user_data)
+
+
+async def start_download(
+    message: types.Message, job_id: str, url: str, video_id: str | None,
+    format_key: str, format_config: dict, user_data: dict,
+):
+    """Checks access and the file_id cache, takes a user slot and runs or enqueues the job."""
+    user_id = message.from_user.id
+    chat_id = message.chat.id
+
+    with span("subscription_check"):
+        subscribed = await is_user_subscribed(user_id)
+    if not subscribed:
         await message.answer("Для скачивания необходимо подписаться на каналы.")
         await send_subscription_request(chat_id)
         return
 
-    if not acquire_user_lock(user_id):
-        await message.answer(" У вас уже выполняется загрузка. Пожалуйста, подождите.")
+    with span("file_id_cache"):
+        if await send_cached_file(chat_id, video_id, format_key, format_config):
+            return
+
+    with span("lock_acquire") as lock_span:
+        user_lock = await acquire_user_lock(user_id, slots=USER_MAX_JOBS)
+        if lock_span is not None and user_lock is not None:
+            lock_span.set_attribute("lock.slot", user_lock.slot)
+    if user_lock is None:
+        await message.answer(f" Достигнут лимит одновременных загрузок ({USER_MAX_JOBS}). Дождитесь завершения одной из них.")
         return
 
-    try:
-        await user_actioner.update_date(user_id, datetime.now(timezone.utc))
-    except Exception as e:
-        logger.warning(f" Не удалось обновить дату для пользователя {user_id}: {e}")
+    with span("db_update"):
+        try:
+            await user_actioner.update_date(user_id, datetime.now(timezone.utc))
+        except Exception as e:
+            logger.warning(f" Не удалось обновить дату для пользователя {user_id}: {e}")
 
     status_message = await message.answer("Пожалуйста, подождите...")
 
-    timestamp = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')
-    base_filename = f"temp_{user_id}_{timestamp}"
-    output_template = f"{base_filename}.%(ext)s"
+    parent = current_span()
+    job = {
+        "job_id": job_id,
+        "user_id": user_id,
+        "chat_id": chat_id,
+        "status_message_id": status_message.message_id,
+        "url": url,
+        "format_key": format_key,
+        "lock_token": user_lock.token,
+        "lock_slot": user_lock.slot,
+        "weight": user_weight(user_id),
+        # Оценка из пробы, сохранённой в состоянии при выборе ссылки
+        "estimated_size": (user_data.get("sizes") or {}).get(format_key),
+        # Воркер продолжает трассу задачи под тем же идентификатором
+        "trace_id": parent.trace.trace_id if parent else None,
+        "parent_span_id": parent.span_id if parent else None,
+    }
+
+    if DISPATCH_MODE == "stream":
+        # Пока задача в очереди, аренду продлевает фронтенд; продление прекратится,
+        # когда воркер снимет блокировку по токену
+        queued_user_locks.add(user_lock)
+        user_lock.add_done_callback(queued_user_locks.discard)
+        try:
+            with span("enqueue"):
+                await enqueue_job(job)
+        except Exception as e:
+            logger.error(f"Не удалось поставить задачу в очередь: {e}", exc_info=True)
+            await user_lock.release()
+            await message.answer("Не удалось поставить загрузку в очередь. Попробуйте позже.")
+        return
+
+    reporter = ChatReporter(chat_id, status_message.message_id)
+    try:
+        await run_download_job(job, reporter)
+    except RetryableJobError as e:
+        # Без очереди повторять задачу некому
+        await reporter.error(str(e))
+    finally:
+        await user_lock.release()
+
+
+async def handle_job_event(event: dict):
+    """Applies a progress or result event sent by a download worker."""
+    reporter = ChatReporter(event["chat_id"], event["status_message_id"])
+    if event["type"] == "progress":
+        await reporter.progress(event["text"])
+    elif event["type"] == "link":
+        await reporter.link(event["url"])
+    elif event["type"] == "error":
+        await reporter.error(event["text"])
+
+
+# Ошибки, которые не исправит повторная попытка
+PERMANENT_ERRORS = ("File not found", "Private video", "Members-only", "Copyright", "Video unavailable")
+
+
+def is_retryable_error(e: Exception) -> bool:
+    """Network and YouTube failures are transient; missing or restricted videos are not."""
+    return not any(marker in str(e) for marker in PERMANENT_ERRORS)
+
+
+async def run_download_job(job: dict, reporter):
+    """
+    Downloads and delivers one requested format. Media is sent to the chat
+    directly; status edits, links and errors go through the reporter.
+    Transient failures raise RetryableJobError instead of being reported.
+    """
+    async with tracer.trace(
+        "run_download_job",
+        trace_id=job.get("trace_id"),
+        parent_span_id=job.get("parent_span_id"),
+        **{"job.id": job["job_id"], "user.id": job["user_id"], "job.format": job["format_key"]},
+    ):
+        await _run_download_job(job, reporter)
+
+
+async def _run_download_job(job: dict, reporter):
+    user_id = job["user_id"]
+    chat_id = job["chat_id"]
+    url = job["url"]
+    format_key = job["format_key"]
+    format_config = FORMATS[format_key]
+    video_id = extract_video_id(url)
+
+    # У пользователя может быть несколько задач одновременно, поэтому имя включает id задачи
+    base_filename = os.path.join(DOWNLOAD_DIR, f"temp_{user_id}_{job['job_id']}")
     final_path = None
+    ownership = None
+    shared_result = None
+    scheduled = None
+    streamed_url = None
+    retrying = False
 
     last_update_time = 0
     loop = asyncio.get_running_loop()
+    job_started = time.monotonic()
+    root_span = current_span()
 
-    async def edit_status_message(text: str):
-        try:
-            await status_message.edit_text(text)
-        except TelegramBadRequest as e:
-            if "message is not modified" not in str(e):
-                logger.warning(f"Could not edit progress message: {e}")
-        except Exception as e:
-            logger.warning(f"Could not edit progress message: {e}")
+    async def report_progress(text: str):
+        await reporter.progress(text)
+        if ownership is not None:
+            await ownership.publish_progress(text)
+
+    async def report_queue_position(stage: str, position: int, eta: float):
+        minutes = max(1, round(eta / 60))
+        await report_progress(f"Вы в очереди на {STAGE_TITLES[stage]}: позиция {position}, ожидание ~{minutes} мин.")
 
     def progress_hook(d):
         nonlocal last_update_time
@@ -267,127 +942,130 @@ async def process_download(message: types.Message, format_key: str, state: FSMCo
             if current_time - last_update_time < 5:
                 return
 
-            percent_str = d.get('_percent_str', '0.0%').strip()
-            speed_str = d.get('_speed_str', 'N/A').strip()
-            eta_str = d.get('_eta_str', 'N/A').strip()
+            percent_str = (d.get('_percent_str') or '0.0%').strip()
+            speed_str = (d.get('_speed_str') or 'N/A').strip()
+            eta_str = (d.get('_eta_str') or 'N/A').strip()
             
             text = f" Загрузка: {percent_str} | Скорость: {speed_str} | ETA: {eta_str}"
-            asyncio.run_coroutine_threadsafe(edit_status_message(text), loop)
+            asyncio.run_coroutine_threadsafe(report_progress(text), loop)
             last_update_time = current_time
         
         elif d['status'] == 'finished':
-            asyncio.run_coroutine_threadsafe(edit_status_message(" Загрузка завершена, обработка..."), loop)
-
-    ydl_opts = {
-        'outtmpl': output_template,
-        'quiet': True,
-        'format': format_config['format'],
-        'buffersize': 1024 * 1024 * 16,
-        'http_chunk_size': 1048576,
-        'continuedl': True,
-        'noprogress': True, 
-        'verbose': False,
-        'cookiefile': COOKIE_FILE,
-        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'progress_hooks': [progress_hook],
-    }
-
-    if 'postprocessors' in format_config:
-        ydl_opts['postprocessors'] = format_config['postprocessors']
-        ydl_opts['keepvideo'] = True  
+            asyncio.run_coroutine_threadsafe(report_progress(" Загрузка завершена, обработка..."), loop)
 
     try:
         logger.info(f"Начало обработки: {url}")
         logger.info(f"Формат: {format_key}")
         logger.info(f"Параметры: {format_config}")
-        
-        with YoutubeDL(ydl_opts) as ydl:
-            info = await asyncio.to_thread(ydl.extract_info, url)
-            url = None
-            logger.info(f"Информация о видео: {info.get('title')}")
-            logger.info(f"Расширение: {info.get('ext')}")
-            if 'requested_downloads' in info and info['requested_downloads']:
-                logger.info(f"Запрошенные загрузки: {info['requested_downloads'][0]}")
-
-            if 'postprocessors' in format_config:
-                ext = format_config['extension']
-                final_path = f"{base_filename}.{ext}"
-                
-                for i in range(15):
-                    if os.path.exists(final_path):
-                        break
-                    logger.info(f"Ожидание файла ({i+1}/15): {final_path}")
-                    await asyncio.sleep(1)
-                else:
-                    raise FileNotFoundError(f"Конвертированный файл не найден: {final_path}")
-            else:
-                ext = info.get('ext', 'mp4')
-                final_path = f"{base_filename}.{ext}"
-                
-                if not os.path.exists(final_path):
-                    candidates = glob.glob(f"{base_filename}*")
-                    logger.info(f"Файл не найден, кандидаты: {candidates}")
-                    
-                    filtered_candidates = [
-                        f for f in candidates 
-                        if not re.search(r'\.f\d+\.', f)
-                        and not f.endswith('.part')        
-                        and not f.endswith('.ytdl')                             ]
-                    
-                    logger.info(f"Отфильтрованные кандидаты: {filtered_candidates}")
-                    
-                    if filtered_candidates:
-                        filtered_candidates.sort(key=os.path.getmtime, reverse=True)
-                        final_path = filtered_candidates[0]
-                        logger.info(f"Выбран файл по дате изменения: {final_path}")
-                    
-                    if not os.path.exists(final_path) and candidates:
-                        final_path = candidates[0]
-                        logger.info(f"Выбран первый кандидат: {final_path}")
 
-        if not os.path.exists(final_path):
-            raise FileNotFoundError(f"Файл не найден после скачивания: {final_path}")
+        # Если это видео в этом формате уже скачивается, ждём чужой результат
+        if video_id:
+            ownership = await coalescer.acquire(video_id, format_key)
+            if ownership is None:
+                with span("coalesce_wait"):
+                    while ownership is None:
+                        try:
+                            result = await coalescer.follow(video_id, format_key, reporter.progress)
+                        except asyncio.TimeoutError:
+                            logger.warning(f"Чужая загрузка {video_id}/{format_key} не завершилась вовремя, скачиваем сами")
+                            break
+                        if result is not None:
+                            shared_result = result
+                            await deliver_shared_result(job, reporter, result)
+                            return
+                        ownership = await coalescer.acquire(video_id, format_key)
+
+        # Большой файл в этом формате уже лежит на хранилище
+        with span("storage_lookup"):
+            stored_url = await stored_object_url(video_id, format_key)
+        if stored_url:
+            logger.info(f"Файл уже на хранилище: {stored_url}")
+            shared_result = {"kind": "url", "url": stored_url}
+            await reporter.link(stored_url)
+            return
+
+        scheduled = download_scheduler.job(
+            on_wait=report_queue_position, key=job["user_id"], weight=job.get("weight", 1.0)
+        )
+        await scheduled.enter("download")
+
+        with span("download"):
+            stream_ext = await streamable_extension(url, format_config, job.get("estimated_size"))
+            if stream_ext:
+                # Файл уходит на хранилище по мере скачивания
+                stream_path = f"{base_filename}.{stream_ext}"
+                download_task = asyncio.create_task(
+                    download_media(url, format_config, base_filename, [progress_hook], job=scheduled)
+                )
+                name_for_digest = (
+                    (lambda content_hash: storage_object_name(video_id, format_key, content_hash, stream_path))
+                    if video_id else None
+                )
+                upload_task = asyncio.create_task(
+                    storage_client.upload_growing_file(stream_path, download_task, name_for_digest)
+                )
+                try:
+                    final_path = await download_task
+                except BaseException:
+                    upload_task.cancel()
+                    await asyncio.gather(upload_task, return_exceptions=True)
+                    raise
+                try:
+                    streamed_url, content_hash = await upload_task
+                except Exception as e:
+                    logger.warning(f"Потоковая выгрузка не удалась, файл будет загружен целиком: {e}")
+                if final_path != stream_path:
+                    streamed_url = None
+                elif streamed_url and video_id:
+                    await save_stored_object(
+                        storage_object_name(video_id, format_key, content_hash, stream_path),
+                        video_id, format_key, content_hash, os.path.getsize(final_path),
+                    )
+            else:
+                final_path = await download_media(url, format_config, base_filename, [progress_hook], job=scheduled)
 
         file_size = os.path.getsize(final_path)
         logger.info(f"Финальный путь: {final_path}, размер: {file_size} байт")
 
+        await scheduled.enter("upload")
+
         if file_size <= MAX_FILE_SIZE:
-            logger.info("Файл меньше 50 МБ, отправка напрямую.")
-            fs_file = types.FSInputFile(final_path)
-            if format_config['send_method'] == 'send_audio':
-                await message.answer_audio(fs_file)
-            elif format_config['send_method'] == 'send_video':
-                await message.answer_video(fs_file)
-            else:
-                await message.answer_document(fs_file)
+            logger.info("Файл в пределах лимита Telegram, отправка напрямую.")
+            with span("send", **{"send.method": format_config['send_method'], "file.bytes": file_size}):
+                sent = await send_media(chat_id, file_input(bot, final_path), format_config['send_method'])
+            await remember_file_id(video_id, format_key, format_config['send_method'], sent)
+            file_id = sent_file_id(sent)
+            if file_id:
+                shared_result = {"kind": "file_id", "file_id": file_id, "send_method": format_config['send_method']}
+            schedule_cache_warmup(url, video_id)
         else:
-            logger.info("Файл > 50 МБ. Загрузка на удаленное хранилище для получения ссылки.")
-            await status_message.edit_text("Загрузка большого файла на сервер...")
+            logger.info("Файл больше лимита Telegram. Загрузка на удаленное хранилище для получения ссылки.")
+            await reporter.progress("Загрузка большого файла на сервер...")
 
             try:
                 # 1. Загрузка на удаленное хранилище и получение URL
-                public_url = await storage_client.upload_file(final_path)
+                if streamed_url:
+                    public_url = streamed_url
+                else:
+                    with span("upload", **{"file.bytes": file_size}):
+                        public_url = await store_large_file(final_path, video_id, format_key)
                 logger.info(f"Файл загружен, получен URL: {public_url}")
+                shared_result = {"kind": "url", "url": public_url}
 
                 # 2. Отправка ссылки пользователю для отладки
-                await status_message.edit_text("Отправка ссылки на файл...")
-                await message.answer(
-                    f"Файл слишком большой для автоматической отправки.\n\n"
-                    f"Вы можете скачать его по прямой ссылке (отладочный режим):\n"
-                    f"{public_url}"
-                )
-                await status_message.delete()
+                await reporter.link(public_url)
 
             except Exception as e:
                 logger.error(f"Ошибка при обработке большого файла: {e}", exc_info=True)
-                await message.answer(f"Не удалось обработать большой файл. Ошибка: {e}")
+                if shared_result is None:
+                    shared_result = {"kind": "error", "error": f"Не удалось обработать большой файл. Ошибка: {e}"}
+                await reporter.error(f"Не удалось обработать большой файл. Ошибка: {e}")
                 # Ошибку не перевыбрасываем, чтобы выполнился блок finally для очистки,
                 # но пользователь уже уведомлен.
 
 
     except TelegramForbiddenError:
         logger.warning(f"Bot is blocked by user {user_id}. Aborting download process.")
-        await state.clear()
 
     except Exception as e:
         logger.error(f"Ошибка при скачивании/отправке: {e}", exc_info=True)
@@ -403,29 +1081,29 @@ async def process_download(message: types.Message, format_key: str, state: FSMCo
             error_message += "\n\n Видео доступно только для участников канала."
         elif "Copyright" in str(e):
             error_message += "\n\Видео содержит защищенный авторским правом контент."
+
+        if is_retryable_error(e):
+            # Результата нет: подписчики заберут загрузку себе, а задачу повторит очередь
+            retrying = True
+            raise RetryableJobError(error_message) from e
+
+        if shared_result is None:
+            shared_result = {"kind": "error", "error": error_message}
         
-        try:
-            await message.answer(error_message)
-        except TelegramForbiddenError:
-            logger.warning(f"Bot is blocked by user {user_id}. Could not send final error message.")
-        
-        await state.clear()
+        await reporter.error(error_message)
 
     finally:
-        
-        release_user_lock(user_id)
-        if final_path and os.path.exists(final_path):
-            try:
-                os.remove(final_path)
-                logger.info(f"Удален временный файл: {final_path}")
-            except Exception as e:
-                logger.warning(f"Ошибка при удалении {final_path}: {e}")
-        
-        temp_files = glob.glob(f"{base_filename}*")
-        for temp_file in temp_files:
-            if temp_file != final_path and os.path.exists(temp_file):
-                try:
-                    os.remove(temp_file)
-                    logger.info(f"Удален временный файл: {temp_file}")
-                except Exception as e:
-                    logger.warning(f"Ошибка удаления временного файла {temp_file}: {e}")
\ No newline at end of file
+        # Исход задачи: file_id - отправлено в Telegram, url - ссылка на хранилище
+        outcome = shared_result["kind"] if shared_result else "retry" if retrying else "aborted"
+        JOB_SECONDS.labels(outcome).observe(time.monotonic() - job_started)
+        if root_span is not None:
+            root_span.set_attribute("job.outcome", outcome)
+        if scheduled is not None:
+            await scheduled.close()
+        if ownership is not None:
+            # Без результата подписчики заберут загрузку себе
+            if shared_result is not None:
+                await ownership.finish(shared_result)
+            await ownership.release()
+        with span("cleanup"):
+            cleanup_temp_files(base_filename, final_path)
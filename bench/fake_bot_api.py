@@ -0,0 +1,88 @@
+"""
+Minimal stand-in for a local Bot API server (telegram-bot-api --local).
+
+Records every call and answers send* methods with a message carrying a
+generated file_id, which is enough to exercise the bot's delivery code.
+"""
+import itertools
+import time
+from typing import Callable, Optional
+
+from aiohttp import web
+
+MEDIA_FIELDS = {
+    "sendDocument": "document",
+    "sendVideo": "video",
+    "sendAudio": "audio",
+}
+
+
+class FakeBotAPI:
+    """
+    With keep_uploads=False uploaded files are only counted (their size is
+    recorded instead of the content); on_call is invoked for every call.
+    """
+
+    def __init__(self, keep_uploads: bool = True, on_call: Optional[Callable[[dict], None]] = None):
+        self.keep_uploads = keep_uploads
+        self.on_call = on_call
+        self.calls: list[dict] = []
+        self._ids = itertools.count(1)
+        self._runner: web.AppRunner | None = None
+        self.url: str | None = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        fields, uploads = {}, {}
+        if request.content_type.startswith("multipart/"):
+            reader = await request.multipart()
+            async for part in reader:
+                if part.filename and self.keep_uploads:
+                    uploads[part.name] = await part.read()
+                elif part.filename:
+                    size = 0
+                    while chunk := await part.read_chunk():
+                        size += len(chunk)
+                    uploads[part.name] = size
+                else:
+                    fields[part.name] = await part.text()
+        else:
+            fields = dict(await request.post())
+        call = {"method": method, "fields": fields, "uploads": uploads}
+        self.calls.append(call)
+        if self.on_call is not None:
+            self.on_call(call)
+
+        message_id = next(self._ids)
+        result = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(fields.get("chat_id", 0)), "type": "private"},
+        }
+        media_field = MEDIA_FIELDS.get(method)
+        if media_field:
+            result[media_field] = {
+                "file_id": f"fake-file-{message_id}",
+                "file_unique_id": f"fake-unique-{message_id}",
+                "duration": 0,
+                "width": 0,
+                "height": 0,
+            }
+        elif method not in ("sendMessage", "editMessageText"):
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application(client_max_size=2 * 1024 ** 3)
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
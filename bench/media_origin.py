@@ -0,0 +1,174 @@
+"""
+Local stand-in for YouTube: serves yt-dlp info dicts and synthetic media
+generated once with ffmpeg's lavfi sources.
+"""
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Потоки, похожие на DASH-форматы YouTube: отдельное видео каждой высоты и отдельный звук
+VIDEO_STREAMS = [
+    {"format_id": "160", "width": 256, "height": 144, "bitrate": "100k"},
+    {"format_id": "134", "width": 640, "height": 360, "bitrate": "700k"},
+    {"format_id": "136", "width": 1280, "height": 720, "bitrate": "2500k"},
+]
+AUDIO_STREAM = {"format_id": "140", "bitrate": "128k"}
+# Размер блока отдачи; после каждого блока соблюдается ограничение скорости
+CHUNK_SIZE = 64 * 1024
+
+
+async def _ffmpeg(*args: str):
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-y", "-loglevel", "error", *args,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {stderr.decode(errors='replace').strip()}")
+
+
+async def generate_media(media_dir: str, duration: int) -> dict[str, str]:
+    """Generates the streams (or reuses them from an earlier run) and returns format_id -> path."""
+    directory = os.path.join(media_dir, f"{duration}s")
+    os.makedirs(directory, exist_ok=True)
+    paths, jobs = {}, []
+
+    for stream in VIDEO_STREAMS:
+        path = os.path.join(directory, f"{stream['format_id']}.mp4")
+        paths[stream["format_id"]] = path
+        if not os.path.exists(path):
+            jobs.append(_ffmpeg(
+                "-f", "lavfi", "-i", f"testsrc2=size={stream['width']}x{stream['height']}:rate=25",
+                "-t", str(duration), "-an", "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+                "-b:v", stream["bitrate"], "-movflags", "+faststart", path,
+            ))
+
+    path = os.path.join(directory, f"{AUDIO_STREAM['format_id']}.m4a")
+    paths[AUDIO_STREAM["format_id"]] = path
+    if not os.path.exists(path):
+        jobs.append(_ffmpeg(
+            "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={duration}",
+            "-vn", "-c:a", "aac", "-b:a", AUDIO_STREAM["bitrate"], path,
+        ))
+
+    if jobs:
+        logger.info(f"Генерация тестовых медиа длительностью {duration} с в {directory}")
+        await asyncio.gather(*jobs)
+    return paths
+
+
+class MediaOrigin:
+    """
+    Serves /info/{video_id} (what yt-dlp would extract) and the media
+    behind it. Every video id maps to the same generated streams.
+    """
+
+    def __init__(self, media: dict[str, str], duration: int, rate: int = 0):
+        self.media = media
+        self.duration = duration
+        # Ограничение скорости отдачи одного файла в байтах в секунду (0 - без ограничения)
+        self.rate = rate
+        self.requests = 0
+        self.bytes_sent = 0
+        self._runner: Optional[web.AppRunner] = None
+        self.url: Optional[str] = None
+
+    def info(self, video_id: str) -> dict:
+        formats = [{
+            "format_id": AUDIO_STREAM["format_id"],
+            "url": f"{self.url}/media/{video_id}/{AUDIO_STREAM['format_id']}.m4a",
+            "ext": "m4a",
+            "protocol": "http",
+            "vcodec": "none",
+            "acodec": "mp4a.40.2",
+            "abr": int(AUDIO_STREAM["bitrate"][:-1]),
+            "filesize": os.path.getsize(self.media[AUDIO_STREAM["format_id"]]),
+        }]
+        for stream in VIDEO_STREAMS:
+            formats.append({
+                "format_id": stream["format_id"],
+                "url": f"{self.url}/media/{video_id}/{stream['format_id']}.mp4",
+                "ext": "mp4",
+                "protocol": "http",
+                "vcodec": "avc1.4d401e",
+                "acodec": "none",
+                "width": stream["width"],
+                "height": stream["height"],
+                "fps": 25,
+                "tbr": int(stream["bitrate"][:-1]),
+                "filesize": os.path.getsize(self.media[stream["format_id"]]),
+            })
+        webpage_url = f"https://www.youtube.com/watch?v={video_id}"
+        return {
+            "id": video_id,
+            "title": f"Bench video {video_id}",
+            "duration": self.duration,
+            "webpage_url": webpage_url,
+            "original_url": webpage_url,
+            "extractor": "generic",
+            "extractor_key": "Generic",
+            "formats": formats,
+        }
+
+    async def _handle_info(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        return web.json_response(self.info(request.match_info["video_id"]))
+
+    async def _handle_media(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        format_id = os.path.splitext(request.match_info["name"])[0]
+        path = self.media.get(format_id)
+        if path is None:
+            raise web.HTTPNotFound()
+        size = os.path.getsize(path)
+        # yt-dlp качает частями по http_chunk_size, поэтому нужна поддержка Range
+        requested = request.http_range
+        start = requested.start or 0
+        if start < 0:
+            start = max(0, size + start)
+        stop = min(size, requested.stop if requested.stop is not None else size)
+        if start >= stop:
+            raise web.HTTPRequestRangeNotSatisfiable(headers={"Content-Range": f"bytes */{size}"})
+
+        response = web.StreamResponse(headers={"Content-Type": "application/octet-stream", "Accept-Ranges": "bytes"})
+        if "Range" in request.headers:
+            response.set_status(206)
+            response.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+        response.content_length = stop - start
+        await response.prepare(request)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        sent = 0
+        with open(path, "rb") as f:
+            f.seek(start)
+            while sent < stop - start and (chunk := f.read(min(CHUNK_SIZE, stop - start - sent))):
+                await response.write(chunk)
+                sent += len(chunk)
+                self.bytes_sent += len(chunk)
+                if self.rate:
+                    delay = started + sent / self.rate - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+        await response.write_eof()
+        return response
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_get("/info/{video_id}", self._handle_info)
+        app.router.add_get("/media/{video_id}/{name}", self._handle_media)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
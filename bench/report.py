@@ -0,0 +1,57 @@
+import json
+import math
+from collections import defaultdict
+
+# Спаны фрагментов слишком мелкие и многочисленные для отчёта по этапам
+SKIPPED_SPANS = {"download_fragment"}
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile; 0 for an empty sample."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def stage_durations(trace_path: str) -> dict[str, list[float]]:
+    """
+    Reads a JSONL trace file and returns, per span name, one duration per
+    job: the total time the job spent in spans of that name.
+    """
+    per_job: dict[str, dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    with open(trace_path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            for item in record["spans"]:
+                if item["name"] in SKIPPED_SPANS:
+                    continue
+                duration = (item["endTimeUnixNano"] - item["startTimeUnixNano"]) / 1e9
+                per_job[record["traceId"]][item["name"]] += duration
+
+    stages: dict[str, list[float]] = defaultdict(list)
+    for durations in per_job.values():
+        for name, seconds in durations.items():
+            stages[name].append(seconds)
+    return dict(stages)
+
+
+def summarize(samples: dict[str, list[float]]) -> dict[str, dict[str, float]]:
+    return {
+        name: {
+            "count": len(values),
+            **{f"p{round(q * 100)}": percentile(values, q) for q in QUANTILES},
+            "max": max(values) if values else 0.0,
+        }
+        for name, values in samples.items()
+    }
+
+
+def format_table(title: str, summary: dict[str, dict[str, float]]) -> str:
+    lines = [title, f"{'':<22}{'count':>7}{'p50, s':>10}{'p95, s':>10}{'p99, s':>10}{'max, s':>10}"]
+    for name, row in sorted(summary.items(), key=lambda item: -item[1]["p50"]):
+        lines.append(
+            f"{name:<22}{row['count']:>7}{row['p50']:>10.3f}{row['p95']:>10.3f}{row['p99']:>10.3f}{row['max']:>10.3f}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,256 @@
+"""
+Offline end-to-end load benchmark.
+
+Starts a YouTube-like media origin with ffmpeg-generated media, a fake Bot
+API server and a local SFTP server, then drives the real handlers from
+handlers/bot.py with N concurrent simulated users. Each user sends a link,
+waits for the format menu and picks a format. Reports p50/p95/p99 per stage
+(from the job traces) and overall throughput.
+
+Needs ffmpeg, Redis and Postgres (e.g. `docker compose up -d db redis`);
+DB_DSN and REDIS_HOST/REDIS_PORT come from the environment or .env.
+Downloads run in this process (DISPATCH_MODE=local). Run from the repo root:
+
+    python -m bench.run --users 20 --jobs-per-user 3 --formats mp3,360,720
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import secrets
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+import aiohttp
+
+from bench.fake_bot_api import MEDIA_FIELDS, FakeBotAPI
+from bench.media_origin import MediaOrigin, generate_media
+from bench.report import format_table, stage_durations, summarize
+from bench.sftp_server import start_sftp_server, stored_bytes
+
+logger = logging.getLogger("bench")
+
+# Id симулируемых пользователей, чтобы не пересекаться с настоящими
+BENCH_USER_BASE = 900_000_000
+STORAGE_URL_PREFIX = "http://storage.bench/"
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10, help="concurrent simulated users")
+    parser.add_argument("--jobs-per-user", type=int, default=3, help="downloads each user requests in turn")
+    parser.add_argument("--videos", type=int, default=5, help="distinct video ids shared by all users")
+    parser.add_argument("--formats", default="mp3,360,720", help="format commands users pick in turn")
+    parser.add_argument("--duration", type=int, default=30, help="length of the generated media, seconds")
+    parser.add_argument("--origin-rate", type=int, default=0, help="origin speed per request, KiB/s (0 - unlimited)")
+    parser.add_argument(
+        "--upload-limit", type=int, default=8 * 1024 * 1024,
+        help="TELEGRAM_UPLOAD_LIMIT for the run; bigger files go to the SFTP storage",
+    )
+    parser.add_argument("--timeout", type=float, default=600, help="limit for one job, seconds")
+    parser.add_argument(
+        "--media-dir", default=os.path.join(tempfile.gettempdir(), "ytbot-bench-media"),
+        help="cache of generated media between runs",
+    )
+    parser.add_argument("--work-dir", default=None, help="downloads, storage and traces (default: temp dir)")
+    parser.add_argument("--keep", action="store_true", help="keep the work dir after the run")
+    parser.add_argument("--output", default=None, help="write the results as JSON to this file")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args: argparse.Namespace, work_dir: str, bot_api_url: str, sftp_port: int):
+    """Points the bot at the local servers; must run before the bot modules are imported."""
+    os.environ.update({
+        "TELEGRAM_API_URL": bot_api_url,
+        "TELEGRAM_UPLOAD_LIMIT": str(args.upload_limit),
+        "DOWNLOAD_DIR": os.path.join(work_dir, "downloads"),
+        "STORAGE_HOST": "127.0.0.1",
+        "STORAGE_PORT": str(sftp_port),
+        "STORAGE_USER": "bench",
+        "STORAGE_PASSWORD": "bench",
+        "STORAGE_PRIVATE_KEY_PATH": "",
+        "STORAGE_PATH": "/",
+        "STORAGE_PUBLIC_URL_PREFIX": STORAGE_URL_PREFIX,
+        "TRACE_FILE": os.path.join(work_dir, "traces.jsonl"),
+        "TRACE_MAX_BYTES": "0",
+        "REQUIRED_CHANNELS": "",
+        "CACHE_WARM_FORMATS": "",
+        "DISPATCH_MODE": "local",
+        "METRICS_PORT": "0",
+    })
+    os.environ.setdefault("TOKEN", "123456:bench")
+    os.environ.setdefault("ADMIN_CHAT_ID", "1")
+    os.environ.setdefault("ADMIN_USER_ID", "1")
+    # Файлы уходят в фейковый Bot API телом запроса, как в api.telegram.org
+    os.environ.setdefault("TELEGRAM_SEND_STRATEGY", "upload")
+
+
+def message_update(update_id: int, user_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"bench{user_id}"},
+            "text": text,
+        },
+    }
+
+
+def job_outcome(calls: list[dict]) -> str:
+    """How a job ended, judging by the Bot API calls made to the user's chat."""
+    for call in calls:
+        if call["method"] in MEDIA_FIELDS:
+            return "file"
+        if call["method"] == "sendMessage" and STORAGE_URL_PREFIX in call["fields"].get("text", ""):
+            return "url"
+    return "error"
+
+
+async def run(args: argparse.Namespace) -> dict:
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="ytbot-bench-")
+    os.makedirs(work_dir, exist_ok=True)
+    storage_root = os.path.join(work_dir, "storage")
+
+    media = await generate_media(args.media_dir, args.duration)
+    origin = MediaOrigin(media, args.duration, args.origin_rate * 1024)
+    await origin.start()
+    calls_by_chat: dict[int, list[dict]] = defaultdict(list)
+    bot_api = FakeBotAPI(keep_uploads=False, on_call=lambda call: calls_by_chat[
+        int(call["fields"].get("chat_id", 0))
+    ].append(call))
+    await bot_api.start()
+    sftp_server, sftp_port = await start_sftp_server(storage_root)
+    configure_environment(args, work_dir, bot_api.url, sftp_port)
+
+    # Модули бота читают конфигурацию при импорте, поэтому импортируются после настройки окружения
+    import audio
+    from clients.storage_client import storage_client
+    from config import USER_ACTIVITY_FLUSH_INTERVAL
+    from main import dp
+    from metadata_cache import extract_video_id
+
+    session = aiohttp.ClientSession()
+
+    async def extract_from_origin(url: str) -> dict:
+        # Экстракция идёт к локальному источнику, дальше конвейер работает как с YouTube
+        async with session.get(f"{origin.url}/info/{extract_video_id(url)}") as response:
+            response.raise_for_status()
+            return await response.json()
+
+    audio._extract_video_info = extract_from_origin
+
+    await audio.db.connect()
+    await audio.db.init_db()
+    await storage_client.warm_up()
+    activity_flusher = asyncio.create_task(audio.user_actioner.run_flusher(USER_ACTIVITY_FLUSH_INTERVAL))
+
+    # Новые id видео в каждом запуске: кэши метаданных и file_id от прошлых запусков не срабатывают
+    run_tag = secrets.token_hex(3)[:5]
+    video_ids = [f"{run_tag}{index:06d}" for index in range(args.videos)]
+    formats = [key.strip() for key in args.formats.split(",") if key.strip()]
+    update_ids = itertools.count(1)
+    menu_latency, job_latency = [], []
+    outcomes = Counter()
+
+    async def send(user_id: int, text: str):
+        # Обработчик выполняется до конца, включая скачивание и доставку
+        await dp.feed_raw_update(audio.bot, message_update(next(update_ids), user_id, text))
+
+    async def simulate_user(index: int):
+        user_id = BENCH_USER_BASE + index
+        for number in range(args.jobs_per_user):
+            job_index = index * args.jobs_per_user + number
+            video_id = video_ids[job_index % len(video_ids)]
+            format_key = formats[job_index % len(formats)]
+
+            started = time.monotonic()
+            await send(user_id, f"https://www.youtube.com/watch?v={video_id}")
+            menu_latency.append(time.monotonic() - started)
+
+            first_call = len(calls_by_chat[user_id])
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(send(user_id, f"/{format_key}"), args.timeout)
+            except Exception as e:
+                logger.error(f"Задача {video_id}/{format_key} пользователя {user_id} не завершилась: {e!r}")
+                outcomes["failed"] += 1
+                continue
+            job_latency.append(time.monotonic() - started)
+            outcomes[job_outcome(calls_by_chat[user_id][first_call:])] += 1
+
+    logger.info(f"Старт: {args.users} пользователей по {args.jobs_per_user} загрузки, форматы {formats}")
+    started = time.monotonic()
+    try:
+        await asyncio.gather(*(simulate_user(index) for index in range(args.users)))
+        wall_time = time.monotonic() - started
+    finally:
+        activity_flusher.cancel()
+        await audio.user_actioner.flush()
+        await audio.telegram_governor.close()
+        if audio.ytdlp_pool is not None:
+            await audio.ytdlp_pool.close()
+        await storage_client.close()
+        await audio.db.close()
+        await audio.bot.session.close()
+        await session.close()
+        sftp_server.close()
+        await origin.stop()
+        await bot_api.stop()
+
+    telegram_bytes = sum(
+        size for calls in calls_by_chat.values() for call in calls for size in call["uploads"].values()
+    )
+    storage_bytes = stored_bytes(storage_root)
+    completed = sum(count for outcome, count in outcomes.items() if outcome != "failed")
+    results = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("work_dir", "keep", "output")},
+        "wall_seconds": wall_time,
+        "jobs": dict(outcomes),
+        "jobs_per_second": completed / wall_time if wall_time else 0.0,
+        "origin_bytes": origin.bytes_sent,
+        "telegram_upload_bytes": telegram_bytes,
+        "storage_bytes": storage_bytes,
+        "delivered_mib_per_second": (telegram_bytes + storage_bytes) / 1024 ** 2 / wall_time if wall_time else 0.0,
+        "client": summarize({"link -> menu": menu_latency, "format -> delivery": job_latency}),
+        "stages": summarize(stage_durations(os.environ["TRACE_FILE"])),
+    }
+    if not args.keep and not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def print_report(results: dict):
+    print(f"Время прогона: {results['wall_seconds']:.1f} с, задачи: {results['jobs']}")
+    print(
+        f"Пропускная способность: {results['jobs_per_second']:.2f} задач/с, "
+        f"{results['delivered_mib_per_second']:.1f} МиБ/с доставлено "
+        f"(Telegram {results['telegram_upload_bytes'] / 1024 ** 2:.1f} МиБ, "
+        f"хранилище {results['storage_bytes'] / 1024 ** 2:.1f} МиБ, "
+        f"скачано с источника {results['origin_bytes'] / 1024 ** 2:.1f} МиБ)"
+    )
+    print()
+    print(format_table("Задержки глазами пользователя", results["client"]))
+    print()
+    print(format_table("Этапы по трассам задач", results["stages"]))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    logger.setLevel(logging.INFO)
+    results = asyncio.run(run(args))
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
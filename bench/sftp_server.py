@@ -0,0 +1,34 @@
+"""Local SFTP server for the storage client, rooted in a scratch directory."""
+import os
+
+import asyncssh
+
+
+class _AnyPasswordServer(asyncssh.SSHServer):
+    def begin_auth(self, username: str) -> bool:
+        return True
+
+    def password_auth_supported(self) -> bool:
+        return True
+
+    def validate_password(self, username: str, password: str) -> bool:
+        return True
+
+
+async def start_sftp_server(root: str, host: str = "127.0.0.1", port: int = 0) -> tuple[asyncssh.SSHAcceptor, int]:
+    """Starts the server; any user name and password are accepted. Returns the acceptor and its port."""
+    os.makedirs(root, exist_ok=True)
+    acceptor = await asyncssh.listen(
+        host, port,
+        server_factory=_AnyPasswordServer,
+        server_host_keys=[asyncssh.generate_private_key("ssh-ed25519")],
+        sftp_factory=lambda chan: asyncssh.SFTPServer(chan, chroot=root.encode()),
+    )
+    return acceptor, acceptor.sockets[0].getsockname()[1]
+
+
+def stored_bytes(root: str) -> int:
+    total = 0
+    for directory, _, files in os.walk(root):
+        total += sum(os.path.getsize(os.path.join(directory, name)) for name in files)
+    return total
@@ -0,0 +1,49 @@
+from datetime import datetime
+from typing import Optional
+from clients.pg_client import AsyncPostgresClient
+
+import logging
+
+GET_FILE_ID = """
+    SELECT file_id FROM file_cache WHERE video_id = $1 AND format_key = $2;
+"""
+
+UPSERT_FILE_ID = """
+    INSERT INTO file_cache (video_id, format_key, file_id, send_method, created_date)
+    VALUES ($1, $2, $3, $4, $5)
+    ON CONFLICT (video_id, format_key) DO UPDATE
+    SET file_id = EXCLUDED.file_id, send_method = EXCLUDED.send_method, created_date = EXCLUDED.created_date;
+"""
+
+DELETE_FILE_ID = """
+    DELETE FROM file_cache WHERE video_id = $1 AND format_key = $2;
+"""
+
+logger = logging.getLogger(__name__)
+
+class AsyncFileCacheActioner:
+    """Stores Telegram file_ids of already delivered files keyed by (video_id, format_key)."""
+
+    def __init__(self, db: AsyncPostgresClient):
+        self.db = db
+        self.db.register_statements(get_file_id=GET_FILE_ID)
+
+    async def get_file_id(self, video_id: str, format_key: str) -> Optional[str]:
+        result = await self.db.fetch(GET_FILE_ID, (video_id, format_key))
+        if not result:
+            return None
+        return result[0]["file_id"]
+
+    async def save_file_id(self, video_id: str, format_key: str, file_id: str, send_method: str, created_date: datetime) -> None:
+        logger.info(f"Сохранение file_id: {video_id}/{format_key}")
+        await self.db.execute(UPSERT_FILE_ID, (
+            video_id,
+            format_key,
+            file_id,
+            send_method,
+            int(created_date.timestamp())
+        ))
+
+    async def delete_file_id(self, video_id: str, format_key: str) -> None:
+        logger.info(f"Удаление file_id: {video_id}/{format_key}")
+        await self.db.execute(DELETE_FILE_ID, (video_id, format_key))
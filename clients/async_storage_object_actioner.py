@@ -0,0 +1,109 @@
+from datetime import datetime
+from typing import List, Optional
+from clients.pg_client import AsyncPostgresClient
+
+import asyncpg
+import logging
+
+GET_LATEST_OBJECT = """
+    SELECT remote_name, content_hash, size FROM storage_objects
+    WHERE video_id = $1 AND format_key = $2 AND created_date >= $3
+    ORDER BY created_date DESC LIMIT 1;
+"""
+
+GET_OBJECT = """
+    SELECT remote_name, content_hash, size FROM storage_objects WHERE remote_name = $1;
+"""
+
+UPSERT_OBJECT = """
+    INSERT INTO storage_objects (remote_name, video_id, format_key, content_hash, size, created_date, last_access_date)
+    VALUES ($1, $2, $3, $4, $5, $6, $6)
+    ON CONFLICT (remote_name) DO UPDATE
+    SET size = EXCLUDED.size, created_date = EXCLUDED.created_date, last_access_date = EXCLUDED.last_access_date;
+"""
+
+TOUCH_OBJECT = """
+    UPDATE storage_objects SET last_access_date = $2 WHERE remote_name = $1;
+"""
+
+GET_EXPIRED_OBJECTS = """
+    SELECT remote_name, size FROM storage_objects
+    WHERE created_date < $1 AND last_access_date < $2
+    ORDER BY created_date LIMIT $3;
+"""
+
+# Наименее давно использованные объекты, пока их суммарный размер не покроет превышение квоты
+GET_EVICTION_CANDIDATES = """
+    SELECT remote_name, size FROM (
+        SELECT remote_name, size, last_access_date,
+               SUM(size) OVER (ORDER BY last_access_date, remote_name) - size AS freed_before
+        FROM storage_objects
+        WHERE last_access_date < $1
+    ) candidates
+    WHERE freed_before < $2
+    ORDER BY last_access_date
+    LIMIT $3;
+"""
+
+GET_KNOWN_NAMES = """
+    SELECT remote_name FROM storage_objects WHERE remote_name = ANY($1::varchar[]);
+"""
+
+GET_STATS = """
+    SELECT COUNT(*) AS objects, COALESCE(SUM(size), 0)::bigint AS total_size,
+           MIN(created_date) AS oldest_created, MIN(last_access_date) AS oldest_access
+    FROM storage_objects;
+"""
+
+DELETE_OBJECTS = """
+    DELETE FROM storage_objects WHERE remote_name = ANY($1::varchar[]);
+"""
+
+logger = logging.getLogger(__name__)
+
+class AsyncStorageObjectActioner:
+    """Index of content-addressed files on the storage host keyed by (video_id, format_key)."""
+
+    def __init__(self, db: AsyncPostgresClient):
+        self.db = db
+
+    async def get_latest(self, video_id: str, format_key: str, created_after: datetime) -> Optional[asyncpg.Record]:
+        result = await self.db.fetch(GET_LATEST_OBJECT, (video_id, format_key, int(created_after.timestamp())))
+        return result[0] if result else None
+
+    async def get_object(self, remote_name: str) -> Optional[asyncpg.Record]:
+        result = await self.db.fetch(GET_OBJECT, (remote_name,))
+        return result[0] if result else None
+
+    async def save_object(self, remote_name: str, video_id: str, format_key: str, content_hash: str, size: int, created_date: datetime) -> None:
+        logger.info(f"Сохранение объекта хранилища: {remote_name}")
+        await self.db.execute(UPSERT_OBJECT, (
+            remote_name,
+            video_id,
+            format_key,
+            content_hash,
+            size,
+            int(created_date.timestamp())
+        ))
+
+    async def touch(self, remote_name: str, accessed_date: datetime) -> None:
+        await self.db.execute(TOUCH_OBJECT, (remote_name, int(accessed_date.timestamp())))
+
+    async def get_expired(self, created_before: datetime, accessed_before: datetime, limit: int) -> List[asyncpg.Record]:
+        return await self.db.fetch(
+            GET_EXPIRED_OBJECTS, (int(created_before.timestamp()), int(accessed_before.timestamp()), limit)
+        )
+
+    async def get_eviction_candidates(self, bytes_to_free: int, accessed_before: datetime, limit: int) -> List[asyncpg.Record]:
+        return await self.db.fetch(GET_EVICTION_CANDIDATES, (int(accessed_before.timestamp()), bytes_to_free, limit))
+
+    async def get_known_names(self, remote_names: List[str]) -> set[str]:
+        result = await self.db.fetch(GET_KNOWN_NAMES, (remote_names,))
+        return {row["remote_name"] for row in result}
+
+    async def get_stats(self) -> asyncpg.Record:
+        return (await self.db.fetch(GET_STATS, ()))[0]
+
+    async def delete_objects(self, remote_names: List[str]) -> None:
+        logger.info(f"Удаление {len(remote_names)} объектов хранилища из индекса")
+        await self.db.execute(DELETE_OBJECTS, (remote_names,))
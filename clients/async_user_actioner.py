@@ -1,7 +1,10 @@
 from datetime import datetime
 from typing import Optional, Dict, Any
 from clients.pg_client import AsyncPostgresClient
+from lru_cache import LRUCache
 
+import asyncio
+import json
 import logging
 
 GET_USER = """
@@ -14,28 +17,101 @@ INSERT_USER = """
     ON CONFLICT (user_id) DO NOTHING;
 """
 
-UPDATE_DATE = """
-    UPDATE users SET last_updated_date = $1 WHERE user_id = $2;
+UPDATE_DATES = """
+    UPDATE users SET last_updated_date = data.last_updated_date
+    FROM unnest($1::bigint[], $2::bigint[]) AS data(user_id, last_updated_date)
+    WHERE users.user_id = data.user_id;
 """
 
+# Отметка "пользователя нет" в кэшах
+MISSING = b"-"
+
 logger = logging.getLogger(__name__)
 
 class AsyncUserActioner:
-    def __init__(self, db: AsyncPostgresClient):
+    """
+    Users table access with a cache in front of get_user: an in-process LRU,
+    then an optional Redis tier shared between instances. Unknown users are
+    cached only for a short negative TTL. Cached users may carry a stale
+    last_updated_date.
+
+    Activity timestamps from update_date are buffered and written in batches
+    by flush(); run_flusher() does that periodically.
+    """
+
+    def __init__(
+        self,
+        db: AsyncPostgresClient,
+        redis=None,
+        cache_size: int = 10000,
+        cache_ttl: int = 3600,
+        negative_ttl: int = 10,
+    ):
         self.db = db
+        self.db.register_statements(get_user=GET_USER, insert_user=INSERT_USER, update_dates=UPDATE_DATES)
+        self.redis = redis
+        self.cache_ttl = cache_ttl
+        self.negative_ttl = negative_ttl
+        self.local = LRUCache(cache_size)
+        self._pending_dates: dict[int, int] = {}
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"user:{user_id}"
+
+    async def _get_shared(self, user_id: int) -> Optional[bytes]:
+        if self.redis is None:
+            return None
+        try:
+            return await self.redis.get(self._key(user_id))
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать кэш пользователя {user_id}: {e}")
+            return None
+
+    async def _remember(self, user_id: int, user: Optional[Dict[str, Any]]):
+        ttl = self.cache_ttl if user is not None else self.negative_ttl
+        self.local.set(user_id, user if user is not None else MISSING, ttl)
+        if self.redis is None:
+            return
+        if user is not None:
+            value = json.dumps(dict(user, last_updated_date=int(user["last_updated_date"].timestamp())))
+        else:
+            value = MISSING
+        try:
+            await self.redis.set(self._key(user_id), value, ex=ttl)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить кэш пользователя {user_id}: {e}")
 
     async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        cached = self.local.get(user_id)
+        if cached is not None:
+            return None if cached == MISSING else cached
+
+        shared = await self._get_shared(user_id)
+        if shared is not None:
+            if shared == MISSING:
+                user = None
+            else:
+                user = json.loads(shared)
+                user["last_updated_date"] = datetime.fromtimestamp(user["last_updated_date"])
+            ttl = self.cache_ttl if user is not None else self.negative_ttl
+            self.local.set(user_id, user if user is not None else MISSING, ttl)
+            return user
+
         result = await self.db.fetch(GET_USER, (user_id,))
         if not result:
-            logger.info(f"Пользователь {user_id} не найден")
+            logger.debug(f"Пользователь {user_id} не найден")
+            await self._remember(user_id, None)
             return None
         row = result[0]
-        return {
+        user = {
             "user_id": row["user_id"],
             "username": row["username"],
             "chat_id": row["chat_id"],
             "last_updated_date": datetime.fromtimestamp(row["last_updated_date"])
         }
+        await self._remember(user_id, user)
+        return user
 
     async def create_user(self, user_id: int, username: str, chat_id: int, last_updated_date: datetime) -> None:
         logger.info(f"Создание пользователя: id={user_id}")
@@ -45,8 +121,38 @@ class AsyncUserActioner:
             chat_id, 
             int(last_updated_date.timestamp())
     ))
+        # Сбрасываем отрицательную запись, чтобы пользователь сразу считался известным
+        await self._remember(user_id, {
+            "user_id": user_id,
+            "username": username,
+            "chat_id": chat_id,
+            "last_updated_date": last_updated_date,
+        })
 
     async def update_date(self, user_id: int, update_date: datetime) -> None:
-        logger.info(f"Обновление времени пользователя {user_id} -> {update_date.isoformat()}")
-        await self.db.execute(UPDATE_DATE, (int(update_date.timestamp()), user_id))
+        logger.debug(f"Обновление времени пользователя {user_id} -> {update_date.isoformat()}")
+        timestamp = int(update_date.timestamp())
+        self._pending_dates[user_id] = max(timestamp, self._pending_dates.get(user_id, timestamp))
+
+    async def flush(self) -> None:
+        """Writes all buffered activity timestamps with a single UPDATE."""
+        if not self._pending_dates:
+            return
+        pending, self._pending_dates = self._pending_dates, {}
+        try:
+            await self.db.execute(UPDATE_DATES, (list(pending), list(pending.values())))
+            logger.info(f"Обновлено время активности {len(pending)} пользователей")
+        except BaseException:
+            # Возвращаем неотправленное в буфер, не затирая более свежие отметки
+            for user_id, timestamp in pending.items():
+                self._pending_dates[user_id] = max(timestamp, self._pending_dates.get(user_id, timestamp))
+            raise
+
+    async def run_flusher(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи времени активности пользователей: {e}")
 
@@ -1,10 +1,13 @@
 from asyncpg import Pool
+from asyncpg.prepared_stmt import PreparedStatement
 import asyncpg
 
 import asyncio
+import bisect
 import logging
+import time
 
-from typing import Optional, List, Tuple, Any
+from typing import Optional, List, Tuple, Any, Dict
 
 logger = logging.getLogger(__name__)
 
@@ -17,17 +20,132 @@ CREATE_QUERY = """
     );
 """
 
+CREATE_FILE_CACHE_QUERY = """
+    CREATE TABLE IF NOT EXISTS file_cache (
+        video_id varchar not null,
+        format_key varchar not null,
+        file_id varchar not null,
+        send_method varchar not null,
+        created_date bigint not null,
+        PRIMARY KEY (video_id, format_key)
+    );
+"""
+
+CREATE_STORAGE_OBJECTS_QUERY = """
+    CREATE TABLE IF NOT EXISTS storage_objects (
+        remote_name varchar PRIMARY KEY,
+        video_id varchar not null,
+        format_key varchar not null,
+        content_hash varchar not null,
+        size bigint not null,
+        created_date bigint not null
+    );
+    CREATE INDEX IF NOT EXISTS storage_objects_video_format_idx ON storage_objects (video_id, format_key);
+    ALTER TABLE storage_objects ADD COLUMN IF NOT EXISTS last_access_date bigint not null default 0;
+    CREATE INDEX IF NOT EXISTS storage_objects_last_access_idx ON storage_objects (last_access_date);
+"""
+
+# Границы корзин гистограмм задержек, в секундах
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float("inf"))
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (bucket bounds match LATENCY_BUCKETS)."""
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th observation."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, bucket in zip(LATENCY_BUCKETS, self.buckets):
+            seen += bucket
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+def _query_label(query: str) -> str:
+    return " ".join(query.split())[:60]
+
+
 class AsyncPostgresClient:
-    def __init__(self, dsn: str):
+    """
+    asyncpg pool wrapper. Records per-query latency and pool saturation, and
+    runs the fixed queries registered with register_statements() through
+    statements prepared once per pooled connection.
+    """
+
+    def __init__(self, dsn: str, min_size: int = 2, max_size: int = 10, statement_cache_size: int = 100):
         self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max(min_size, max_size)
+        self.statement_cache_size = statement_cache_size
         self.pool: Optional[Pool] = None
+        self._statements: Dict[str, str] = {}
+        # Подготовленные запросы по pid серверного процесса соединения
+        self._prepared: Dict[int, Dict[str, PreparedStatement]] = {}
+        self._schema_ready = False
+        self.query_latency: Dict[str, LatencyHistogram] = {}
+        self.acquire_latency = LatencyHistogram()
+        # Сколько раз соединение запрашивалось, когда свободных не было и пул достиг максимума
+        self.saturated_acquires = 0
+
+    def register_statements(self, **statements: str):
+        """Registers fixed queries by name; they are prepared on each connection."""
+        self._statements.update({query: name for name, query in statements.items()})
+
+    async def _prepared_statement(self, conn: asyncpg.Connection, query: str) -> Optional[PreparedStatement]:
+        """The connection's prepared statement for a registered query, prepared on first use."""
+        if query not in self._statements:
+            return None
+        prepared = self._prepared.setdefault(conn.get_server_pid(), {})
+        statement = prepared.get(query)
+        if statement is None:
+            statement = prepared[query] = await conn.prepare(query)
+        return statement
+
+    async def _prepare_statements(self, conn: asyncpg.Connection):
+        for query in self._statements:
+            await self._prepared_statement(conn, query)
+
+    async def _init_connection(self, conn: asyncpg.Connection):
+        # Новое соединение может получить pid закрытого, его запросы не переиспользуются
+        pid = conn.get_server_pid()
+        self._prepared.pop(pid, None)
+        # После закрытия pid соединения уже недоступен, поэтому он запоминается здесь
+        conn.add_termination_listener(lambda _: self._prepared.pop(pid, None))
+        if not self._schema_ready:
+            return
+        try:
+            await self._prepare_statements(conn)
+        except Exception as e:
+            logger.warning(f"Failed to prepare statements on a new connection: {e}")
 
     async def connect(self, retries: int = 5):
         delay = 1
         for attempt in range(retries):
             try:
-                self.pool = await asyncpg.create_pool(self.dsn)
-                logger.info("Connected to Postgres")
+                self.pool = await asyncpg.create_pool(
+                    self.dsn,
+                    min_size=self.min_size,
+                    max_size=self.max_size,
+                    statement_cache_size=self.statement_cache_size,
+                    init=self._init_connection,
+                )
+                logger.info(f"Connected to Postgres (pool {self.min_size}-{self.max_size})")
                 return
             except Exception as e:
                 logger.warning(f"Failed to connect to DB (attempt {attempt+1}/{retries}): {e}")
@@ -37,16 +155,74 @@ class AsyncPostgresClient:
 
     async def init_db(self):
         await self.execute(CREATE_QUERY, ())
+        await self.execute(CREATE_FILE_CACHE_QUERY, ())
+        await self.execute(CREATE_STORAGE_OBJECTS_QUERY, ())
+        self._schema_ready = True
+
+    async def warm_up(self):
+        """Prepares the registered statements on min_size connections at once."""
+        connections = [await self.pool.acquire() for _ in range(self.min_size)]
+        try:
+            await asyncio.gather(*(self._prepare_statements(conn) for conn in connections))
+        finally:
+            for conn in connections:
+                await self.pool.release(conn)
+        logger.info(f"Prepared {len(self._statements)} statements on {len(connections)} connections")
 
     async def close(self):
         if self.pool:
             await self.pool.close()
 
+    def _observe(self, query: str, seconds: float):
+        label = self._statements.get(query) or _query_label(query)
+        histogram = self.query_latency.get(label)
+        if histogram is None:
+            histogram = self.query_latency[label] = LatencyHistogram()
+        histogram.observe(seconds)
+
+    async def _acquire(self):
+        if self.pool.get_idle_size() == 0 and self.pool.get_size() >= self.max_size:
+            self.saturated_acquires += 1
+        started = time.perf_counter()
+        conn = await self.pool.acquire()
+        self.acquire_latency.observe(time.perf_counter() - started)
+        return conn
+
     async def fetch(self, query: str, params: Tuple[Any, ...]) -> List[asyncpg.Record]:
-        async with self.pool.acquire() as conn:
+        conn = await self._acquire()
+        started = time.perf_counter()
+        try:
+            statement = await self._prepared_statement(conn, query)
+            if statement is not None:
+                return await statement.fetch(*params)
             return await conn.fetch(query, *params)
+        finally:
+            self._observe(query, time.perf_counter() - started)
+            await self.pool.release(conn)
 
     async def execute(self, query: str, params: Tuple[Any, ...]) -> None:
-        async with self.pool.acquire() as conn:
-            await conn.execute(query, *params)
+        conn = await self._acquire()
+        started = time.perf_counter()
+        try:
+            statement = await self._prepared_statement(conn, query)
+            if statement is not None:
+                await statement.fetch(*params)
+            else:
+                await conn.execute(query, *params)
+        finally:
+            self._observe(query, time.perf_counter() - started)
+            await self.pool.release(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool and latency figures for the admin report."""
+        pool = {}
+        if self.pool is not None:
+            size, idle = self.pool.get_size(), self.pool.get_idle_size()
+            pool = {"size": size, "idle": idle, "in_use": size - idle, "min": self.min_size, "max": self.max_size}
+        return {
+            "pool": pool,
+            "saturated_acquires": self.saturated_acquires,
+            "acquire": self.acquire_latency,
+            "queries": dict(self.query_latency),
+        }
 
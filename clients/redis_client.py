@@ -0,0 +1,20 @@
+import time
+
+import redis.asyncio as redis
+
+from config import REDIS_HOST, REDIS_PORT
+from metrics import REDIS_COMMAND_SECONDS
+
+
+class InstrumentedRedis(redis.Redis):
+    """Redis client that records the latency of every command by name."""
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            REDIS_COMMAND_SECONDS.labels(str(args[0]).upper()).observe(time.perf_counter() - started)
+
+
+redis_client = InstrumentedRedis(host=REDIS_HOST, port=REDIS_PORT, db=0)
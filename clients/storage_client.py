@@ -1,5 +1,10 @@
+import asyncio
 import asyncssh
+import hashlib
 import os
+import time
+from contextlib import asynccontextmanager
+from typing import Callable
 from urllib.parse import urljoin
 import logging
 
@@ -10,11 +15,140 @@ from config import (
     STORAGE_PASSWORD,
     STORAGE_PRIVATE_KEY_PATH,
     STORAGE_PATH,
-    STORAGE_PUBLIC_URL_PREFIX
+    STORAGE_PUBLIC_URL_PREFIX,
+    STORAGE_POOL_SIZE,
+    STORAGE_CHANNELS_PER_CONNECTION,
+    STORAGE_BLOCK_SIZE,
+    STORAGE_MAX_REQUESTS,
+    STORAGE_UPLOAD_RETRIES,
 )
+from metrics import STORAGE_UPLOAD_BYTES, STORAGE_UPLOAD_SECONDS
 
 logger = logging.getLogger(__name__)
 
+CONNECT_RETRIES = 5
+MAX_BACKOFF = 30
+# Размер блока и период опроса при выгрузке файла, который ещё скачивается
+STREAM_CHUNK_SIZE = 1024 * 1024
+STREAM_POLL_INTERVAL = 0.5
+
+
+class StreamingUploadError(Exception):
+    """Raised when a file changed in a way that cannot be streamed incrementally."""
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(STORAGE_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class _AckedPrefix:
+    """
+    Offset below which every written block has been acknowledged. Blocks
+    are written concurrently and may complete out of order; blocks past a
+    gap are remembered until the gap is filled.
+    """
+
+    def __init__(self, offset: int = 0):
+        self.offset = offset
+        self._acked: dict[int, int] = {}
+
+    def ack(self, offset: int, length: int):
+        self._acked[offset] = length
+        while self.offset in self._acked:
+            self.offset += self._acked.pop(self.offset)
+
+
+class _ConnectionWatcher(asyncssh.SSHClient):
+    """Marks a pooled connection as dead once asyncssh reports it lost."""
+
+    def __init__(self):
+        self.closed = False
+
+    def connection_lost(self, exc):
+        self.closed = True
+        if exc:
+            logger.warning(f"Storage connection lost: {exc}")
+
+
+class _PooledConnection:
+    def __init__(self):
+        self.conn: asyncssh.SSHClientConnection | None = None
+        self.watcher: _ConnectionWatcher | None = None
+        self.idle_sftp: list[asyncssh.SFTPClient] = []
+        self.active = 0
+        self.lock = asyncio.Lock()
+
+    @property
+    def healthy(self) -> bool:
+        return self.conn is not None and not self.watcher.closed
+
+
+class SFTPConnectionPool:
+    """
+    Keeps a fixed number of warm SSH connections to the storage host and
+    multiplexes concurrent transfers over SFTP channels on them.
+    """
+
+    def __init__(self, conn_opts: dict, size: int, channels_per_connection: int):
+        self.conn_opts = conn_opts
+        self._slots = [_PooledConnection() for _ in range(max(1, size))]
+        self._channels = asyncio.Semaphore(max(1, size) * max(1, channels_per_connection))
+
+    async def _ensure_connected(self, slot: _PooledConnection):
+        async with slot.lock:
+            if slot.healthy:
+                return
+
+            slot.idle_sftp.clear()
+            delay = 1
+            for attempt in range(CONNECT_RETRIES):
+                try:
+                    slot.conn, slot.watcher = await asyncssh.create_connection(_ConnectionWatcher, **self.conn_opts)
+                    logger.info(f"Connected to storage at {self.conn_opts['host']}:{self.conn_opts['port']}")
+                    return
+                except (OSError, asyncssh.Error) as e:
+                    logger.warning(f"Failed to connect to storage (attempt {attempt+1}/{CONNECT_RETRIES}): {e}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, MAX_BACKOFF)
+            raise ConnectionError("Failed to connect to storage after retries")
+
+    async def warm_up(self):
+        await asyncio.gather(*(self._ensure_connected(slot) for slot in self._slots))
+
+    @asynccontextmanager
+    async def sftp(self):
+        """Yields an SFTP client on the least busy healthy connection."""
+        async with self._channels:
+            slot = min(self._slots, key=lambda s: s.active)
+            slot.active += 1
+            try:
+                await self._ensure_connected(slot)
+                sftp = slot.idle_sftp.pop() if slot.idle_sftp else await slot.conn.start_sftp_client()
+                reusable = False
+                try:
+                    yield sftp
+                    reusable = True
+                finally:
+                    if reusable and slot.healthy:
+                        slot.idle_sftp.append(sftp)
+                    else:
+                        sftp.exit()
+            finally:
+                slot.active -= 1
+
+    async def close(self):
+        for slot in self._slots:
+            if slot.conn is not None:
+                slot.conn.close()
+                await slot.conn.wait_closed()
+                slot.conn = None
+            slot.idle_sftp.clear()
+
+
 class StorageClient:
     def __init__(self):
         self.host = STORAGE_HOST
@@ -30,53 +164,256 @@ class StorageClient:
         if not self.password and not self.key_path:
             raise ValueError("Storage client auth is not configured. Please provide either STORAGE_PASSWORD or STORAGE_PRIVATE_KEY_PATH.")
 
-    async def upload_file(self, local_path: str) -> str:
-        """
-        Uploads a file to the remote storage via SFTP and returns its public URL.
-        """
-        if not os.path.exists(local_path):
-            raise FileNotFoundError(f"Local file not found: {local_path}")
-
-        file_name = os.path.basename(local_path)
-        remote_file_path = os.path.join(self.remote_path, file_name)
-
         conn_opts = {
             "host": self.host.strip(),
             "port": self.port,
             "username": self.user,
-            "known_hosts": None
+            "known_hosts": None,
+            "keepalive_interval": 15,
+            "keepalive_count_max": 3,
         }
         if self.key_path:
             conn_opts["client_keys"] = [self.key_path]
         elif self.password:
             conn_opts["password"] = self.password
 
-        logger.info(f"--- SFTP CONNECTION DEBUG ---")
-        logger.info(f"Host: {conn_opts.get('host')}")
-        logger.info(f"Port: {conn_opts.get('port')}")
-        logger.info(f"Username: {conn_opts.get('username')}")
-        logger.info(f"Password provided: {'yes' if conn_opts.get('password') else 'no'}")
-        logger.info(f"Client keys path: {conn_opts.get('client_keys')}")
-        logger.info(f"Remote file path: {remote_file_path}")
-        logger.info(f"--- END SFTP CONNECTION DEBUG ---")
+        self.pool = SFTPConnectionPool(conn_opts, STORAGE_POOL_SIZE, STORAGE_CHANNELS_PER_CONNECTION)
 
-        logger.info(f"Connecting to storage at {self.host}:{self.port}...")
+    async def warm_up(self):
         try:
-            async with asyncssh.connect(**conn_opts) as conn:
-                logger.info(f"Uploading {local_path} to {remote_file_path}...")
-                async with conn.start_sftp_client() as sftp:
-                    await sftp.put(local_path, remote_file_path)
+            await self.pool.warm_up()
+        except Exception as e:
+            logger.warning(f"Storage connections are not warmed up: {e}")
+
+    async def close(self):
+        await self.pool.close()
+
+    def public_url(self, remote_name: str) -> str:
+        return urljoin(self.url_prefix, remote_name)
+
+    async def _resume_offset(self, sftp: asyncssh.SFTPClient, local_path: str, remote_path: str, acked: int) -> int:
+        """
+        Returns how many bytes of an interrupted upload can be kept: the
+        acknowledged prefix, if the remote partial file still holds it and
+        its last block matches the local file. The partial file is cut to
+        that length, dropping blocks written past a gap.
+        """
+        if not acked:
+            return 0
+        try:
+            remote_size = (await sftp.stat(remote_path)).size or 0
+        except asyncssh.SFTPNoSuchFile:
+            return 0
+        if remote_size < acked:
+            logger.warning(f"Partial upload {remote_path} is shorter than its acknowledged {acked} bytes, starting over")
+            return 0
+
+        tail_offset = max(0, acked - STORAGE_BLOCK_SIZE)
+        async with sftp.open(remote_path, "rb") as remote:
+            remote_tail = await remote.read(acked - tail_offset, tail_offset)
+        with open(local_path, "rb") as local:
+            local.seek(tail_offset)
+            local_tail = local.read(acked - tail_offset)
+
+        if remote_tail != local_tail:
+            logger.warning(f"Partial upload {remote_path} does not match {local_path}, starting over")
+            return 0
+        if remote_size > acked:
+            await sftp.truncate(remote_path, acked)
+        return acked
+
+    async def _write_blocks(self, sftp: asyncssh.SFTPClient, local_path: str, remote_path: str, acked: _AckedPrefix) -> int:
+        """
+        Writes the local file from the acknowledged offset with up to
+        STORAGE_MAX_REQUESTS blocks in flight, recording completed blocks.
+        """
+        async def write_block(remote, block: bytes, offset: int):
+            await remote.write(block, offset)
+            acked.ack(offset, len(block))
+
+        pending: set[asyncio.Task] = set()
+        written = acked.offset
+        try:
+            async with sftp.open(remote_path, "r+b" if written else "wb") as remote:
+                with open(local_path, "rb") as local:
+                    local.seek(written)
+                    while True:
+                        block = await asyncio.to_thread(local.read, STORAGE_BLOCK_SIZE)
+                        if not block:
+                            break
+                        if len(pending) >= STORAGE_MAX_REQUESTS:
+                            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                            for task in done:
+                                task.result()
+                        pending.add(asyncio.create_task(write_block(remote, block, written)))
+                        written += len(block)
+                    await asyncio.gather(*pending)
+        finally:
+            for task in pending:
+                task.cancel()
+        return written
+
+    async def upload_file(self, local_path: str, remote_name: str | None = None) -> str:
+        """
+        Uploads a file to the remote storage via SFTP and returns its public URL.
+        The remote file is named `remote_name`, or after the local file.
+
+        Blocks are written in parallel into a remote `.part` file. After a
+        dropped connection the upload resumes after the last block that was
+        acknowledged together with all blocks before it, and the file is
+        renamed to its final name once complete.
+        """
+        if not os.path.exists(local_path):
+            raise FileNotFoundError(f"Local file not found: {local_path}")
+
+        file_name = remote_name or os.path.basename(local_path)
+        remote_file_path = os.path.join(self.remote_path, file_name)
+        remote_part_path = remote_file_path + ".part"
+        size = os.path.getsize(local_path)
+        upload_started = time.monotonic()
+        acked = _AckedPrefix()
+
+        for attempt in range(1, STORAGE_UPLOAD_RETRIES + 1):
+            started = time.monotonic()
+            try:
+                async with self.pool.sftp() as sftp:
+                    offset = await self._resume_offset(sftp, local_path, remote_part_path, acked.offset)
+                    acked = _AckedPrefix(offset)
+                    if offset:
+                        logger.info(f"Resuming upload of {local_path} from byte {offset}")
+                    else:
+                        logger.info(f"Uploading {local_path} to {remote_file_path}...")
+
+                    written = await self._write_blocks(sftp, local_path, remote_part_path, acked)
                     # Устанавливаем права на файл, чтобы веб-сервер мог его прочитать
-                    await sftp.chmod(remote_file_path, 0o644)
-                logger.info("File uploaded and permissions set successfully.")
+                    await sftp.chmod(remote_part_path, 0o644)
+                    await sftp.posix_rename(remote_part_path, remote_file_path)
+                break
+            except (OSError, asyncssh.Error) as e:
+                logger.warning(f"Upload of {local_path} failed (attempt {attempt}/{STORAGE_UPLOAD_RETRIES}): {e}")
+                if attempt == STORAGE_UPLOAD_RETRIES:
+                    logger.error(f"Failed to upload file to storage: {e}", exc_info=True)
+                    raise ConnectionError("Failed to upload file to storage.") from e
 
-            public_url = urljoin(self.url_prefix, file_name)
-            logger.info(f"File is available at public URL: {public_url}")
-            
-            return public_url
+        elapsed = max(time.monotonic() - started, 1e-6)
+        sent = written - offset
+        STORAGE_UPLOAD_SECONDS.labels("file").observe(time.monotonic() - upload_started)
+        STORAGE_UPLOAD_BYTES.labels("file").inc(sent)
+        logger.info(
+            f"Uploaded {size} bytes ({sent} in this attempt) in {elapsed:.1f}s, "
+            f"{sent / elapsed / (1024 * 1024):.1f} MiB/s"
+        )
 
-        except Exception as e:
-            logger.error(f"Failed to upload file to storage: {e}", exc_info=True)
-            raise ConnectionError("Failed to upload file to storage.") from e
+        public_url = self.public_url(file_name)
+        logger.info(f"File is available at public URL: {public_url}")
+        return public_url
+
+    async def list_files(self) -> list[tuple[str, int, int]]:
+        """Returns (name, size, mtime) of the regular files in the storage directory."""
+        async with self.pool.sftp() as sftp:
+            entries = await sftp.readdir(self.remote_path)
+        return [
+            (entry.filename, entry.attrs.size or 0, entry.attrs.mtime or 0)
+            for entry in entries
+            if entry.attrs.type == asyncssh.FILEXFER_TYPE_REGULAR
+        ]
+
+    async def delete_files(self, file_names: list[str]) -> list[str]:
+        """
+        Deletes files from the storage directory over one pooled SFTP session
+        and returns the names that are gone, including already missing ones.
+        """
+        async def remove(sftp: asyncssh.SFTPClient, file_name: str) -> bool:
+            try:
+                await sftp.remove(os.path.join(self.remote_path, file_name))
+            except asyncssh.SFTPNoSuchFile:
+                pass
+            except (OSError, asyncssh.Error) as e:
+                logger.warning(f"Failed to delete {file_name} from storage: {e}")
+                return False
+            return True
+
+        async with self.pool.sftp() as sftp:
+            # Запросы на удаление отправляются по одному каналу без ожидания ответов
+            results = await asyncio.gather(*(remove(sftp, name) for name in file_names))
+        return [name for name, removed in zip(file_names, results) if removed]
+
+    async def _open_growing_file(self, local_path: str, writer: asyncio.Future):
+        # yt-dlp пишет в <имя>.part и переименовывает файл по завершении
+        while True:
+            for path in (local_path + ".part", local_path):
+                try:
+                    return open(path, "rb")
+                except FileNotFoundError:
+                    pass
+            if writer.done():
+                writer.result()
+                raise FileNotFoundError(f"Local file not found: {local_path}")
+            await asyncio.sleep(STREAM_POLL_INTERVAL)
+
+    async def upload_growing_file(
+        self,
+        local_path: str,
+        writer: asyncio.Future,
+        name_for_digest: Callable[[str], str] | None = None,
+    ) -> tuple[str, str]:
+        """
+        Uploads a file while `writer` is still producing it and returns its
+        public URL and SHA-256. Data goes to a remote `.part` file that is
+        renamed only after the writer has finished and all bytes are sent,
+        to `name_for_digest(sha256)` if given or after the local file.
+        """
+        part_name = f"{os.path.basename(local_path)}.part"
+        remote_part_path = os.path.join(self.remote_path, part_name)
+        digest = hashlib.sha256()
+
+        source = await self._open_growing_file(local_path, writer)
+        started = time.monotonic()
+        sent = 0
+        try:
+            async with self.pool.sftp() as sftp:
+                logger.info(f"Streaming {local_path} to {remote_part_path} while it is downloaded...")
+                try:
+                    async with sftp.open(remote_part_path, "wb") as remote:
+                        while True:
+                            # Статус писателя проверяется до чтения, чтобы не потерять хвост файла
+                            finished = writer.done()
+                            chunk = await asyncio.to_thread(source.read, STREAM_CHUNK_SIZE)
+                            if chunk:
+                                await remote.write(chunk, sent)
+                                digest.update(chunk)
+                                sent += len(chunk)
+                                continue
+                            if finished:
+                                writer.result()
+                                break
+                            if os.fstat(source.fileno()).st_size < sent:
+                                raise StreamingUploadError(f"{local_path} was truncated during upload")
+                            await asyncio.sleep(STREAM_POLL_INTERVAL)
+
+                    local_size = os.path.getsize(local_path)
+                    if local_size != sent:
+                        raise StreamingUploadError(f"Streamed {sent} bytes, but {local_path} has {local_size}")
+
+                    content_hash = digest.hexdigest()
+                    file_name = name_for_digest(content_hash) if name_for_digest else os.path.basename(local_path)
+                    remote_file_path = os.path.join(self.remote_path, file_name)
+                    await sftp.chmod(remote_part_path, 0o644)
+                    # Файл появляется под итоговым именем только целиком
+                    await sftp.posix_rename(remote_part_path, remote_file_path)
+                except BaseException:
+                    try:
+                        await sftp.remove(remote_part_path)
+                    except Exception:
+                        pass
+                    raise
+        finally:
+            source.close()
+
+        elapsed = time.monotonic() - started
+        STORAGE_UPLOAD_SECONDS.labels("stream").observe(elapsed)
+        STORAGE_UPLOAD_BYTES.labels("stream").inc(sent)
+        logger.info(f"Streamed {sent} bytes to {remote_file_path} in {elapsed:.1f}s")
+        return self.public_url(file_name), content_hash
 
 storage_client = StorageClient()
@@ -4,15 +4,73 @@ env = Env()
 env.read_envfile()
 
 TOKEN = env.str("TOKEN")
+# Собственный сервер Bot API (telegram-bot-api --local) вместо api.telegram.org
+TELEGRAM_API_URL = env.str("TELEGRAM_API_URL", default=None)
+TELEGRAM_API_LOCAL = env.bool("TELEGRAM_API_LOCAL", default=bool(TELEGRAM_API_URL))
+# Каталог загрузок бота, как его видит сервер Bot API (если смонтирован по другому пути)
+TELEGRAM_API_FILES_DIR = env.str("TELEGRAM_API_FILES_DIR", default=None)
+# Файлы до этого размера отправляются в Telegram, остальные - ссылкой на хранилище
+TELEGRAM_UPLOAD_LIMIT = env.int(
+    "TELEGRAM_UPLOAD_LIMIT",
+    default=2000 * 1024 * 1024 if TELEGRAM_API_LOCAL else 49 * 1024 * 1024,
+)
+# Каталог временных файлов загрузок; в режиме path он должен быть доступен серверу Bot API
+DOWNLOAD_DIR = env.str("DOWNLOAD_DIR", default=".")
+# upload - multipart-загрузка файла, path - передача пути к файлу локальному серверу
+TELEGRAM_SEND_STRATEGY = env.str("TELEGRAM_SEND_STRATEGY", default="path" if TELEGRAM_API_LOCAL else "upload")
+# Ограничения исходящих вызовов Bot API (flood control действует и для локального сервера).
+# TELEGRAM_GLOBAL_RATE - на весь бот: бот и воркеры загрузок берут токены из общего ведра в Redis
+TELEGRAM_GLOBAL_RATE = env.float("TELEGRAM_GLOBAL_RATE", default=25.0)
+TELEGRAM_CHAT_RATE = env.float("TELEGRAM_CHAT_RATE", default=1.0)
+TELEGRAM_CHAT_BURST = env.int("TELEGRAM_CHAT_BURST", default=3)
+# Сколько раз повторять вызов после ответа RetryAfter
+TELEGRAM_MAX_RETRIES = env.int("TELEGRAM_MAX_RETRIES", default=5)
 ADMIN_CHAT_ID = env.int("ADMIN_CHAT_ID")
 ADMIN_USER_ID = env.int("ADMIN_USER_ID")
 DB_DSN = env.str("DB_DSN")
+DB_POOL_MIN_SIZE = env.int("DB_POOL_MIN_SIZE", default=2)
+DB_POOL_MAX_SIZE = env.int("DB_POOL_MAX_SIZE", default=10)
+DB_STATEMENT_CACHE_SIZE = env.int("DB_STATEMENT_CACHE_SIZE", default=100)
 REQUIRED_CHANNELS = [ch for ch in env.list("REQUIRED_CHANNELS", default=[]) if ch]
+# Сколько секунд помнить результат проверки подписки (положительный и отрицательный)
+SUBSCRIPTION_CACHE_TTL = env.int("SUBSCRIPTION_CACHE_TTL", default=600)
+SUBSCRIPTION_NEGATIVE_CACHE_TTL = env.int("SUBSCRIPTION_NEGATIVE_CACHE_TTL", default=30)
+# Кэш известных пользователей перед таблицей users
+USER_CACHE_SIZE = env.int("USER_CACHE_SIZE", default=10000)
+USER_CACHE_TTL = env.int("USER_CACHE_TTL", default=3600)
+USER_NEGATIVE_CACHE_TTL = env.int("USER_NEGATIVE_CACHE_TTL", default=10)
+# Как часто записывать накопленное время активности пользователей
+USER_ACTIVITY_FLUSH_INTERVAL = env.int("USER_ACTIVITY_FLUSH_INTERVAL", default=10)
 
 REDIS_HOST = env.str("REDIS_HOST", default="localhost")
 REDIS_PORT = env.int("REDIS_PORT", default=6379)
+# Срок жизни состояния диалога и его данных (ссылка, оценки размеров) в Redis
+FSM_STATE_TTL = env.int("FSM_STATE_TTL", default=24 * 3600)
+FSM_DATA_TTL = env.int("FSM_DATA_TTL", default=24 * 3600)
 HTTP_PORT = env.int("HTTP_PORT", default=8080)
 
+# polling - long polling, webhook - приём обновлений aiohttp-сервером за nginx
+UPDATES_MODE = env.str("UPDATES_MODE", default="polling")
+# Публичный адрес, на который Telegram присылает обновления (https://bot.example.com)
+WEBHOOK_BASE_URL = env.str("WEBHOOK_BASE_URL", default=None)
+WEBHOOK_PATH = env.str("WEBHOOK_PATH", default="/webhook")
+# Если не задан, при каждом запуске генерируется новый
+WEBHOOK_SECRET = env.str("WEBHOOK_SECRET", default=None)
+WEBHOOK_HOST = env.str("WEBHOOK_HOST", default="0.0.0.0")
+WEBHOOK_PORT = env.int("WEBHOOK_PORT", default=8000)
+# Число процессов-обработчиков; обновления делятся между ними по user_id.
+# Лимиты этапов и YTDLP_PROCESS_WORKERS задаются на все процессы-обработчики и делятся между ними поровну
+WEBHOOK_WORKERS = env.int("WEBHOOK_WORKERS", default=1)
+WEBHOOK_SOCKET_DIR = env.str("WEBHOOK_SOCKET_DIR", default="/tmp")
+# Порт эндпоинта /metrics для Prometheus (0 - выключен); обработчик вебхука номер i слушает METRICS_PORT + i
+METRICS_HOST = env.str("METRICS_HOST", default="0.0.0.0")
+METRICS_PORT = env.int("METRICS_PORT", default=9464)
+# Журнал трасс задач в формате JSONL (пустое значение - не писать) и его размер до ротации
+TRACE_FILE = env.str("TRACE_FILE", default="traces.jsonl")
+TRACE_MAX_BYTES = env.int("TRACE_MAX_BYTES", default=50 * 1024 * 1024)
+# Задачи дольше этого срока (в секундах) показываются командой /slow
+TRACE_SLOW_SECONDS = env.float("TRACE_SLOW_SECONDS", default=60.0)
+
 STORAGE_HOST = env.str("STORAGE_HOST", default=None)
 STORAGE_PORT = env.int("STORAGE_PORT", default=22)
 STORAGE_USER = env.str("STORAGE_USER", default=None)
@@ -22,3 +80,44 @@ STORAGE_PATH = env.str("STORAGE_PATH", default="/")
 STORAGE_PUBLIC_URL_PREFIX = env.str("STORAGE_PUBLIC_URL_PREFIX", default=None)
 
 COOKIE_FILE = "www.youtube.com_cookies.txt"
+
+META_CACHE_TTL = env.int("META_CACHE_TTL", default=3600)
+META_CACHE_LRU_SIZE = env.int("META_CACHE_LRU_SIZE", default=256)
+
+CACHE_CHANNEL_ID = env.int("CACHE_CHANNEL_ID", default=None)
+CACHE_WARM_FORMATS = [f for f in env.list("CACHE_WARM_FORMATS", default=[]) if f]
+
+DOWNLOAD_CONCURRENCY = env.int("DOWNLOAD_CONCURRENCY", default=4)
+POSTPROCESS_CONCURRENCY = env.int("POSTPROCESS_CONCURRENCY", default=2)
+UPLOAD_CONCURRENCY = env.int("UPLOAD_CONCURRENCY", default=4)
+# Сколько слотов одного этапа может занимать один пользователь
+USER_STAGE_CONCURRENCY = env.int("USER_STAGE_CONCURRENCY", default=1)
+# Сколько загрузок пользователь может держать в работе и в очереди одновременно
+USER_MAX_JOBS = env.int("USER_MAX_JOBS", default=3)
+# Пользователи с повышенным приоритетом и их вес в очередях (у обычных пользователей вес 1)
+PRIORITY_USER_IDS = [int(user_id) for user_id in env.list("PRIORITY_USER_IDS", default=[]) if user_id]
+PRIORITY_USER_WEIGHT = env.float("PRIORITY_USER_WEIGHT", default=3.0)
+
+# thread - yt-dlp в потоке процесса бота, process - в пуле отдельных процессов
+YTDLP_EXECUTOR = env.str("YTDLP_EXECUTOR", default="thread")
+YTDLP_PROCESS_WORKERS = env.int("YTDLP_PROCESS_WORKERS", default=DOWNLOAD_CONCURRENCY)
+YTDLP_JOB_TIMEOUT = env.int("YTDLP_JOB_TIMEOUT", default=3600)
+
+# local - загрузки выполняются процессом бота, stream - воркерами через Redis Streams
+DISPATCH_MODE = env.str("DISPATCH_MODE", default="local")
+WORKER_CONCURRENCY = env.int("WORKER_CONCURRENCY", default=DOWNLOAD_CONCURRENCY)
+JOB_MAX_ATTEMPTS = env.int("JOB_MAX_ATTEMPTS", default=3)
+
+STORAGE_POOL_SIZE = env.int("STORAGE_POOL_SIZE", default=2)
+STORAGE_CHANNELS_PER_CONNECTION = env.int("STORAGE_CHANNELS_PER_CONNECTION", default=4)
+# Размер блока записи SFTP и число одновременно отправленных блоков
+STORAGE_BLOCK_SIZE = env.int("STORAGE_BLOCK_SIZE", default=256 * 1024)
+STORAGE_MAX_REQUESTS = env.int("STORAGE_MAX_REQUESTS", default=64)
+STORAGE_UPLOAD_RETRIES = env.int("STORAGE_UPLOAD_RETRIES", default=3)
+# Квота хранилища в байтах (0 - без ограничения) и срок жизни ссылок в секундах
+STORAGE_QUOTA_BYTES = env.int("STORAGE_QUOTA_BYTES", default=0)
+STORAGE_OBJECT_TTL = env.int("STORAGE_OBJECT_TTL", default=7 * 24 * 3600)
+STORAGE_GC_INTERVAL = env.int("STORAGE_GC_INTERVAL", default=600)
+STORAGE_GC_BATCH_SIZE = env.int("STORAGE_GC_BATCH_SIZE", default=100)
+# Выгружать большие однофайловые форматы на хранилище параллельно со скачиванием
+STREAM_UPLOADS = env.bool("STREAM_UPLOADS", default=True)
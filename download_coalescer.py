@@ -0,0 +1,168 @@
+import asyncio
+import json
+import logging
+import secrets
+import time
+from typing import Awaitable, Callable, Optional
+
+from clients.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Время жизни аренды владельца; продлевается, пока загрузка жива
+LEASE_TTL = 60
+# Сколько хранится результат для опоздавших подписчиков
+RESULT_TTL = 300
+# Сколько подписчик ждёт результата, прежде чем скачать файл сам
+FOLLOW_TIMEOUT = 2 * 60 * 60
+
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _key(video_id: str, format_key: str) -> str:
+    return f"inflight:{video_id}:{format_key}"
+
+
+class DownloadOwnership:
+    """
+    Held by the request that actually downloads a (video, format) pair.
+    Progress and the final result are broadcast to every follower.
+    """
+
+    def __init__(self, redis, video_id: str, format_key: str, token: str):
+        self.redis = redis
+        self.key = _key(video_id, format_key)
+        self.token = token
+        self._renew_task = asyncio.create_task(self._renew())
+
+    async def _renew(self):
+        while True:
+            await asyncio.sleep(LEASE_TTL / 3)
+            try:
+                renewed = await self.redis.eval(RENEW_SCRIPT, 1, self.key, self.token, LEASE_TTL)
+                if not renewed:
+                    logger.warning(f"Аренда {self.key} потеряна")
+                    return
+            except Exception as e:
+                logger.warning(f"Не удалось продлить аренду {self.key}: {e}")
+
+    async def _publish(self, event: dict):
+        await self.redis.publish(f"{self.key}:events", json.dumps(event))
+
+    async def publish_progress(self, text: str):
+        try:
+            await self._publish({"type": "progress", "text": text})
+        except Exception as e:
+            logger.debug(f"Не удалось опубликовать прогресс {self.key}: {e}")
+
+    async def finish(self, result: dict):
+        """
+        Publishes the delivered result, e.g. {"kind": "file_id", ...},
+        {"kind": "url", ...} or {"kind": "error", ...}.
+        """
+        event = {"type": "result", "result": result}
+        try:
+            await self.redis.set(f"{self.key}:result", json.dumps(event), ex=RESULT_TTL)
+            await self._publish(event)
+        except Exception as e:
+            logger.warning(f"Не удалось опубликовать результат {self.key}: {e}")
+
+    async def release(self):
+        self._renew_task.cancel()
+        try:
+            await self.redis.eval(RELEASE_SCRIPT, 1, self.key, self.token)
+            # Подписчики без результата увидят, что владельца больше нет
+            await self._publish({"type": "released"})
+        except Exception as e:
+            logger.warning(f"Не удалось освободить {self.key}: {e}")
+
+
+class DownloadCoalescer:
+    """
+    Single-flight layer for downloads: the first request for a
+    (video, format) pair becomes the owner, the rest follow its progress
+    and reuse its result. Works across bot instances through Redis.
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    async def acquire(self, video_id: str, format_key: str) -> Optional[DownloadOwnership]:
+        key = _key(video_id, format_key)
+        token = secrets.token_hex(16)
+        try:
+            if not await self.redis.set(key, token, nx=True, ex=LEASE_TTL):
+                return None
+            await self.redis.delete(f"{key}:result")
+        except Exception as e:
+            # Без Redis каждый запрос скачивает сам
+            logger.warning(f"Redis недоступен для объединения загрузок {key}: {e}")
+            return DownloadOwnership(self.redis, video_id, format_key, token)
+
+        logger.info(f"Загрузка {key} выполняется этим запросом")
+        return DownloadOwnership(self.redis, video_id, format_key, token)
+
+    async def follow(
+        self,
+        video_id: str,
+        format_key: str,
+        on_progress: Callable[[str], Awaitable[None]],
+    ) -> Optional[dict]:
+        """
+        Waits for the owner's result. Returns None if the owner disappeared
+        without a result, in which case the caller should try to take over.
+        Raises asyncio.TimeoutError after FOLLOW_TIMEOUT; the caller should
+        then download on its own.
+        """
+        key = _key(video_id, format_key)
+        pubsub = self.redis.pubsub()
+        await pubsub.subscribe(f"{key}:events")
+        logger.info(f"Ожидание результата чужой загрузки {key}")
+
+        try:
+            deadline = time.monotonic() + FOLLOW_TIMEOUT
+            last_owner_check = 0.0
+            while (remaining := deadline - time.monotonic()) > 0:
+                # Результат мог быть опубликован до подписки
+                if time.monotonic() - last_owner_check >= LEASE_TTL / 3:
+                    last_owner_check = time.monotonic()
+                    stored = await self.redis.get(f"{key}:result")
+                    if stored is not None:
+                        return json.loads(stored)["result"]
+                    if not await self.redis.exists(key):
+                        return None
+
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=min(1.0, remaining))
+                if message is None:
+                    continue
+
+                event = json.loads(message["data"])
+                if event["type"] == "progress":
+                    await on_progress(event["text"])
+                elif event["type"] == "result":
+                    return event["result"]
+                elif event["type"] == "released":
+                    # Проверяем сохранённый результат при следующей итерации
+                    last_owner_check = 0.0
+            raise asyncio.TimeoutError(f"no result for {key} in {FOLLOW_TIMEOUT} s")
+        finally:
+            try:
+                await pubsub.unsubscribe()
+                await pubsub.aclose()
+            except Exception as e:
+                logger.debug(f"Ошибка закрытия подписки {key}: {e}")
+
+
+coalescer = DownloadCoalescer(redis_client)
@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import math
+import time
+from collections import Counter, OrderedDict, deque
+from typing import Awaitable, Callable, Hashable, Optional
+
+from config import DOWNLOAD_CONCURRENCY, POSTPROCESS_CONCURRENCY, UPLOAD_CONCURRENCY, USER_STAGE_CONCURRENCY
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Как часто ожидающим сообщается их позиция в очереди
+POSITION_UPDATE_INTERVAL = 5
+# Оценка длительности этапа, пока нет ни одного замера
+DEFAULT_STAGE_DURATION = 60.0
+# Вес нового замера в скользящем среднем длительности этапа
+DURATION_EWMA_ALPHA = 0.2
+# Минимальный вес, чтобы круг планировщика всегда завершался
+MIN_WEIGHT = 0.05
+
+# Обработчик позиции в очереди: (этап, позиция, ожидание в секундах)
+WaitCallback = Callable[[str, int, float], Awaitable[None]]
+
+
+class StageQueue:
+    """
+    Admission queue with bounded concurrency for one pipeline stage.
+
+    Waiters are queued per key (user) and served by deficit round-robin, so
+    a user with many queued jobs cannot starve the others; a key's weight
+    sets its share. `per_key_limit` caps the slots a single key may hold.
+    Waiters of the same key are served in FIFO order.
+    """
+
+    def __init__(self, name: str, concurrency: int, per_key_limit: Optional[int] = None):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.per_key_limit = per_key_limit
+        self.active = 0
+        self.avg_duration = DEFAULT_STAGE_DURATION
+        self._queues: OrderedDict[Hashable, deque[asyncio.Future]] = OrderedDict()
+        self._weights: dict[Hashable, float] = {}
+        self._deficits: dict[Hashable, float] = {}
+        self._active_by_key: Counter = Counter()
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def estimate_wait(self, position: int) -> float:
+        """Estimated seconds until the job at `position` (1-based) gets a slot."""
+        return math.ceil(position / self.concurrency) * self.avg_duration
+
+    def _has_room(self, key: Hashable) -> bool:
+        return self.per_key_limit is None or self._active_by_key[key] < self.per_key_limit
+
+    def _next_key(self) -> Hashable:
+        """Picks the next key to serve; at least one queued key must have room."""
+        while True:
+            key = next(iter(self._queues))
+            if not self._has_room(key):
+                self._queues.move_to_end(key)
+                continue
+            if self._deficits[key] >= 1:
+                self._deficits[key] -= 1
+                return key
+            # Ключ получает свой квант и уходит в конец круга
+            self._deficits[key] += self._weights[key]
+            if self._deficits[key] < 1:
+                self._queues.move_to_end(key)
+
+    def _dispatch(self):
+        while self.active < self.concurrency:
+            if not any(self._has_room(key) for key in self._queues):
+                return
+            key = self._next_key()
+            queue = self._queues[key]
+            waiter = queue.popleft()
+            if not queue:
+                del self._queues[key]
+                del self._deficits[key]
+            elif self._deficits[key] < 1:
+                self._queues.move_to_end(key)
+            if waiter.done():
+                continue
+            self.active += 1
+            self._active_by_key[key] += 1
+            waiter.set_result(None)
+
+    def position(self, waiter: asyncio.Future, key: Hashable) -> int:
+        """Approximate 1-based position of a waiter under weighted round-robin."""
+        queue = self._queues.get(key)
+        if not queue or waiter not in queue:
+            return 1
+        index = queue.index(waiter)
+        weight = self._weights[key]
+        ahead = index
+        for other, other_queue in self._queues.items():
+            if other != key:
+                ahead += min(len(other_queue), math.ceil((index + 1) * self._weights[other] / weight))
+        return ahead + 1
+
+    def _remove(self, waiter: asyncio.Future, key: Hashable):
+        queue = self._queues.get(key)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            return
+        if not queue:
+            del self._queues[key]
+            del self._deficits[key]
+            if not self._active_by_key[key]:
+                self._weights.pop(key, None)
+
+    async def acquire(self, on_wait: Optional[WaitCallback] = None, key: Hashable = None, weight: float = 1.0):
+        waiter = asyncio.get_running_loop().create_future()
+        if key not in self._queues:
+            self._queues[key] = deque()
+            self._deficits[key] = 0.0
+        self._queues[key].append(waiter)
+        self._weights[key] = max(weight, MIN_WEIGHT)
+        self._dispatch()
+        if waiter.done():
+            return
+
+        last_position = None
+        try:
+            while True:
+                position = self.position(waiter, key)
+                if on_wait is not None and position != last_position:
+                    last_position = position
+                    try:
+                        await on_wait(self.name, position, self.estimate_wait(position))
+                    except Exception as e:
+                        logger.debug(f"Ошибка уведомления о позиции в очереди {self.name}: {e}")
+                try:
+                    # Слот выдаётся в _dispatch(), active уже учтён
+                    await asyncio.wait_for(asyncio.shield(waiter), timeout=POSITION_UPDATE_INTERVAL)
+                    return
+                except asyncio.TimeoutError:
+                    continue
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(key=key)
+            else:
+                waiter.cancel()
+                self._remove(waiter, key)
+            raise
+
+    def release(self, duration: Optional[float] = None, key: Hashable = None):
+        if duration is not None:
+            self.avg_duration += DURATION_EWMA_ALPHA * (duration - self.avg_duration)
+
+        self.active -= 1
+        self._active_by_key[key] -= 1
+        if self._active_by_key[key] <= 0:
+            del self._active_by_key[key]
+            if key not in self._queues:
+                self._weights.pop(key, None)
+        self._dispatch()
+
+
+class ScheduledJob:
+    """
+    Tracks which stage slot a single download job currently holds.
+    A job holds at most one slot; entering a stage releases the previous one.
+    """
+
+    def __init__(
+        self,
+        scheduler: "DownloadScheduler",
+        loop: asyncio.AbstractEventLoop,
+        on_wait: Optional[WaitCallback],
+        key: Hashable = None,
+        weight: float = 1.0,
+    ):
+        self.scheduler = scheduler
+        self.loop = loop
+        self.on_wait = on_wait
+        self.key = key
+        self.weight = weight
+        self.stage: Optional[str] = None
+        self._entered_at = 0.0
+
+    def _leave(self):
+        if self.stage is not None:
+            self.scheduler.stages[self.stage].release(time.monotonic() - self._entered_at, key=self.key)
+            self.stage = None
+
+    async def enter(self, stage: str):
+        if stage == self.stage:
+            return
+        self._leave()
+        with span(f"queue_{stage}"):
+            await self.scheduler.stages[stage].acquire(self.on_wait, key=self.key, weight=self.weight)
+        self.stage = stage
+        self._entered_at = time.monotonic()
+
+    def enter_from_thread(self, stage: str):
+        """Blocking variant of enter() for yt-dlp hooks running in a worker thread."""
+        asyncio.run_coroutine_threadsafe(self.enter(stage), self.loop).result()
+
+    async def close(self):
+        self._leave()
+
+
+class DownloadScheduler:
+    """
+    Global scheduler with separate bounded queues for downloads, postprocessing
+    and uploads. Jobs are keyed by user and share each stage fairly by weight.
+    """
+
+    def __init__(self, download: int, postprocess: int, upload: int, per_user: Optional[int] = None):
+        self.stages = {
+            "download": StageQueue("download", download, per_user),
+            "postprocess": StageQueue("postprocess", postprocess, per_user),
+            "upload": StageQueue("upload", upload, per_user),
+        }
+
+    def job(self, on_wait: Optional[WaitCallback] = None, key: Hashable = None, weight: float = 1.0) -> ScheduledJob:
+        return ScheduledJob(self, asyncio.get_running_loop(), on_wait, key, weight)
+
+    def snapshot(self) -> dict[str, dict[str, int]]:
+        return {
+            name: {"active": stage.active, "queued": stage.queued, "concurrency": stage.concurrency}
+            for name, stage in self.stages.items()
+        }
+
+
+download_scheduler = DownloadScheduler(
+    download=DOWNLOAD_CONCURRENCY,
+    postprocess=POSTPROCESS_CONCURRENCY,
+    upload=UPLOAD_CONCURRENCY,
+    per_user=USER_STAGE_CONCURRENCY,
+)
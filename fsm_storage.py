@@ -0,0 +1,26 @@
+import json
+from typing import Any
+
+from aiogram.fsm.storage.base import DefaultKeyBuilder
+from aiogram.fsm.storage.redis import RedisStorage
+
+KEY_PREFIX = "fsm"
+
+
+def compact_json_dumps(data: Any) -> str:
+    """JSON without whitespace and with UTF-8 kept as is, to keep FSM records small."""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def create_fsm_storage(redis, state_ttl: int, data_ttl: int) -> RedisStorage:
+    """
+    FSM storage in Redis: the chosen link and its probe summary survive
+    restarts and are visible to every bot instance and dispatcher process.
+    """
+    return RedisStorage(
+        redis,
+        key_builder=DefaultKeyBuilder(prefix=KEY_PREFIX),
+        state_ttl=state_ttl or None,
+        data_ttl=data_ttl or None,
+        json_dumps=compact_json_dumps,
+    )
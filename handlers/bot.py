@@ -1,15 +1,19 @@
+import asyncio
 import logging
+from datetime import datetime, timezone
 from aiogram import Router, F, types
 from aiogram.exceptions import TelegramForbiddenError
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import ReplyKeyboardBuilder
 
-from audio import process_download, DownloadState, ensure_user_exists, is_user_subscribed, send_subscription_request, estimate_video_size, format_size
-from config import ADMIN_USER_ID, ADMIN_CHAT_ID
+from audio import process_download, DownloadState, ensure_user_exists, is_user_subscribed, send_subscription_request, probe_video, estimate_format_sizes, format_size, storage_lifecycle, subscription_cache, db
+from config import ADMIN_USER_ID, ADMIN_CHAT_ID, TRACE_SLOW_SECONDS
 from constants import FORMATS
 from generate_cookies import export_youtube_cookies_to_txt
+from metadata_cache import extract_video_id
 from redis_lock import get_all_locks
+from tracing import tracer
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -33,7 +37,7 @@ async def list_locks(message: types.Message):
         return
 
     try:
-        locks = get_all_locks()
+        locks = await get_all_locks()
         if not locks:
             await message.answer("Нет активных блокировок.")
         else:
@@ -42,11 +46,124 @@ async def list_locks(message: types.Message):
         logger.warning(f"Bot is blocked by user {user_id}.")
 
 
+def _format_timestamp(timestamp: int | None) -> str:
+    if not timestamp:
+        return "—"
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+
+
+@router.message(Command("storage"))
+async def storage_report(message: types.Message, command: CommandObject):
+    user_id = message.from_user.id
+    if user_id != ADMIN_USER_ID:
+        try:
+            await message.answer("Нет доступа.")
+        except TelegramForbiddenError:
+            logger.warning(f"Bot is blocked by user {user_id}.")
+        return
+
+    try:
+        # /storage gc - запустить очистку немедленно
+        if (command.args or "").strip() == "gc":
+            await storage_lifecycle.collect()
+
+        report = await storage_lifecycle.report()
+        lines = [
+            f"Объектов: {report['objects']}",
+            f"Занято: {format_size(report['total_size'])}"
+            + (f" из {format_size(report['quota_bytes'])}" if report['quota_bytes'] else " (без квоты)"),
+            f"Срок жизни ссылок: {report['ttl'] // 3600} ч" if report['ttl'] else "Срок жизни ссылок: не ограничен",
+            f"Самый старый файл: {_format_timestamp(report['oldest_created'])}",
+            f"Самое давнее обращение: {_format_timestamp(report['oldest_access'])}",
+        ]
+        last_run = report["last_run"]
+        if last_run:
+            lines.append(
+                f"Последняя очистка: {last_run['finished_at']:%Y-%m-%d %H:%M UTC}, "
+                f"истекло {last_run['expired']}, вытеснено {last_run['evicted']}, "
+                f"брошенных {last_run['orphans']}, освобождено {format_size(last_run['freed_bytes'])}"
+            )
+        else:
+            lines.append("Очистка в этом процессе ещё не запускалась.")
+        await message.answer("\n".join(lines))
+    except TelegramForbiddenError:
+        logger.warning(f"Bot is blocked by user {user_id}.")
+    except Exception as e:
+        logger.error(f"Ошибка отчёта о хранилище: {e}", exc_info=True)
+        await message.answer(f"Не удалось получить отчёт о хранилище: {e}")
+
+
+@router.message(Command("db"))
+async def db_report(message: types.Message):
+    user_id = message.from_user.id
+    if user_id != ADMIN_USER_ID:
+        try:
+            await message.answer("Нет доступа.")
+        except TelegramForbiddenError:
+            logger.warning(f"Bot is blocked by user {user_id}.")
+        return
+
+    stats = db.stats()
+    pool = stats["pool"]
+    acquire = stats["acquire"]
+    lines = [
+        f"Пул: {pool.get('in_use', 0)} занято, {pool.get('idle', 0)} свободно "
+        f"(размер {pool.get('size', 0)}, {pool.get('min', 0)}-{pool.get('max', 0)})",
+        f"Ожидание соединения: p50 {acquire.quantile(0.5) * 1000:.1f} мс, "
+        f"p99 {acquire.quantile(0.99) * 1000:.1f} мс, макс {acquire.max * 1000:.1f} мс",
+        f"Запросов при исчерпанном пуле: {stats['saturated_acquires']}",
+        "",
+        "Запросы (число, p50 / p95 / макс, мс):",
+    ]
+    for label, histogram in sorted(stats["queries"].items(), key=lambda item: -item[1].total):
+        lines.append(
+            f"{label}: {histogram.count}, {histogram.quantile(0.5) * 1000:.1f} / "
+            f"{histogram.quantile(0.95) * 1000:.1f} / {histogram.max * 1000:.1f}"
+        )
+    try:
+        await message.answer("\n".join(lines))
+    except TelegramForbiddenError:
+        logger.warning(f"Bot is blocked by user {user_id}.")
+
+
+@router.message(Command("slow"))
+async def slow_jobs_report(message: types.Message, command: CommandObject):
+    user_id = message.from_user.id
+    if user_id != ADMIN_USER_ID:
+        try:
+            await message.answer("Нет доступа.")
+        except TelegramForbiddenError:
+            logger.warning(f"Bot is blocked by user {user_id}.")
+        return
+
+    # /slow 10 - сколько последних медленных задач показать
+    args = (command.args or "").strip()
+    limit = int(args) if args.isdigit() else 5
+    jobs = await asyncio.to_thread(tracer.slow_jobs, limit, TRACE_SLOW_SECONDS)
+    if not jobs:
+        lines = [f"Задач дольше {TRACE_SLOW_SECONDS:.0f} с не найдено."]
+    else:
+        lines = []
+        for job in jobs:
+            attributes = job["attributes"]
+            started = _format_timestamp(job["start_ns"] // 1_000_000_000)
+            lines.append(
+                f"{attributes.get('job.id', job['trace_id'])[:12]} {attributes.get('job.format', '?')} "
+                f"{job['duration']:.1f} с ({attributes.get('job.outcome', '?')}), {started}"
+            )
+            stages = sorted(job["stages"].items(), key=lambda item: -item[1])
+            lines.append("  " + ", ".join(f"{name} {seconds:.1f} с" for name, seconds in stages))
+    try:
+        await message.answer("\n".join(lines)[:4096])
+    except TelegramForbiddenError:
+        logger.warning(f"Bot is blocked by user {user_id}.")
+
+
 @router.message(Command("check_subscription"))
 async def check_subscription_command(message: types.Message):
     user_id = message.from_user.id
     try:
-        if await is_user_subscribed(user_id):
+        if await is_user_subscribed(user_id, use_cache=False):
             await message.answer("Вы подписаны на все каналы! Теперь вы можете скачивать видео.")
         else:
             await send_subscription_request(message.chat.id)
@@ -58,7 +175,7 @@ async def check_subscription_command(message: types.Message):
 async def check_subscription_callback_handler(callback: types.CallbackQuery):
     user_id = callback.from_user.id
     try:
-        if await is_user_subscribed(user_id):
+        if await is_user_subscribed(user_id, use_cache=False):
             await callback.message.edit_text("Подписка подтверждена! Теперь вы можете скачивать видео.")
             await callback.answer()
         else:
@@ -67,6 +184,12 @@ async def check_subscription_callback_handler(callback: types.CallbackQuery):
         logger.warning(f"Bot is blocked by user {user_id}. Cannot process subscription callback.")
 
 
+@router.chat_member()
+async def chat_member_updated(update: types.ChatMemberUpdated):
+    # Подписка или отписка от обязательного канала: следующая проверка пойдёт в Bot API
+    await subscription_cache.invalidate(update.new_chat_member.user.id)
+
+
 @router.message(Command("start"))
 async def start_command(message: types.Message):
     user_id = message.from_user.id
@@ -95,30 +218,30 @@ async def handle_video_link(message: types.Message, state: FSMContext):
             return
 
         await state.set_state(DownloadState.waiting_for_format)
-        await state.update_data(last_url=message.text)
 
-        cached_sizes = {}
+        try:
+            info = await probe_video(message.text)
+            sizes = estimate_format_sizes(info)
+        except Exception as e:
+            logger.error(f"Ошибка получения информации о видео: {e}")
+            sizes = {}
+
+        # Итог пробы хранится в состоянии, и выбор формата не требует новой пробы на любом экземпляре
+        await state.update_data(last_url=message.text, video_id=extract_video_id(message.text), sizes=sizes)
+
+        # Если пробу выполнить не удалось, показываем все форматы без размеров
+        available_formats = [key for key in FORMATS if key in sizes] or list(FORMATS)
 
         response = "Выберите качество:\n\n"
-        for format_key, format_info in FORMATS.items():
-            key = (message.text, format_key)
-            try:
-                if key in cached_sizes:
-                    size = cached_sizes[key]
-                else:
-                    size = await estimate_video_size(message.text, format_info)
-                    cached_sizes[key] = size
-
-                if size > 0:
-                    size_str = format_size(size)
-                    response += f"/{format_key} - {size_str}\n"
-                else:
-                    response += f"/{format_key}\n"
-            except Exception as e:
+        for format_key in available_formats:
+            size = sizes.get(format_key, 0)
+            if size > 0:
+                response += f"/{format_key} - {format_size(size)}\n"
+            else:
                 response += f"/{format_key}\n"
 
         builder = ReplyKeyboardBuilder()
-        for format_key in FORMATS.keys():
+        for format_key in available_formats:
             builder.add(types.KeyboardButton(text=f"/{format_key}"))
         builder.adjust(3)
 
@@ -143,7 +266,7 @@ async def handle_format_command(message: types.Message, state: FSMContext):
             await message.answer("Сначала отправьте ссылку на видео.")
             return
 
-        await process_download(message, format_key, state)
+        await process_download(message, format_key, state, user_data)
 
         await state.clear()
     except TelegramForbiddenError:
@@ -0,0 +1,254 @@
+import asyncio
+import json
+import logging
+from typing import Awaitable, Callable
+
+from redis.exceptions import ResponseError
+
+from clients.redis_client import redis_client
+from config import JOB_MAX_ATTEMPTS
+from redis_lock import release_user_lock, renew_user_lock
+
+logger = logging.getLogger(__name__)
+
+JOBS_STREAM = "download_jobs"
+DEAD_JOBS_STREAM = "download_jobs:dead"
+JOB_ATTEMPTS_KEY = "download_jobs:attempts"
+EVENTS_STREAM = "download_events"
+WORKERS_GROUP = "workers"
+FRONTEND_GROUP = "frontend"
+
+STREAM_MAXLEN = 10000
+READ_BLOCK_MS = 5000
+# Задача без подтверждения дольше этого срока считается задачей умершего воркера
+CLAIM_IDLE_MS = 2 * 60 * 1000
+# Живой воркер обновляет время простоя своих задач чаще, чем CLAIM_IDLE_MS
+HEARTBEAT_INTERVAL = 30
+
+JobHandler = Callable[[dict, "StreamReporter"], Awaitable[None]]
+EventHandler = Callable[[dict], Awaitable[None]]
+
+
+class RetryableJobError(Exception):
+    """
+    Raised by a job handler when the job failed transiently and should be
+    retried. The message is shown to the user once the attempts run out.
+    """
+
+
+async def ensure_group(redis, stream: str, group: str):
+    try:
+        await redis.xgroup_create(stream, group, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def enqueue_job(job: dict) -> str:
+    """Adds a download job to the shared stream consumed by the workers."""
+    message_id = await redis_client.xadd(
+        JOBS_STREAM, {"job": json.dumps(job)}, maxlen=STREAM_MAXLEN, approximate=True
+    )
+    logger.info(f"Задача {job['job_id']} поставлена в очередь ({message_id.decode()})")
+    return message_id
+
+
+class StreamReporter:
+    """Sends a worker's progress and results back to the frontend as events."""
+
+    def __init__(self, redis, job: dict):
+        self.redis = redis
+        self.route = {
+            "job_id": job["job_id"],
+            "user_id": job["user_id"],
+            "chat_id": job["chat_id"],
+            "status_message_id": job["status_message_id"],
+            "lock_token": job.get("lock_token"),
+            "lock_slot": job.get("lock_slot"),
+        }
+
+    async def _emit(self, event_type: str, **fields):
+        event = dict(self.route, type=event_type, **fields)
+        try:
+            await self.redis.xadd(
+                EVENTS_STREAM, {"event": json.dumps(event)}, maxlen=STREAM_MAXLEN, approximate=True
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось отправить событие {event_type} задачи {self.route['job_id']}: {e}")
+
+    async def progress(self, text: str):
+        await self._emit("progress", text=text)
+
+    async def link(self, public_url: str):
+        await self._emit("link", url=public_url)
+
+    async def error(self, text: str):
+        await self._emit("error", text=text)
+
+    async def done(self):
+        await self._emit("done")
+
+
+class JobWorker:
+    """
+    Consumes download jobs from the Redis Stream as part of the workers
+    consumer group. Jobs are acknowledged once handled; jobs that failed
+    with RetryableJobError or were left pending by a dead worker are
+    reclaimed and retried up to JOB_MAX_ATTEMPTS. The worker renews the
+    user's lock slot while it runs a job and releases it when done.
+    """
+
+    def __init__(self, redis, consumer: str, handler: JobHandler, concurrency: int):
+        self.redis = redis
+        self.consumer = consumer
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def free_slots(self) -> int:
+        return self.concurrency - len(self._tasks)
+
+    async def run(self):
+        await ensure_group(self.redis, JOBS_STREAM, WORKERS_GROUP)
+        logger.info(f"Воркер {self.consumer} ожидает задачи")
+        try:
+            while True:
+                if self.free_slots <= 0:
+                    await asyncio.wait(self._tasks, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+
+                try:
+                    messages = await self._reclaim()
+                    if not messages:
+                        response = await self.redis.xreadgroup(
+                            WORKERS_GROUP, self.consumer, {JOBS_STREAM: ">"},
+                            count=self.free_slots, block=READ_BLOCK_MS,
+                        )
+                        messages = response[0][1] if response else []
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Ошибка чтения очереди задач: {e}")
+                    await asyncio.sleep(1)
+                    continue
+
+                for message_id, fields in messages:
+                    task = asyncio.create_task(self._process(message_id, fields))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+        finally:
+            for task in self._tasks:
+                task.cancel()
+
+    async def _reclaim(self) -> list:
+        _, messages, _ = await self.redis.xautoclaim(
+            JOBS_STREAM, WORKERS_GROUP, self.consumer,
+            min_idle_time=CLAIM_IDLE_MS, start_id="0-0", count=self.free_slots,
+        )
+        if messages:
+            logger.warning(f"Воркер {self.consumer} забрал {len(messages)} зависших задач")
+        return messages
+
+    async def _heartbeat(self, message_id, job: dict):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            try:
+                await self.redis.xclaim(
+                    JOBS_STREAM, WORKERS_GROUP, self.consumer,
+                    min_idle_time=0, message_ids=[message_id], justid=True,
+                )
+            except Exception as e:
+                logger.warning(f"Не удалось продлить задачу {message_id}: {e}")
+            if job.get("lock_token"):
+                # Аренда не истечёт, даже если фронтенд, поставивший задачу, остановлен
+                try:
+                    await renew_user_lock(job["user_id"], job["lock_token"], slot=job.get("lock_slot") or 0)
+                except Exception as e:
+                    logger.warning(f"Не удалось продлить блокировку пользователя {job['user_id']}: {e}")
+
+    async def _ack(self, message_id):
+        await self.redis.xack(JOBS_STREAM, WORKERS_GROUP, message_id)
+        await self.redis.hdel(JOB_ATTEMPTS_KEY, message_id)
+
+    async def _finish(self, message_id, job: dict, reporter: StreamReporter):
+        # Блокировку снимает воркер: событие done может прочитать другой экземпляр фронтенда
+        if job.get("lock_token"):
+            try:
+                await release_user_lock(job["user_id"], job["lock_token"], job.get("lock_slot") or 0)
+            except Exception as e:
+                logger.warning(f"Не удалось снять блокировку пользователя {job['user_id']}: {e}")
+        await reporter.done()
+        await self._ack(message_id)
+
+    async def _dead_letter(self, message_id, fields: dict, job: dict, reporter: StreamReporter, text: str):
+        await self.redis.xadd(DEAD_JOBS_STREAM, fields, maxlen=STREAM_MAXLEN, approximate=True)
+        await reporter.error(text)
+        await self._finish(message_id, job, reporter)
+
+    async def _process(self, message_id, fields: dict | None):
+        if not fields:
+            # Запись уже удалена из потока при обрезке
+            await self._ack(message_id)
+            return
+
+        job = json.loads(fields[b"job"])
+        reporter = StreamReporter(self.redis, job)
+
+        attempts = await self.redis.hincrby(JOB_ATTEMPTS_KEY, message_id, 1)
+        if attempts > JOB_MAX_ATTEMPTS:
+            logger.error(f"Задача {job['job_id']} исчерпала {JOB_MAX_ATTEMPTS} попыток")
+            await self._dead_letter(
+                message_id, fields, job, reporter, "Не удалось выполнить загрузку. Попробуйте позже."
+            )
+            return
+
+        logger.info(f"Воркер {self.consumer} выполняет задачу {job['job_id']} (попытка {attempts})")
+        heartbeat = asyncio.create_task(self._heartbeat(message_id, job))
+        try:
+            await self.handler(job, reporter)
+        except RetryableJobError as e:
+            if attempts >= JOB_MAX_ATTEMPTS:
+                logger.error(f"Задача {job['job_id']} исчерпала {JOB_MAX_ATTEMPTS} попыток: {e}")
+                await self._dead_letter(message_id, fields, job, reporter, str(e))
+                return
+            # Задача остаётся неподтверждённой и будет забрана повторно через CLAIM_IDLE_MS
+            logger.warning(f"Задача {job['job_id']} будет повторена: {e}")
+            await reporter.progress("Не удалось скачать видео, повторная попытка через несколько минут...")
+            return
+        except Exception as e:
+            # Задача остаётся неподтверждённой и будет забрана повторно
+            logger.error(f"Сбой задачи {job['job_id']}: {e}", exc_info=True)
+            return
+        finally:
+            heartbeat.cancel()
+
+        await self._finish(message_id, job, reporter)
+
+
+async def consume_events(consumer: str, handler: EventHandler):
+    """Applies worker events on the frontend side until cancelled."""
+    await ensure_group(redis_client, EVENTS_STREAM, FRONTEND_GROUP)
+    while True:
+        try:
+            _, messages, _ = await redis_client.xautoclaim(
+                EVENTS_STREAM, FRONTEND_GROUP, consumer, min_idle_time=CLAIM_IDLE_MS, start_id="0-0"
+            )
+            if not messages:
+                response = await redis_client.xreadgroup(
+                    FRONTEND_GROUP, consumer, {EVENTS_STREAM: ">"}, count=100, block=READ_BLOCK_MS
+                )
+                messages = response[0][1] if response else []
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка чтения событий воркеров: {e}")
+            await asyncio.sleep(1)
+            continue
+
+        for message_id, fields in messages:
+            try:
+                await handler(json.loads(fields[b"event"]))
+            except Exception as e:
+                logger.error(f"Ошибка обработки события {message_id}: {e}", exc_info=True)
+            await redis_client.xack(EVENTS_STREAM, FRONTEND_GROUP, message_id)
@@ -1,31 +1,175 @@
 import logging
 import asyncio
+import multiprocessing
+import os
+import secrets
+import signal
+import socket
 
 from aiogram import Dispatcher
-from audio import db, bot, logger
+from audio import db, bot, logger, ytdlp_pool, handle_job_event, storage_lifecycle, user_actioner, telegram_governor
+from clients.redis_client import redis_client
+from clients.storage_client import storage_client
+from config import DISPATCH_MODE, USER_ACTIVITY_FLUSH_INTERVAL, FSM_STATE_TTL, FSM_DATA_TTL
+from config import UPDATES_MODE, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT
+from config import WEBHOOK_WORKERS, WEBHOOK_SOCKET_DIR, METRICS_HOST, METRICS_PORT
+from config import DOWNLOAD_CONCURRENCY, POSTPROCESS_CONCURRENCY, UPLOAD_CONCURRENCY, YTDLP_PROCESS_WORKERS
+from download_scheduler import download_scheduler
+from fsm_storage import create_fsm_storage
 from handlers import bot as bot_handlers
+from job_queue import consume_events
+from metrics import register_pipeline_collector, start_metrics_server
+from webhook import UpdateRouter, create_listener_app, create_webhook_app, serve_app, serve_updates, webhook_socket_path
 
-dp = Dispatcher()
+dp = Dispatcher(storage=create_fsm_storage(redis_client, FSM_STATE_TTL, FSM_DATA_TTL))
+dp.include_router(bot_handlers.router)
 
-async def main():
-    dp.include_router(bot_handlers.router)
+# Как часто приёмник проверяет, что процессы-обработчики живы
+WORKER_CHECK_INTERVAL = 5
 
+
+async def set_webhook(secret_token: str):
+    await bot.set_webhook(
+        f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}",
+        secret_token=secret_token,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    logger.info(f"Вебхук установлен: {WEBHOOK_BASE_URL}{WEBHOOK_PATH}")
+
+
+async def receive_updates():
+    if UPDATES_MODE == "webhook":
+        secret_token = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+        await set_webhook(secret_token)
+        await serve_app(create_webhook_app(dp, bot, WEBHOOK_PATH, secret_token), WEBHOOK_HOST, WEBHOOK_PORT)
+    else:
+        await bot.delete_webhook()
+        # chat_member приходит только по явному запросу, поэтому перечисляем используемые типы
+        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+
+
+async def main(update_socket: str | None = None, metrics_port: int = METRICS_PORT):
     logger.info("Бот запущен!")
     try:    
         await db.connect()
         await db.init_db()
+        await db.warm_up()
     except Exception as e:
         logger.critical(f"Ошибка подключения к БД: {e}")
         return
 
+    # Соединения с хранилищем поднимаются в фоне и не задерживают запуск
+    storage_warmup = asyncio.create_task(storage_client.warm_up())
+    register_pipeline_collector(download_scheduler, db, telegram_governor)
+    metrics_server = await start_metrics_server(METRICS_HOST, metrics_port)
+    storage_gc_task = asyncio.create_task(storage_lifecycle.run())
+    activity_flusher = asyncio.create_task(user_actioner.run_flusher(USER_ACTIVITY_FLUSH_INTERVAL))
+
+    events_task = None
+    if DISPATCH_MODE == "stream":
+        # Загрузки выполняют воркеры (worker.py), бот только применяет их события
+        events_task = asyncio.create_task(
+            consume_events(f"{socket.gethostname()}-{os.getpid()}", handle_job_event)
+        )
+
     try:
-        await dp.start_polling(bot)
+        if update_socket is not None:
+            await serve_updates(dp, bot, update_socket)
+        else:
+            await receive_updates()
     finally:
+        if events_task is not None:
+            events_task.cancel()
+        if ytdlp_pool is not None:
+            await ytdlp_pool.close()
+        storage_warmup.cancel()
+        storage_gc_task.cancel()
+        activity_flusher.cancel()
+        await telegram_governor.close()
+        if metrics_server is not None:
+            await metrics_server.cleanup()
+        await storage_client.close()
+        try:
+            await user_actioner.flush()
+        except Exception as e:
+            logger.error(f"Не удалось записать время активности при остановке: {e}")
         await db.close()
 
+
+def update_worker_limits(workers: int) -> dict[str, str]:
+    """
+    Environment for dispatcher processes: each one gets its share of the
+    limits configured for the whole bot, so N processes together stay
+    within them.
+    """
+    def share(total: int) -> str:
+        return str(max(1, total // workers))
+
+    return {
+        "DOWNLOAD_CONCURRENCY": share(DOWNLOAD_CONCURRENCY),
+        "POSTPROCESS_CONCURRENCY": share(POSTPROCESS_CONCURRENCY),
+        "UPLOAD_CONCURRENCY": share(UPLOAD_CONCURRENCY),
+        "YTDLP_PROCESS_WORKERS": share(YTDLP_PROCESS_WORKERS),
+    }
+
+
+def run_update_worker(index: int):
+    """Entry point of a dispatcher process in multi-process webhook mode."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    try:
+        metrics_port = METRICS_PORT + index if METRICS_PORT else 0
+        asyncio.run(main(webhook_socket_path(WEBHOOK_SOCKET_DIR, index), metrics_port))
+    except KeyboardInterrupt:
+        pass
+
+
+def start_update_worker(index: int) -> multiprocessing.Process:
+    process = multiprocessing.get_context("spawn").Process(
+        target=run_update_worker, args=(index,), name=f"updates-{index}"
+    )
+    process.start()
+    return process
+
+
+async def supervise_update_workers(processes: list[multiprocessing.Process]):
+    while True:
+        await asyncio.sleep(WORKER_CHECK_INTERVAL)
+        for index, process in enumerate(processes):
+            if not process.is_alive():
+                logger.error(f"Обработчик обновлений {index} завершился (код {process.exitcode}), перезапуск")
+                processes[index] = start_update_worker(index)
+
+
+async def run_webhook_listener():
+    """
+    Multi-process webhook mode: this process accepts updates on one port and
+    routes them by user to WEBHOOK_WORKERS dispatcher processes.
+    """
+    # Процессы запускаются через spawn и читают конфигурацию заново из окружения
+    os.environ.update(update_worker_limits(WEBHOOK_WORKERS))
+    processes = [start_update_worker(index) for index in range(WEBHOOK_WORKERS)]
+    router = UpdateRouter([webhook_socket_path(WEBHOOK_SOCKET_DIR, index) for index in range(WEBHOOK_WORKERS)])
+    supervisor = asyncio.create_task(supervise_update_workers(processes))
+    secret_token = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    try:
+        await set_webhook(secret_token)
+        await serve_app(create_listener_app(router, WEBHOOK_PATH, secret_token), WEBHOOK_HOST, WEBHOOK_PORT)
+    finally:
+        supervisor.cancel()
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGINT)
+        for process in processes:
+            await asyncio.to_thread(process.join, 30)
+        await bot.session.close()
+
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
     try:
-        asyncio.run(main())
+        if UPDATES_MODE == "webhook" and WEBHOOK_WORKERS > 1:
+            asyncio.run(run_webhook_listener())
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         logging.info("Бот остановлен")
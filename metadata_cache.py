@@ -0,0 +1,212 @@
+import asyncio
+import copy
+import json
+import logging
+import re
+import secrets
+import time
+import zlib
+from typing import Awaitable, Callable, Optional
+from urllib.parse import parse_qs, urlparse
+
+from yt_dlp import YoutubeDL
+
+from clients.redis_client import redis_client
+from lru_cache import LRUCache
+from config import META_CACHE_TTL, META_CACHE_LRU_SIZE
+
+logger = logging.getLogger(__name__)
+
+VIDEO_ID_RE = re.compile(r'(?:[?&]v=|youtu\.be/|embed/|/v/|shorts/|live/)([0-9A-Za-z_-]{11})')
+
+# Запас времени до истечения ссылок на форматы, чтобы скачивание успело завершиться
+URL_EXPIRY_MARGIN = 30 * 60
+# Сколько ждать чужую экстракцию (другой экземпляр бота) перед тем, как выполнить свою
+REMOTE_EXTRACTION_TIMEOUT = 60
+REMOTE_POLL_INTERVAL = 0.5
+
+UNLOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def extract_video_id(url: str) -> Optional[str]:
+    """Returns the canonical 11-character YouTube video ID, or None."""
+    match = VIDEO_ID_RE.search(url)
+    return match.group(1) if match else None
+
+
+def _formats_expire_at(info: dict) -> Optional[int]:
+    """Returns the earliest `expire` timestamp among the format URLs."""
+    expires = []
+    for fmt in info.get('formats') or []:
+        query = parse_qs(urlparse(fmt.get('url') or '').query)
+        try:
+            expires.append(int(query['expire'][0]))
+        except (KeyError, ValueError):
+            continue
+    return min(expires) if expires else None
+
+
+class MetadataCache:
+    """
+    Caches yt-dlp extract_info results keyed by video ID.
+
+    Lookups go through the in-process LRU, then Redis, and only then run the
+    extractor. Concurrent lookups of the same ID share one extraction, both
+    inside the process and across bot instances.
+    """
+
+    def __init__(self, redis, ttl: int, lru_size: int):
+        self.redis = redis
+        self.ttl = ttl
+        self.local = LRUCache(lru_size)
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def _key(video_id: str) -> str:
+        return f"video_meta:{video_id}"
+
+    def _ttl_for(self, info: dict) -> int:
+        ttl = self.ttl
+        expire_at = _formats_expire_at(info)
+        if expire_at is not None:
+            ttl = min(ttl, int(expire_at - time.time() - URL_EXPIRY_MARGIN))
+        return ttl
+
+    async def get_info(self, url: str, extractor: Callable[[str], Awaitable[dict]]) -> dict:
+        """
+        Returns a private copy of the info dict for the URL, extracting it with
+        `extractor` only when no cached copy is available.
+        """
+        video_id = extract_video_id(url)
+        if video_id is None:
+            return await extractor(url)
+
+        info = self.local.get(video_id)
+        if info is not None:
+            logger.debug(f"Метаданные {video_id} взяты из локального кэша")
+            return copy.deepcopy(info)
+
+        future = self._inflight.get(video_id)
+        if future is not None:
+            # Отмена ожидающего не должна отменять общую экстракцию
+            return copy.deepcopy(await asyncio.shield(future))
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[video_id] = future
+        try:
+            info = await self._load(video_id, url, extractor)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение получают ожидающие; помечаем его полученным и здесь
+            future.exception()
+            raise
+        else:
+            future.set_result(info)
+        finally:
+            self._inflight.pop(video_id, None)
+
+        return copy.deepcopy(info)
+
+    async def invalidate(self, url: str):
+        video_id = extract_video_id(url)
+        if video_id is None:
+            return
+        self.local.pop(video_id)
+        try:
+            await self.redis.delete(self._key(video_id))
+        except Exception as e:
+            logger.warning(f"Не удалось удалить метаданные {video_id} из Redis: {e}")
+
+    async def _load(self, video_id: str, url: str, extractor: Callable[[str], Awaitable[dict]]) -> dict:
+        info = await self._get_remote(video_id)
+        if info is not None:
+            return info
+
+        lock_key = f"{self._key(video_id)}:lock"
+        token = secrets.token_hex(8)
+        try:
+            owner = await self.redis.set(lock_key, token, nx=True, ex=REMOTE_EXTRACTION_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Redis недоступен для блокировки метаданных {video_id}: {e}")
+            owner = True
+
+        if not owner:
+            info = await self._wait_remote(video_id)
+            if info is not None:
+                return info
+
+        try:
+            info = YoutubeDL.sanitize_info(await extractor(url), remove_private_keys=True)
+            await self._store(video_id, info)
+            return info
+        finally:
+            if owner:
+                try:
+                    await self.redis.eval(UNLOCK_SCRIPT, 1, lock_key, token)
+                except Exception as e:
+                    logger.warning(f"Не удалось снять блокировку метаданных {video_id}: {e}")
+
+    async def _get_remote(self, video_id: str) -> Optional[dict]:
+        try:
+            payload = await self.redis.get(self._key(video_id))
+            if payload is None:
+                return None
+            ttl = await self.redis.ttl(self._key(video_id))
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать метаданные {video_id} из Redis: {e}")
+            return None
+
+        try:
+            info = json.loads(zlib.decompress(payload))
+        except (zlib.error, ValueError) as e:
+            # Повреждённая или чужая запись считается промахом и удаляется
+            logger.warning(f"Некорректные метаданные {video_id} в Redis, запись удалена: {e}")
+            try:
+                await self.redis.delete(self._key(video_id))
+            except Exception as e:
+                logger.warning(f"Не удалось удалить метаданные {video_id} из Redis: {e}")
+            return None
+        if ttl > 0:
+            self.local.set(video_id, info, ttl)
+        logger.debug(f"Метаданные {video_id} взяты из Redis")
+        return info
+
+    async def _wait_remote(self, video_id: str) -> Optional[dict]:
+        """Waits for another instance to finish extracting the same video."""
+        deadline = time.monotonic() + REMOTE_EXTRACTION_TIMEOUT
+        lock_key = f"{self._key(video_id)}:lock"
+        while time.monotonic() < deadline:
+            await asyncio.sleep(REMOTE_POLL_INTERVAL)
+            info = await self._get_remote(video_id)
+            if info is not None:
+                return info
+            try:
+                if not await self.redis.exists(lock_key):
+                    return None
+            except Exception:
+                return None
+        return None
+
+    async def _store(self, video_id: str, info: dict):
+        ttl = self._ttl_for(info)
+        if ttl <= 0:
+            logger.info(f"Ссылки на форматы {video_id} скоро истекают, метаданные не кэшируются")
+            return
+
+        self.local.set(video_id, info, ttl)
+        payload = zlib.compress(json.dumps(info, separators=(',', ':')).encode('utf-8'))
+        try:
+            await self.redis.set(self._key(video_id), payload, ex=ttl)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить метаданные {video_id} в Redis: {e}")
+
+
+metadata_cache = MetadataCache(redis_client, ttl=META_CACHE_TTL, lru_size=META_CACHE_LRU_SIZE)
@@ -0,0 +1,128 @@
+import logging
+
+from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+from prometheus_client.utils import floatToGoString
+
+from clients.pg_client import LATENCY_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+# Границы для этапов, длящихся от секунд до десятков минут
+STAGE_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, float("inf"))
+# Границы для отдельных команд Redis
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float("inf"))
+# Скорость скачивания и выгрузки: от 100 КиБ/с до 1 ГиБ/с
+THROUGHPUT_BUCKETS = tuple(2 ** power * 100 * 1024 for power in range(14)) + (float("inf"),)
+
+PROBE_SECONDS = Histogram(
+    "ytbot_probe_seconds", "yt-dlp metadata extraction time (metadata cache misses)", buckets=STAGE_BUCKETS
+)
+DOWNLOAD_SECONDS = Histogram(
+    "ytbot_download_seconds", "Media download time, without postprocessing", ["extension"], buckets=STAGE_BUCKETS
+)
+DOWNLOAD_BYTES = Counter("ytbot_download_bytes", "Bytes of finished downloads", ["extension"])
+DOWNLOAD_THROUGHPUT = Histogram(
+    "ytbot_download_throughput_bytes_per_second", "Download throughput per job", buckets=THROUGHPUT_BUCKETS
+)
+POSTPROCESS_SECONDS = Histogram(
+    "ytbot_postprocess_seconds", "ffmpeg postprocessing time", ["extension"], buckets=STAGE_BUCKETS
+)
+TELEGRAM_SEND_SECONDS = Histogram(
+    "ytbot_telegram_send_seconds", "Telegram media send time", ["method"], buckets=STAGE_BUCKETS
+)
+STORAGE_UPLOAD_SECONDS = Histogram(
+    "ytbot_storage_upload_seconds", "SFTP upload time", ["mode"], buckets=STAGE_BUCKETS
+)
+STORAGE_UPLOAD_BYTES = Counter("ytbot_storage_upload_bytes", "Bytes uploaded to the storage host", ["mode"])
+JOB_SECONDS = Histogram(
+    "ytbot_job_seconds", "End-to-end download job time by outcome", ["outcome"], buckets=STAGE_BUCKETS
+)
+REDIS_COMMAND_SECONDS = Histogram(
+    "ytbot_redis_command_seconds", "Redis command latency", ["command"], buckets=REQUEST_BUCKETS
+)
+
+
+def _histogram(name: str, documentation: str, labels: list[str], histograms: dict) -> HistogramMetricFamily:
+    """Converts the pg client's fixed-bucket histograms into a Prometheus family."""
+    family = HistogramMetricFamily(name, documentation, labels=labels)
+    for label_values, histogram in histograms.items():
+        cumulative, buckets = 0, []
+        for bound, count in zip(LATENCY_BUCKETS, histogram.buckets):
+            cumulative += count
+            buckets.append((floatToGoString(bound), cumulative))
+        family.add_metric(list(label_values), buckets, histogram.total)
+    return family
+
+
+class PipelineCollector:
+    """Reads scheduler, Telegram governor and Postgres pool figures at scrape time."""
+
+    def __init__(self, scheduler, db, governor):
+        self.scheduler = scheduler
+        self.db = db
+        self.governor = governor
+
+    def collect(self):
+        active = GaugeMetricFamily("ytbot_stage_active", "Jobs holding a stage slot", labels=["stage"])
+        queued = GaugeMetricFamily("ytbot_stage_queued", "Jobs waiting for a stage slot", labels=["stage"])
+        limit = GaugeMetricFamily("ytbot_stage_concurrency", "Stage slot limit", labels=["stage"])
+        for stage, figures in self.scheduler.snapshot().items():
+            active.add_metric([stage], figures["active"])
+            queued.add_metric([stage], figures["queued"])
+            limit.add_metric([stage], figures["concurrency"])
+        yield from (active, queued, limit)
+
+        yield GaugeMetricFamily(
+            "ytbot_telegram_queued", "Bot API calls waiting for the rate governor", value=self.governor.queued
+        )
+        yield CounterMetricFamily(
+            "ytbot_telegram_coalesced", "Status edits replaced by a newer one", value=self.governor.coalesced_total
+        )
+        yield CounterMetricFamily(
+            "ytbot_telegram_retry_after", "Flood-control responses", value=self.governor.retry_after_total
+        )
+
+        stats = self.db.stats()
+        if stats["pool"]:
+            pool = GaugeMetricFamily("ytbot_postgres_pool_connections", "asyncpg pool connections", labels=["state"])
+            pool.add_metric(["in_use"], stats["pool"]["in_use"])
+            pool.add_metric(["idle"], stats["pool"]["idle"])
+            yield pool
+        yield CounterMetricFamily(
+            "ytbot_postgres_saturated_acquires", "Acquires that found no idle connection",
+            value=stats["saturated_acquires"],
+        )
+        yield _histogram("ytbot_postgres_acquire_seconds", "Pool acquire latency", [], {(): stats["acquire"]})
+        yield _histogram(
+            "ytbot_postgres_query_seconds", "Query latency by statement", ["query"],
+            {(query,): histogram for query, histogram in stats["queries"].items()},
+        )
+
+
+def register_pipeline_collector(scheduler, db, governor):
+    REGISTRY.register(PipelineCollector(scheduler, db, governor))
+
+
+def create_metrics_app() -> web.Application:
+    async def handle(request: web.Request) -> web.Response:
+        response = web.Response(body=generate_latest(REGISTRY))
+        response.content_type = CONTENT_TYPE_LATEST.split(";")[0]
+        response.charset = "utf-8"
+        return response
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    return app
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner | None:
+    """Serves /metrics in the running event loop; port 0 disables the endpoint."""
+    if not port:
+        return None
+    runner = web.AppRunner(create_metrics_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на {host}:{port}/metrics")
+    return runner
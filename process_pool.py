@@ -0,0 +1,167 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+from typing import Awaitable, Callable
+
+from ytdlp_worker import is_ffmpeg_start
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ytdlp_worker.py")
+# Сообщения воркера небольшие, но лимит строки берём с запасом
+STREAM_LIMIT = 1024 * 1024
+
+
+class WorkerError(Exception):
+    """Raised when a pool worker fails, dies or exceeds its job timeout."""
+
+
+class JobError(WorkerError):
+    """Raised when yt-dlp fails inside an otherwise healthy worker."""
+
+
+class _Worker:
+    def __init__(self, proc: asyncio.subprocess.Process):
+        self.proc = proc
+
+    @property
+    def alive(self) -> bool:
+        return self.proc.returncode is None
+
+    async def send(self, message: dict):
+        self.proc.stdin.write((json.dumps(message, separators=(',', ':')) + '\n').encode('utf-8'))
+        await self.proc.stdin.drain()
+
+    async def receive(self) -> dict:
+        line = await self.proc.stdout.readline()
+        if not line:
+            raise WorkerError(f"Воркер yt-dlp (pid {self.proc.pid}) завершился")
+        return json.loads(line)
+
+    async def kill(self):
+        if self.alive:
+            # Воркер - лидер своей группы процессов; вместе с ним останавливаем запущенный им ffmpeg
+            try:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        await self.proc.wait()
+
+
+def _paused_during(deadline: asyncio.Timeout, on_postprocess: Callable[[dict], Awaitable[None]]):
+    async def handle(data: dict):
+        # Ожидание слота постобработки в планировщике не входит в лимит времени задачи
+        loop = asyncio.get_running_loop()
+        remaining = deadline.when() - loop.time()
+        deadline.reschedule(None)
+        try:
+            await on_postprocess(data)
+        finally:
+            deadline.reschedule(loop.time() + remaining)
+
+    return handle
+
+
+class YtdlpProcessPool:
+    """
+    Pool of long-lived yt-dlp worker processes.
+
+    Each worker handles one job at a time and streams progress and
+    postprocessor events back over its stdout. A job that exceeds the
+    timeout gets its worker and its children killed and replaced; time
+    spent waiting for a postprocess slot does not count.
+    """
+
+    def __init__(self, size: int, job_timeout: float):
+        self.size = max(1, size)
+        self.job_timeout = job_timeout
+        self._spawned = 0
+        self._idle: asyncio.Queue[_Worker] = asyncio.Queue()
+
+    async def _spawn(self) -> _Worker:
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, WORKER_SCRIPT,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            limit=STREAM_LIMIT,
+            start_new_session=True,
+        )
+        logger.info(f"Запущен воркер yt-dlp, pid {proc.pid}")
+        return _Worker(proc)
+
+    async def _get_worker(self) -> _Worker:
+        if self._idle.empty() and self._spawned < self.size:
+            self._spawned += 1
+            try:
+                return await self._spawn()
+            except Exception:
+                self._spawned -= 1
+                raise
+        return await self._idle.get()
+
+    async def run(
+        self,
+        ydl_opts: dict,
+        info: dict,
+        url: str,
+        on_progress: Callable[[dict], None],
+        on_postprocess: Callable[[dict], Awaitable[None]],
+    ) -> tuple[dict, bool]:
+        """Runs ytdlp_worker.run_ytdlp in a worker process and returns its result."""
+        worker = await self._get_worker()
+        try:
+            async with asyncio.timeout(self.job_timeout) as deadline:
+                return await self._run_job(
+                    worker, ydl_opts, info, url, on_progress, _paused_during(deadline, on_postprocess)
+                )
+        except TimeoutError:
+            logger.error(f"Воркер yt-dlp (pid {worker.proc.pid}) превысил лимит {self.job_timeout} с и будет остановлен")
+            await worker.kill()
+            raise WorkerError(f"Превышено время обработки ({self.job_timeout} с)")
+        except JobError:
+            raise
+        except BaseException:
+            # Состояние воркера после сбоя или отмены неизвестно, заменяем его
+            await worker.kill()
+            raise
+        finally:
+            if not worker.alive:
+                self._spawned -= 1
+            else:
+                self._idle.put_nowait(worker)
+
+    async def _run_job(
+        self,
+        worker: _Worker,
+        ydl_opts: dict,
+        info: dict,
+        url: str,
+        on_progress: Callable[[dict], None],
+        on_postprocess: Callable[[dict], Awaitable[None]],
+    ) -> tuple[dict, bool]:
+        await worker.send({"type": "job", "opts": ydl_opts, "info": info, "url": url})
+        while True:
+            message = await worker.receive()
+            if message["type"] == "progress":
+                on_progress(message["data"])
+            elif message["type"] == "postprocess":
+                await on_postprocess(message["data"])
+                if is_ffmpeg_start(message["data"]):
+                    await worker.send({"type": "ack"})
+            elif message["type"] == "done":
+                return message["summary"], message["reextracted"]
+            elif message["type"] == "error":
+                raise JobError(message["message"])
+
+    async def close(self):
+        while not self._idle.empty():
+            worker = self._idle.get_nowait()
+            worker.proc.stdin.close()
+            try:
+                await asyncio.wait_for(worker.proc.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                await worker.kill()
+        self._spawned = 0
@@ -1,25 +1,93 @@
-import redis
-import time
-from config import REDIS_HOST, REDIS_PORT
-
-r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
-
-def acquire_user_lock(user_id: int, ttl: int = 600) -> bool:
-    
-    key = f"user_lock:{user_id}"
-    result = r.setnx(key, int(time.time()))
-    if result:
-        r.expire(key, ttl)
-    return result
-
-def release_user_lock(user_id: int):
-    r.delete(f"user_lock:{user_id}")
-    
-def get_all_locks(pattern: str = "user_lock:*") -> list[str]:
+import asyncio
+import logging
+import secrets
+from typing import Optional
+
+from clients.redis_client import redis_client
+from config import USER_MAX_JOBS
+
+logger = logging.getLogger(__name__)
+
+r = redis_client
+
+# Срок аренды блокировки; пока задача жива, аренда продлевается каждую треть срока
+LOCK_TTL_MS = 60 * 1000
+
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def _key(user_id: int, slot: int = 0) -> str:
+    # Первый слот сохраняет прежнее имя ключа
+    return f"user_lock:{user_id}" if slot == 0 else f"user_lock:{user_id}:{slot}"
+
+
+class UserLock:
+    """A held user lock slot. The lease is renewed in the background until release()."""
+
+    def __init__(self, user_id: int, token: str, ttl_ms: int, slot: int = 0):
+        self.user_id = user_id
+        self.token = token
+        self.ttl_ms = ttl_ms
+        self.slot = slot
+        self._renew_task = asyncio.create_task(self._renew())
+
+    async def _renew(self):
+        while True:
+            await asyncio.sleep(self.ttl_ms / 3000)
+            try:
+                if not await renew_user_lock(self.user_id, self.token, self.ttl_ms, self.slot):
+                    logger.warning(f"Блокировка пользователя {self.user_id} потеряна")
+                    return
+            except Exception as e:
+                logger.warning(f"Не удалось продлить блокировку пользователя {self.user_id}: {e}")
+
+    def add_done_callback(self, callback):
+        """Calls callback(lock) once renewal stops: the lock was released or lost."""
+        self._renew_task.add_done_callback(lambda _: callback(self))
+
+    async def release(self) -> bool:
+        self._renew_task.cancel()
+        return await release_user_lock(self.user_id, self.token, self.slot)
+
+
+async def acquire_user_lock(user_id: int, ttl_ms: int = LOCK_TTL_MS, slots: int = 1) -> Optional[UserLock]:
+    """
+    Atomically takes the first free of the user's `slots` lock slots;
+    returns None if all of them are held.
+    """
+    token = secrets.token_hex(16)
+    for slot in range(max(1, slots)):
+        if await r.set(_key(user_id, slot), token, nx=True, px=ttl_ms):
+            return UserLock(user_id, token, ttl_ms, slot)
+    return None
+
+
+async def renew_user_lock(user_id: int, token: str, ttl_ms: int = LOCK_TTL_MS, slot: int = 0) -> bool:
+    return bool(await r.eval(RENEW_SCRIPT, 1, _key(user_id, slot), token, ttl_ms))
+
+
+async def release_user_lock(user_id: int, token: str, slot: int = 0) -> bool:
+    """Releases the lock slot only if it is still held with the given token."""
+    return bool(await r.eval(RELEASE_SCRIPT, 1, _key(user_id, slot), token))
+
+
+async def get_all_locks(pattern: str = "user_lock:*") -> list[str]:
     """Вернёт все активные ключи блокировок пользователей."""
-    return [key.decode("utf-8") for key in r.scan_iter(match=pattern)]
+    return [key.decode("utf-8") async for key in r.scan_iter(match=pattern)]
 
-def is_locked(user_id: int) -> bool:
-    """Проверяет, есть ли блокировка для конкретного пользователя."""
-    return r.exists(f"user_lock:{user_id}") == 1
 
+async def is_locked(user_id: int, slots: int = USER_MAX_JOBS) -> bool:
+    """Проверяет, занят ли у пользователя хотя бы один из слотов блокировки."""
+    return await r.exists(*(_key(user_id, slot) for slot in range(max(1, slots)))) > 0
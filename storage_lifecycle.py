@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+
+from clients.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+GC_LOCK_KEY = "storage_gc:lock"
+# Недавно выданные ссылки не удаляются ради квоты, пользователь мог ещё не скачать файл
+ACCESS_GRACE_PERIOD = timedelta(hours=1)
+# Брошенные .part-файлы прерванных загрузок
+STALE_PART_AGE = 24 * 3600
+# Файлы, загруженные до появления индекса (temp_<user>_<timestamp>.<ext>)
+LEGACY_PREFIX = "temp_"
+
+
+class StorageLifecycleManager:
+    """
+    Garbage collector for the storage host. Objects older than the TTL are
+    deleted unless a link to them was handed out within ACCESS_GRACE_PERIOD,
+    and when the indexed total exceeds the quota the least recently
+    used objects are evicted. Only one process runs a collection at a time.
+    """
+
+    def __init__(self, storage, objects, quota_bytes: int, ttl: int, interval: int, batch_size: int):
+        self.storage = storage
+        self.objects = objects
+        self.quota_bytes = quota_bytes
+        self.ttl = ttl
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.last_run: dict | None = None
+
+    async def _delete(self, rows) -> tuple[int, int]:
+        names = [row["remote_name"] for row in rows]
+        sizes = {row["remote_name"]: row["size"] for row in rows}
+        removed = await self.storage.delete_files(names)
+        if removed:
+            await self.objects.delete_objects(removed)
+        return len(removed), sum(sizes[name] for name in removed)
+
+    async def _expire(self, now: datetime) -> tuple[int, int]:
+        count, freed = 0, 0
+        while True:
+            # Ссылку на объект могли выдать незадолго до истечения TTL
+            rows = await self.objects.get_expired(
+                now - timedelta(seconds=self.ttl), now - ACCESS_GRACE_PERIOD, self.batch_size
+            )
+            if not rows:
+                break
+            deleted, deleted_bytes = await self._delete(rows)
+            count += deleted
+            freed += deleted_bytes
+            if deleted < len(rows):
+                # Остальное удалим в следующий проход, чтобы не зациклиться на ошибке
+                break
+        return count, freed
+
+    async def _evict(self, now: datetime) -> tuple[int, int]:
+        stats = await self.objects.get_stats()
+        excess = stats["total_size"] - self.quota_bytes
+        count, freed = 0, 0
+        while excess > 0:
+            rows = await self.objects.get_eviction_candidates(excess, now - ACCESS_GRACE_PERIOD, self.batch_size)
+            if not rows:
+                logger.warning(f"Квота хранилища превышена на {excess} байт, но все файлы недавно использовались")
+                break
+            deleted, deleted_bytes = await self._delete(rows)
+            count += deleted
+            freed += deleted_bytes
+            excess -= deleted_bytes
+            if deleted < len(rows):
+                break
+        return count, freed
+
+    async def _sweep_orphans(self) -> tuple[int, int]:
+        now = time.time()
+        stale = {}
+        for name, size, mtime in await self.storage.list_files():
+            if name.endswith(".part") and now - mtime > STALE_PART_AGE:
+                stale[name] = size
+            elif name.startswith(LEGACY_PREFIX) and self.ttl and now - mtime > self.ttl:
+                stale[name] = size
+        if not stale:
+            return 0, 0
+
+        # Проиндексированные файлы удаляются по TTL и квоте
+        for name in await self.objects.get_known_names(list(stale)):
+            stale.pop(name)
+        removed = await self.storage.delete_files(list(stale))
+        return len(removed), sum(stale[name] for name in removed)
+
+    async def collect(self) -> dict:
+        """Runs one collection pass and returns what was deleted."""
+        started = time.monotonic()
+        now = datetime.now(timezone.utc)
+        result = {"expired": 0, "evicted": 0, "orphans": 0, "freed_bytes": 0}
+
+        if self.ttl:
+            result["expired"], freed = await self._expire(now)
+            result["freed_bytes"] += freed
+        if self.quota_bytes:
+            result["evicted"], freed = await self._evict(now)
+            result["freed_bytes"] += freed
+        result["orphans"], freed = await self._sweep_orphans()
+        result["freed_bytes"] += freed
+
+        result["finished_at"] = datetime.now(timezone.utc)
+        result["duration"] = time.monotonic() - started
+        self.last_run = result
+        logger.info(
+            f"Очистка хранилища: истекло {result['expired']}, вытеснено {result['evicted']}, "
+            f"брошенных {result['orphans']}, освобождено {result['freed_bytes']} байт"
+        )
+        return result
+
+    async def run(self):
+        """Collects garbage every `interval` seconds until cancelled."""
+        owner = f"{socket.gethostname()}-{os.getpid()}"
+        while True:
+            try:
+                if await redis_client.set(GC_LOCK_KEY, owner, nx=True, ex=self.interval):
+                    await self.collect()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка очистки хранилища: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def report(self) -> dict:
+        stats = await self.objects.get_stats()
+        return {
+            "objects": stats["objects"],
+            "total_size": stats["total_size"],
+            "oldest_created": stats["oldest_created"],
+            "oldest_access": stats["oldest_access"],
+            "quota_bytes": self.quota_bytes,
+            "ttl": self.ttl,
+            "last_run": self.last_run,
+        }
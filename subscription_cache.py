@@ -0,0 +1,46 @@
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "subscribed"
+
+
+class SubscriptionCache:
+    """
+    Caches the result of the required-channels check per user in Redis.
+    Positive results live longer than negative ones, so a user who has just
+    subscribed is not kept waiting; chat_member updates invalidate both.
+    """
+
+    def __init__(self, redis, positive_ttl: int, negative_ttl: int):
+        self.redis = redis
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"{KEY_PREFIX}:{user_id}"
+
+    async def get(self, user_id: int) -> Optional[bool]:
+        try:
+            value = await self.redis.get(self._key(user_id))
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать кэш подписки {user_id}: {e}")
+            return None
+        return None if value is None else value == b"1"
+
+    async def set(self, user_id: int, subscribed: bool):
+        ttl = self.positive_ttl if subscribed else self.negative_ttl
+        if ttl <= 0:
+            return
+        try:
+            await self.redis.set(self._key(user_id), b"1" if subscribed else b"0", ex=ttl)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить кэш подписки {user_id}: {e}")
+
+    async def invalidate(self, user_id: int):
+        try:
+            await self.redis.delete(self._key(user_id))
+        except Exception as e:
+            logger.warning(f"Не удалось сбросить кэш подписки {user_id}: {e}")
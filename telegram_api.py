@@ -0,0 +1,44 @@
+import logging
+import os
+from pathlib import Path
+
+from aiogram import Bot, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import SimpleFilesPathWrapper, TelegramAPIServer
+
+from config import TELEGRAM_API_URL, TELEGRAM_API_LOCAL, TELEGRAM_API_FILES_DIR, TELEGRAM_SEND_STRATEGY
+from config import DOWNLOAD_DIR
+
+logger = logging.getLogger(__name__)
+
+
+def build_api_server(base_url: str, is_local: bool, files_dir: str | None = None) -> TelegramAPIServer:
+    """
+    Describes a self-hosted Bot API server. `files_dir` is DOWNLOAD_DIR as
+    mounted on the server, if it differs from the local path.
+    """
+    options = {"is_local": is_local}
+    if files_dir:
+        options["wrap_local_file"] = SimpleFilesPathWrapper(server_path=Path(files_dir), local_path=Path(DOWNLOAD_DIR).resolve())
+    return TelegramAPIServer.from_base(base_url, **options)
+
+
+def create_bot(token: str) -> Bot:
+    if not TELEGRAM_API_URL:
+        return Bot(token=token)
+
+    logger.info(f"Используется сервер Bot API {TELEGRAM_API_URL} (local={TELEGRAM_API_LOCAL})")
+    session = AiohttpSession(api=build_api_server(TELEGRAM_API_URL, TELEGRAM_API_LOCAL, TELEGRAM_API_FILES_DIR))
+    return Bot(token=token, session=session)
+
+
+def file_input(bot: Bot, path: str, strategy: str = TELEGRAM_SEND_STRATEGY) -> types.InputFile | str:
+    """
+    Returns what to pass to a send method for a file on disk: a multipart
+    upload, or a file:// URI that a local Bot API server reads directly.
+    """
+    api = bot.session.api
+    if strategy == "path" and api.is_local:
+        server_path = api.wrap_local_file.to_server(os.path.abspath(path))
+        return Path(server_path).as_uri()
+    return types.FSInputFile(path)
@@ -0,0 +1,297 @@
+import asyncio
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты исходящих вызовов: чем меньше число, тем раньше вызов уходит в Telegram
+DELIVERY = 0
+PROGRESS = 1
+BACKGROUND = 2
+
+TelegramCall = Callable[[], Awaitable[Any]]
+
+# Общий для всех процессов бота и воркеров глобальный лимит Bot API
+GLOBAL_BUCKET_KEY = "telegram:global_bucket"
+
+# Тот же алгоритм, что в TokenBucket, но состояние хранится в Redis, а время берётся у Redis.
+# Возвращает 0, если токен взят, иначе сколько секунд ждать; дробь передаётся строкой
+TAKE_TOKEN_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local time = redis.call('time')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('hmget', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('hset', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('pexpire', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available."""
+        self._refill(now)
+        wait = self.blocked_until - now
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return max(0.0, wait)
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds: float, now: float):
+        """Blocks the bucket after a flood-control error."""
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0.0
+        self.updated = now
+
+    def idle(self, now: float) -> bool:
+        return self.delay(now) == 0 and self.tokens >= self.capacity
+
+
+class SharedTokenBucket:
+    """Token bucket kept in Redis, so that all processes together stay within `rate`."""
+
+    def __init__(self, redis, key: str, rate: float, capacity: float):
+        self.redis = redis
+        self.key = key
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+
+    async def take(self) -> float:
+        """Takes a token and returns 0, or returns the seconds until one is available."""
+        return float(await self.redis.eval(TAKE_TOKEN_SCRIPT, 1, self.key, self.rate, self.capacity))
+
+
+class _Call:
+    __slots__ = ("priority", "seq", "chat_id", "factory", "future", "coalesce_key", "attempts")
+
+    def __init__(self, priority: int, seq: int, chat_id: int, factory: TelegramCall, coalesce_key: Optional[Hashable]):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.factory = factory
+        self.future = asyncio.get_running_loop().create_future()
+        self.coalesce_key = coalesce_key
+        self.attempts = 0
+
+
+class TelegramRateGovernor:
+    """
+    Paces outbound Bot API calls with a global and a per-chat token bucket.
+
+    Pending calls are started in priority order, so result delivery overtakes
+    progress edits. With a Redis client the global bucket is shared by all
+    processes of the bot; if Redis fails, a local bucket is used instead. Calls with the same `coalesce_key` (the status message)
+    replace each other while queued, and only the latest text is sent. A
+    flood-control error pauses the chat and puts the call back in the queue.
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float, max_retries: int, redis=None):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.shared_bucket = (
+            SharedTokenBucket(redis, GLOBAL_BUCKET_KEY, global_rate, global_rate) if redis is not None else None
+        )
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._pending: list[_Call] = []
+        self._coalesced: dict[Hashable, _Call] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._running: set[asyncio.Task] = set()
+        self.coalesced_total = 0
+        self.retry_after_total = 0
+
+    @property
+    def queued(self) -> int:
+        return len(self._pending)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _enqueue(self, call: _Call):
+        self._pending.append(call)
+        if call.coalesce_key is not None:
+            self._coalesced[call.coalesce_key] = call
+        self._wakeup.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def submit(
+        self,
+        chat_id: int,
+        factory: TelegramCall,
+        priority: int = DELIVERY,
+        coalesce_key: Optional[Hashable] = None,
+    ) -> Any:
+        """
+        Queues `factory()` and returns its result. A coalesced call that was
+        replaced by a newer one before it was sent returns None.
+        """
+        previous = self._coalesced.get(coalesce_key) if coalesce_key is not None else None
+        if previous is not None:
+            # Ещё не отправленная правка заменяется новой и сохраняет своё место в очереди
+            previous.factory = factory
+            self.coalesced_total += 1
+            future = asyncio.get_running_loop().create_future()
+            previous.future, future = future, previous.future
+            if not future.done():
+                future.set_result(None)
+            return await previous.future
+
+        call = _Call(priority, next(self._seq), chat_id, factory, coalesce_key)
+        self._enqueue(call)
+        return await call.future
+
+    def discard(self, coalesce_key: Hashable):
+        """Drops a queued coalesced call, e.g. before its message is deleted."""
+        call = self._coalesced.pop(coalesce_key, None)
+        if call is not None:
+            self._pending.remove(call)
+            if not call.future.done():
+                call.future.set_result(None)
+
+    async def close(self):
+        """Stops the dispatcher; calls that were not started yet are cancelled."""
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        for call in self._pending:
+            call.future.cancel()
+        self._pending.clear()
+        self._coalesced.clear()
+
+    def _next_ready(self, now: float) -> tuple[Optional[_Call], float]:
+        wait = self.global_bucket.delay(now) if self.shared_bucket is None else 0.0
+        if wait > 0:
+            return None, wait
+        for call in sorted(self._pending, key=lambda c: (c.priority, c.seq)):
+            delay = self._chat_bucket(call.chat_id).delay(now)
+            if delay <= 0:
+                return call, 0.0
+            wait = delay if wait <= 0 else min(wait, delay)
+        return None, wait
+
+    def _prune(self, now: float):
+        for chat_id, bucket in list(self._chat_buckets.items()):
+            if bucket.idle(now):
+                del self._chat_buckets[chat_id]
+
+    async def _take_shared(self) -> float:
+        try:
+            return await self.shared_bucket.take()
+        except Exception as e:
+            logger.warning(f"Общий лимит Telegram в Redis недоступен, используется локальный: {e}")
+            now = time.monotonic()
+            wait = self.global_bucket.delay(now)
+            if wait <= 0:
+                self.global_bucket.take(now)
+            return wait
+
+    async def _sleep(self, wait: float):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _dispatch(self):
+        while True:
+            if not self._pending:
+                self._prune(time.monotonic())
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            call, wait = self._next_ready(now)
+            if call is None:
+                await self._sleep(wait)
+                continue
+
+            if self.shared_bucket is not None:
+                wait = await self._take_shared()
+                if wait > 0:
+                    # Ожидание в общей очереди не будится новыми вызовами: токена всё равно нет
+                    await asyncio.sleep(wait)
+                    continue
+                if call not in self._pending:
+                    # Пока брали токен, вызов заменили или отменили
+                    continue
+                now = time.monotonic()
+
+            self._pending.remove(call)
+            if call.coalesce_key is not None and self._coalesced.get(call.coalesce_key) is call:
+                del self._coalesced[call.coalesce_key]
+            if call.future.done():
+                # Вызывающий уже отменил ожидание
+                continue
+            if self.shared_bucket is None:
+                self.global_bucket.take(now)
+            self._chat_bucket(call.chat_id).take(now)
+            task = asyncio.create_task(self._run(call))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, call: _Call):
+        call.attempts += 1
+        try:
+            result = await call.factory()
+        except TelegramRetryAfter as e:
+            self.retry_after_total += 1
+            self._chat_bucket(call.chat_id).pause(e.retry_after, time.monotonic())
+            if call.attempts > self.max_retries:
+                if not call.future.done():
+                    call.future.set_exception(e)
+                return
+            logger.warning(f"Flood control в чате {call.chat_id}, повтор через {e.retry_after} с")
+            newer = self._coalesced.get(call.coalesce_key) if call.coalesce_key is not None else None
+            if newer is not None or call.future.done():
+                # Пока ждали, пришла более свежая правка, эта уже не нужна
+                if not call.future.done():
+                    call.future.set_result(None)
+                return
+            self._enqueue(call)
+        except BaseException as e:
+            if not call.future.done():
+                call.future.set_exception(e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        else:
+            if not call.future.done():
+                call.future.set_result(result)
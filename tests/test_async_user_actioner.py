@@ -0,0 +1,123 @@
+import json
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from clients.async_user_actioner import AsyncUserActioner, MISSING
+
+
+def make_row(user_id: int) -> dict:
+    return {"user_id": user_id, "username": "user", "chat_id": user_id, "last_updated_date": 1700000000}
+
+
+@pytest.fixture
+def mock_db():
+    """Фикстура клиента Postgres."""
+    mock = AsyncMock()
+    mock.register_statements = MagicMock()
+    mock.fetch.return_value = [make_row(1)]
+    return mock
+
+
+@pytest.fixture
+def mock_redis():
+    """Фикстура асинхронного клиента Redis без сохранённых значений."""
+    mock = AsyncMock()
+    mock.get.return_value = None
+    return mock
+
+
+@pytest.mark.asyncio
+async def test_known_user_skips_postgres(mock_db, mock_redis):
+    """Тест: повторный запрос известного пользователя не идёт в Postgres."""
+    actioner = AsyncUserActioner(mock_db, mock_redis)
+
+    first = await actioner.get_user(1)
+    second = await actioner.get_user(1)
+
+    assert first == second
+    assert first["user_id"] == 1
+    mock_db.fetch.assert_awaited_once()
+    mock_redis.set.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_shared_tier_is_used_before_postgres(mock_db, mock_redis):
+    """Тест: пользователь из Redis не запрашивается в Postgres."""
+    mock_redis.get.return_value = json.dumps(make_row(1)).encode()
+    actioner = AsyncUserActioner(mock_db, mock_redis)
+
+    user = await actioner.get_user(1)
+
+    assert user["last_updated_date"] == datetime.fromtimestamp(1700000000)
+    mock_db.fetch.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_missing_user_is_cached_briefly(mock_db, mock_redis):
+    """Тест: отсутствие пользователя кэшируется с коротким TTL."""
+    mock_db.fetch.return_value = []
+    actioner = AsyncUserActioner(mock_db, mock_redis, negative_ttl=5)
+
+    assert await actioner.get_user(2) is None
+    assert await actioner.get_user(2) is None
+
+    mock_db.fetch.assert_awaited_once()
+    mock_redis.set.assert_awaited_once_with("user:2", MISSING, ex=5)
+
+
+@pytest.mark.asyncio
+async def test_create_user_replaces_negative_entry(mock_db, mock_redis):
+    """Тест: созданный пользователь сразу считается известным."""
+    mock_db.fetch.return_value = []
+    actioner = AsyncUserActioner(mock_db, mock_redis)
+    assert await actioner.get_user(3) is None
+
+    await actioner.create_user(3, "new", 3, datetime.now())
+
+    assert (await actioner.get_user(3))["username"] == "new"
+    mock_db.fetch.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_works_without_redis(mock_db):
+    """Тест: без Redis используется только локальный кэш."""
+    actioner = AsyncUserActioner(mock_db)
+
+    await actioner.get_user(1)
+    await actioner.get_user(1)
+
+    mock_db.fetch.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_update_date_is_batched(mock_db):
+    """Тест: время активности пишется одним запросом на пакет."""
+    actioner = AsyncUserActioner(mock_db)
+
+    await actioner.update_date(1, datetime.fromtimestamp(100))
+    await actioner.update_date(2, datetime.fromtimestamp(200))
+    await actioner.update_date(1, datetime.fromtimestamp(300))
+    mock_db.execute.assert_not_awaited()
+
+    await actioner.flush()
+    await actioner.flush()
+
+    mock_db.execute.assert_awaited_once()
+    assert mock_db.execute.await_args.args[1] == ([1, 2], [300, 200])
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_pending_dates(mock_db):
+    """Тест: при ошибке записи отметки остаются в буфере."""
+    actioner = AsyncUserActioner(mock_db)
+    await actioner.update_date(1, datetime.fromtimestamp(100))
+    mock_db.execute.side_effect = ConnectionError("db is down")
+
+    with pytest.raises(ConnectionError):
+        await actioner.flush()
+
+    mock_db.execute.side_effect = None
+    await actioner.flush()
+    assert mock_db.execute.await_args.args[1] == ([1], [100])
@@ -0,0 +1,38 @@
+import pytest
+
+from bench.report import percentile, stage_durations, summarize
+from tracing import JsonlTracer, span
+
+
+def test_percentile_nearest_rank():
+    """Тест: перцентили считаются по ближайшему рангу."""
+    values = [float(value) for value in range(1, 101)]
+
+    assert percentile(values, 0.5) == 50
+    assert percentile(values, 0.95) == 95
+    assert percentile(values, 0.99) == 99
+    assert percentile([3.0], 0.99) == 3
+    assert percentile([], 0.5) == 0
+
+
+@pytest.mark.asyncio
+async def test_stage_durations_from_traces(tmp_path):
+    """Тест: длительности этапов собираются по задачам из журнала трасс, фрагменты пропускаются."""
+    path = tmp_path / "traces.jsonl"
+    tracer = JsonlTracer(str(path), 0)
+    for _ in range(2):
+        async with tracer.trace("run_download_job"):
+            with span("queue_download"):
+                pass
+            with span("download"):
+                with span("download_fragment"):
+                    pass
+            with span("queue_download"):
+                pass
+
+    stages = stage_durations(str(path))
+    summary = summarize(stages)
+
+    assert set(stages) == {"run_download_job", "queue_download", "download"}
+    assert summary["queue_download"]["count"] == 2
+    assert summary["download"]["p99"] <= summary["run_download_job"]["max"]
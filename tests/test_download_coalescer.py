@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+
+import download_coalescer
+from download_coalescer import RELEASE_SCRIPT, RENEW_SCRIPT, DownloadCoalescer
+
+
+class FakePubSub:
+    def __init__(self, redis):
+        self.redis = redis
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def subscribe(self, channel):
+        self.redis.subscribers.setdefault(channel, []).append(self)
+
+    async def get_message(self, ignore_subscribe_messages=True, timeout=1.0):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def unsubscribe(self):
+        for subscribers in self.redis.subscribers.values():
+            if self in subscribers:
+                subscribers.remove(self)
+
+    async def aclose(self):
+        pass
+
+
+class FakeRedis:
+    """Хранилище в памяти с командами, которые использует объединение загрузок."""
+
+    def __init__(self):
+        self.values = {}
+        self.subscribers = {}
+        self.renewals = 0
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def delete(self, key):
+        return int(self.values.pop(key, None) is not None)
+
+    async def exists(self, key):
+        return int(key in self.values)
+
+    async def eval(self, script, numkeys, key, token, *args):
+        if self.values.get(key) != token:
+            return 0
+        if script == RENEW_SCRIPT:
+            self.renewals += 1
+            return 1
+        if script == RELEASE_SCRIPT:
+            return await self.delete(key)
+        raise AssertionError("unknown script")
+
+    async def publish(self, channel, data):
+        for subscriber in self.subscribers.get(channel, []):
+            subscriber.queue.put_nowait({"type": "message", "data": data})
+
+    def pubsub(self):
+        return FakePubSub(self)
+
+
+async def ignore_progress(text):
+    pass
+
+
+@pytest.mark.asyncio
+async def test_follower_gets_owner_progress_and_result():
+    """Тест: второй запрос не скачивает сам, а получает прогресс и результат владельца."""
+    coalescer = DownloadCoalescer(FakeRedis())
+    owner = await coalescer.acquire("vid", "mp3")
+    assert await coalescer.acquire("vid", "mp3") is None
+
+    progress = []
+
+    async def on_progress(text):
+        progress.append(text)
+
+    follower = asyncio.create_task(coalescer.follow("vid", "mp3", on_progress))
+    await asyncio.sleep(0.01)
+    await owner.publish_progress("50%")
+    await owner.finish({"kind": "file_id", "file_id": "abc"})
+    await owner.release()
+
+    assert await follower == {"kind": "file_id", "file_id": "abc"}
+    assert progress == ["50%"]
+    # После освобождения следующий запрос снова становится владельцем
+    successor = await coalescer.acquire("vid", "mp3")
+    assert successor is not None
+    await successor.release()
+
+
+@pytest.mark.asyncio
+async def test_result_published_before_subscribe():
+    """Тест: опоздавший подписчик берёт сохранённый результат."""
+    coalescer = DownloadCoalescer(FakeRedis())
+    owner = await coalescer.acquire("vid", "mp3")
+    await owner.finish({"kind": "url", "url": "https://example.com/f.mp3"})
+
+    result = await coalescer.follow("vid", "mp3", ignore_progress)
+
+    assert result == {"kind": "url", "url": "https://example.com/f.mp3"}
+    await owner.release()
+
+
+@pytest.mark.asyncio
+async def test_owner_death_lets_follower_take_over():
+    """Тест: если аренда владельца истекла без результата, подписчик получает None."""
+    redis = FakeRedis()
+    coalescer = DownloadCoalescer(redis)
+    owner = await coalescer.acquire("vid", "mp3")
+    owner._renew_task.cancel()
+    # Аренда истекла: ключ исчез, результата нет
+    del redis.values[owner.key]
+
+    assert await coalescer.follow("vid", "mp3", ignore_progress) is None
+    successor = await coalescer.acquire("vid", "mp3")
+    assert successor is not None
+    await successor.release()
+
+
+@pytest.mark.asyncio
+async def test_lease_is_renewed_while_owner_lives(monkeypatch):
+    """Тест: аренда владельца продлевается, а release снимает только свою аренду."""
+    monkeypatch.setattr(download_coalescer, "LEASE_TTL", 0.03)
+    redis = FakeRedis()
+    owner = await DownloadCoalescer(redis).acquire("vid", "mp3")
+
+    await asyncio.sleep(0.05)
+    assert redis.renewals >= 2
+
+    redis.values[owner.key] = "someone-else"
+    await owner.release()
+    assert redis.values[owner.key] == "someone-else"
+
+
+@pytest.mark.asyncio
+async def test_follow_timeout_gives_up(monkeypatch):
+    """Тест: по истечении FOLLOW_TIMEOUT подписчик перестаёт ждать живого владельца."""
+    monkeypatch.setattr(download_coalescer, "FOLLOW_TIMEOUT", 0.05)
+    coalescer = DownloadCoalescer(FakeRedis())
+    owner = await coalescer.acquire("vid", "mp3")
+
+    with pytest.raises(asyncio.TimeoutError):
+        await coalescer.follow("vid", "mp3", ignore_progress)
+    await owner.release()
+
@@ -0,0 +1,93 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from prometheus_client import REGISTRY
+
+import audio
+from constants import FORMATS
+from download_scheduler import ScheduledJob
+from ytdlp_worker import is_ffmpeg_start
+
+EXTRACT_AUDIO_HOOKS = [
+    {"status": "started", "postprocessor": "ExtractAudio"},
+    {"status": "finished", "postprocessor": "ExtractAudio"},
+    {"status": "started", "postprocessor": "MoveFiles"},
+    {"status": "finished", "postprocessor": "MoveFiles"},
+]
+
+
+@pytest.fixture
+def downloaded(mocker, tmp_path):
+    """Фикстура: пробы нет, yt-dlp «скачивает» mp3 и сообщает хуки постобработки."""
+    base = str(tmp_path / "video")
+    mocker.patch.object(audio, "probe_video", AsyncMock(return_value={"id": "dQw4w9WgXcQ"}))
+
+    def fake_run_ytdlp(ydl_opts, info, url):
+        for d in EXTRACT_AUDIO_HOOKS:
+            for hook in ydl_opts["postprocessor_hooks"]:
+                hook(d)
+        with open(f"{base}.mp3", "wb") as f:
+            f.write(b"\0" * 1024)
+        return {"ext": "mp3", "filepath": f"{base}.mp3"}, False
+
+    mocker.patch.object(audio, "run_ytdlp", fake_run_ytdlp)
+    mocker.patch.object(audio, "ytdlp_pool", None)
+    return base
+
+
+def test_retryable_errors():
+    """Тест: сетевые сбои повторяются, а недоступные видео сразу сообщаются пользователю."""
+    assert audio.is_retryable_error(Exception("ERROR: Unable to download webpage: <urlopen error timed out>"))
+    assert audio.is_retryable_error(ConnectionResetError("Connection reset by peer"))
+    assert not audio.is_retryable_error(Exception("ERROR: [youtube] x: Private video. Sign in if you've been granted access"))
+    assert not audio.is_retryable_error(Exception("ERROR: [youtube] x: Video unavailable"))
+
+
+def test_ffmpeg_postprocessors_by_pp_key():
+    """Тест: постобработчики ffmpeg узнаются по именам, которые yt-dlp передаёт в хуки."""
+    for name in ("ExtractAudio", "Merger", "FixupM4a", "VideoConvertor"):
+        assert is_ffmpeg_start({"status": "started", "postprocessor": name})
+    assert not is_ffmpeg_start({"status": "finished", "postprocessor": "ExtractAudio"})
+    assert not is_ffmpeg_start({"status": "started", "postprocessor": "MoveFiles"})
+
+
+@pytest.mark.asyncio
+async def test_extract_audio_enters_postprocess_stage(downloaded):
+    """Тест: извлечение аудио ffmpeg занимает слот этапа постобработки."""
+    job = MagicMock(spec=ScheduledJob)
+
+    path = await audio.download_media("https://youtu.be/dQw4w9WgXcQ", FORMATS["mp3"], downloaded, job=job)
+
+    assert path == f"{downloaded}.mp3"
+    job.enter_from_thread.assert_called_once_with("postprocess")
+
+
+@pytest.mark.asyncio
+async def test_process_pool_enters_postprocess_stage(mocker, downloaded):
+    """Тест: в пуле процессов слот постобработки занимается по хуку из воркера."""
+    job = MagicMock(spec=ScheduledJob)
+    job.enter = AsyncMock()
+
+    async def fake_pool_run(ydl_opts, info, url, on_progress, on_postprocess):
+        for d in EXTRACT_AUDIO_HOOKS:
+            await on_postprocess(d)
+        with open(f"{downloaded}.mp3", "wb") as f:
+            f.write(b"\0" * 1024)
+        return {"ext": "mp3"}, False
+
+    mocker.patch.object(audio, "ytdlp_pool", MagicMock(run=fake_pool_run))
+
+    await audio.download_media("https://youtu.be/dQw4w9WgXcQ", FORMATS["mp3"], downloaded, job=job)
+
+    job.enter.assert_awaited_once_with("postprocess")
+
+
+@pytest.mark.asyncio
+async def test_postprocess_seconds_recorded(downloaded):
+    """Тест: время работы ffmpeg попадает в ytbot_postprocess_seconds."""
+    labels = {"extension": "mp3"}
+    before = REGISTRY.get_sample_value("ytbot_postprocess_seconds_count", labels) or 0
+
+    await audio.download_media("https://youtu.be/dQw4w9WgXcQ", FORMATS["mp3"], downloaded)
+
+    assert REGISTRY.get_sample_value("ytbot_postprocess_seconds_count", labels) == before + 1
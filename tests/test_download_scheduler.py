@@ -0,0 +1,163 @@
+import asyncio
+
+import pytest
+
+from download_scheduler import DownloadScheduler, StageQueue
+
+
+@pytest.mark.asyncio
+async def test_stage_queue_limits_concurrency():
+    """Тест: одновременно выполняется не больше заданного числа задач."""
+    stage = StageQueue("download", concurrency=2)
+    running = 0
+    peak = 0
+
+    async def job():
+        nonlocal running, peak
+        await stage.acquire()
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        stage.release()
+
+    await asyncio.gather(*(job() for _ in range(6)))
+
+    assert peak == 2
+    assert stage.active == 0
+    assert stage.queued == 0
+
+
+@pytest.mark.asyncio
+async def test_stage_queue_reports_positions():
+    """Тест: ожидающие получают свою позицию в очереди."""
+    stage = StageQueue("download", concurrency=1)
+    await stage.acquire()
+    positions = []
+
+    async def on_wait(name, position, eta):
+        positions.append((name, position))
+
+    first = asyncio.create_task(stage.acquire(on_wait))
+    second = asyncio.create_task(stage.acquire(on_wait))
+    await asyncio.sleep(0)
+
+    assert positions == [("download", 1), ("download", 2)]
+
+    stage.release()
+    await first
+    assert not second.done()
+
+    stage.release()
+    await second
+    stage.release()
+    assert stage.active == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_queue():
+    """Тест: отменённая задача освобождает место в очереди."""
+    stage = StageQueue("upload", concurrency=1)
+    await stage.acquire()
+
+    waiter = asyncio.create_task(stage.acquire())
+    await asyncio.sleep(0)
+    assert stage.queued == 1
+
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+
+    assert stage.queued == 0
+    stage.release()
+    assert stage.active == 0
+
+
+@pytest.mark.asyncio
+async def test_job_moves_between_stages():
+    """Тест: задача держит слот только одного этапа."""
+    scheduler = DownloadScheduler(download=1, postprocess=1, upload=1)
+    job = scheduler.job()
+
+    await job.enter("download")
+    assert scheduler.snapshot()["download"]["active"] == 1
+
+    await job.enter("upload")
+    snapshot = scheduler.snapshot()
+    assert snapshot["download"]["active"] == 0
+    assert snapshot["upload"]["active"] == 1
+
+    await job.close()
+    assert scheduler.snapshot()["upload"]["active"] == 0
+
+
+def test_estimate_wait():
+    """Тест оценки времени ожидания по позиции."""
+    stage = StageQueue("postprocess", concurrency=2)
+    stage.avg_duration = 30
+
+    assert stage.estimate_wait(1) == 30
+    assert stage.estimate_wait(3) == 60
+
+
+@pytest.mark.asyncio
+async def test_users_are_served_round_robin():
+    """Тест: пользователь с длинной очередью не вытесняет остальных."""
+    stage = StageQueue("download", concurrency=1)
+    await stage.acquire(key="holder")
+    order = []
+
+    async def job(user):
+        await stage.acquire(key=user)
+        order.append(user)
+        stage.release(key=user)
+
+    tasks = [asyncio.create_task(job("heavy")) for _ in range(3)]
+    await asyncio.sleep(0)
+    tasks += [asyncio.create_task(job("light")) for _ in range(2)]
+    await asyncio.sleep(0)
+
+    stage.release(key="holder")
+    await asyncio.gather(*tasks)
+
+    assert order == ["heavy", "light", "heavy", "light", "heavy"]
+
+
+@pytest.mark.asyncio
+async def test_weight_sets_share():
+    """Тест: приоритетный пользователь получает больше слотов за круг."""
+    stage = StageQueue("download", concurrency=1)
+    await stage.acquire(key="holder")
+    order = []
+
+    async def job(user, weight):
+        await stage.acquire(key=user, weight=weight)
+        order.append(user)
+        stage.release(key=user)
+
+    tasks = [asyncio.create_task(job("vip", 2.0)) for _ in range(4)]
+    tasks += [asyncio.create_task(job("user", 1.0)) for _ in range(2)]
+    await asyncio.sleep(0)
+
+    stage.release(key="holder")
+    await asyncio.gather(*tasks)
+
+    assert order == ["vip", "vip", "user", "vip", "vip", "user"]
+
+
+@pytest.mark.asyncio
+async def test_per_key_limit():
+    """Тест: пользователь не занимает больше своего лимита слотов."""
+    stage = StageQueue("download", concurrency=3, per_key_limit=1)
+    await stage.acquire(key=1)
+
+    second = asyncio.create_task(stage.acquire(key=1))
+    await asyncio.sleep(0)
+    await stage.acquire(key=2)
+
+    assert not second.done()
+    assert stage.active == 2
+
+    stage.release(key=1)
+    await second
+    assert stage.active == 2
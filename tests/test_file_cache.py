@@ -0,0 +1,68 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SendAudio
+
+import audio
+from clients.async_file_cache_actioner import AsyncFileCacheActioner
+from constants import FORMATS
+
+
+@pytest.fixture
+def file_cache(mocker):
+    """Фикстура кэша file_id поверх фиктивного клиента Postgres."""
+    db = AsyncMock()
+    db.register_statements = MagicMock()
+    cache = AsyncFileCacheActioner(db)
+    mocker.patch.object(audio, "file_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def send_media(mocker):
+    return mocker.patch.object(audio, "send_media", AsyncMock())
+
+
+@pytest.mark.asyncio
+async def test_cached_file_id_is_resent(file_cache, send_media):
+    """Тест: при попадании в кэш файл отправляется по file_id без скачивания."""
+    file_cache.db.fetch.return_value = [{"file_id": "cached-id"}]
+
+    assert await audio.send_cached_file(1, "dQw4w9WgXcQ", "mp3", FORMATS["mp3"]) is True
+
+    send_media.assert_awaited_once_with(1, "cached-id", "send_audio")
+
+
+@pytest.mark.asyncio
+async def test_cache_miss_falls_back_to_download(file_cache, send_media):
+    """Тест: без сохранённого file_id отправки нет."""
+    file_cache.db.fetch.return_value = []
+
+    assert await audio.send_cached_file(1, "dQw4w9WgXcQ", "mp3", FORMATS["mp3"]) is False
+    assert await audio.send_cached_file(1, None, "mp3", FORMATS["mp3"]) is False
+    send_media.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_rejected_file_id_is_invalidated(file_cache, send_media):
+    """Тест: отклонённый Telegram file_id удаляется из кэша."""
+    file_cache.db.fetch.return_value = [{"file_id": "stale-id"}]
+    send_media.side_effect = TelegramBadRequest(SendAudio(chat_id=1, audio="stale-id"), "wrong file identifier")
+
+    assert await audio.send_cached_file(1, "dQw4w9WgXcQ", "mp3", FORMATS["mp3"]) is False
+
+    deletes = [c for c in file_cache.db.execute.await_args_list if "DELETE" in c.args[0]]
+    assert len(deletes) == 1
+    assert deletes[0].args[1] == ("dQw4w9WgXcQ", "mp3")
+
+
+@pytest.mark.asyncio
+async def test_delivered_file_id_is_remembered(file_cache):
+    """Тест: file_id отправленного файла сохраняется для повторных запросов."""
+    sent = MagicMock(audio=MagicMock(file_id="new-id"), video=None, document=None)
+
+    await audio.remember_file_id("dQw4w9WgXcQ", "mp3", "send_audio", sent)
+
+    [call] = file_cache.db.execute.await_args_list
+    assert call.args[1][:4] == ("dQw4w9WgXcQ", "mp3", "new-id", "send_audio")
@@ -0,0 +1,42 @@
+from audio import _format_size, estimate_format_sizes
+
+
+def make_format(format_id: str, **fields) -> dict:
+    return {"format_id": format_id, "url": f"https://r1.googlevideo.com/videoplayback?itag={format_id}", **fields}
+
+
+def make_probe() -> dict:
+    return {
+        "id": "dQw4w9WgXcQ",
+        "duration": 100,
+        "formats": [
+            make_format("140", ext="m4a", vcodec="none", acodec="mp4a.40.2", filesize=1_000),
+            make_format("160", ext="mp4", vcodec="avc1", acodec="none", height=144, filesize=2_000),
+            make_format("134", ext="mp4", vcodec="avc1", acodec="none", height=360, tbr=800),
+        ],
+    }
+
+
+def test_format_size_sources():
+    """Тест: размер берётся из filesize, затем filesize_approx, затем из битрейта."""
+    assert _format_size({"filesize": 10, "filesize_approx": 20, "tbr": 1}, 100) == 10
+    assert _format_size({"filesize_approx": 20, "tbr": 1}, 100) == 20
+    assert _format_size({"tbr": 800}, 100) == 10_000_000
+    assert _format_size({}, 100) == 0
+
+
+def test_estimate_format_sizes_from_one_probe():
+    """Тест: размеры всех форматов считаются по одной пробе, склеиваемые потоки суммируются."""
+    sizes = estimate_format_sizes(make_probe())
+
+    assert sizes["mp3"] == 1_000
+    assert sizes["144"] == 2_000 + 1_000
+    assert sizes["360"] == 10_000_000 + 1_000
+
+
+def test_estimate_format_sizes_skips_duplicate_qualities():
+    """Тест: качества, совпадающие с более низким по потокам, не предлагаются."""
+    sizes = estimate_format_sizes(make_probe())
+
+    # 240 выбирает те же потоки, что и 144, а 480-1080 - те же, что и 360
+    assert set(sizes) == {"mp3", "144", "360"}
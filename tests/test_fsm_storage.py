@@ -0,0 +1,39 @@
+from unittest.mock import AsyncMock
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm_storage import compact_json_dumps, create_fsm_storage
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+
+
+def test_compact_json_dumps():
+    """Тест: данные состояния сериализуются без пробелов и без экранирования кириллицы."""
+    assert compact_json_dumps({"a": [1, 2], "title": "видео"}) == '{"a":[1,2],"title":"видео"}'
+
+
+@pytest.mark.asyncio
+async def test_state_and_data_are_stored_with_ttl():
+    """Тест: состояние и данные пишутся в Redis компактно и со сроком жизни."""
+    redis = AsyncMock()
+    storage = create_fsm_storage(redis, state_ttl=600, data_ttl=300)
+
+    await storage.set_state(KEY, "DownloadState:waiting_for_format")
+    await storage.set_data(KEY, {"last_url": "https://youtu.be/abc", "sizes": {"720": 1024}})
+
+    redis.set.assert_any_await("fsm:10:10:state", "DownloadState:waiting_for_format", ex=600)
+    redis.set.assert_any_await(
+        "fsm:10:10:data", '{"last_url":"https://youtu.be/abc","sizes":{"720":1024}}', ex=300
+    )
+
+
+@pytest.mark.asyncio
+async def test_zero_ttl_disables_expiry():
+    """Тест: нулевой срок жизни означает хранение без истечения."""
+    redis = AsyncMock()
+    storage = create_fsm_storage(redis, state_ttl=0, data_ttl=0)
+
+    await storage.set_data(KEY, {"last_url": "x"})
+
+    redis.set.assert_awaited_once_with("fsm:10:10:data", '{"last_url":"x"}', ex=None)
@@ -0,0 +1,270 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import defaultdict
+from unittest.mock import AsyncMock
+
+import pytest
+
+import job_queue
+from config import JOB_MAX_ATTEMPTS
+from job_queue import (
+    DEAD_JOBS_STREAM, EVENTS_STREAM, FRONTEND_GROUP, JOB_ATTEMPTS_KEY, JOBS_STREAM, WORKERS_GROUP, JobWorker,
+    RetryableJobError,
+)
+
+
+def encode(fields: dict) -> dict:
+    return {
+        key.encode() if isinstance(key, str) else key: value.encode() if isinstance(value, str) else value
+        for key, value in fields.items()
+    }
+
+
+class FakeStreams:
+    """Потоки Redis в памяти: группы потребителей, ожидающие подтверждения записи и xautoclaim."""
+
+    def __init__(self):
+        self.streams = defaultdict(list)
+        self.delivered = defaultdict(int)
+        # (поток, группа, id) -> [потребитель, время выдачи]
+        self.pending = {}
+        self.acked = []
+        self.hashes = defaultdict(dict)
+        self.ids = itertools.count(1)
+
+    async def xgroup_create(self, stream, group, id="0", mkstream=False):
+        pass
+
+    async def xadd(self, stream, fields, maxlen=None, approximate=True):
+        message_id = f"{next(self.ids)}-0".encode()
+        self.streams[stream].append((message_id, encode(fields)))
+        return message_id
+
+    async def xreadgroup(self, group, consumer, streams, count=None, block=None):
+        [stream] = streams
+        start = self.delivered[stream, group]
+        batch = self.streams[stream][start:start + (count or len(self.streams[stream]))]
+        if not batch:
+            await asyncio.sleep(0.01)
+            return []
+        self.delivered[stream, group] = start + len(batch)
+        for message_id, _ in batch:
+            self.pending[stream, group, message_id] = [consumer, time.monotonic()]
+        return [[stream.encode(), batch]]
+
+    async def xautoclaim(self, stream, group, consumer, min_idle_time, start_id="0-0", count=None):
+        now = time.monotonic()
+        claimed = []
+        for (pending_stream, pending_group, message_id), entry in self.pending.items():
+            if (pending_stream, pending_group) != (stream, group) or (now - entry[1]) * 1000 < min_idle_time:
+                continue
+            if count is not None and len(claimed) >= count:
+                break
+            entry[:] = [consumer, now]
+            claimed.append((message_id, dict(self.streams[stream])[message_id]))
+        return b"0-0", claimed, []
+
+    async def xclaim(self, stream, group, consumer, min_idle_time, message_ids, justid=False):
+        for message_id in message_ids:
+            self.pending[stream, group, message_id] = [consumer, time.monotonic()]
+
+    async def xack(self, stream, group, message_id):
+        self.acked.append((stream, group, message_id))
+        return int(self.pending.pop((stream, group, message_id), None) is not None)
+
+    async def hincrby(self, key, field, amount):
+        self.hashes[key][field] = self.hashes[key].get(field, 0) + amount
+        return self.hashes[key][field]
+
+    async def hdel(self, key, field):
+        return int(self.hashes[key].pop(field, None) is not None)
+
+    def events(self) -> list[dict]:
+        return [json.loads(fields[b"event"]) for _, fields in self.streams[EVENTS_STREAM]]
+
+
+@pytest.fixture(autouse=True)
+def release_lock(monkeypatch):
+    """Фикстура: снятие блокировки пользователя по токену."""
+    release = AsyncMock(return_value=True)
+    monkeypatch.setattr(job_queue, "release_user_lock", release)
+    return release
+
+
+def make_job(job_id="job-1") -> dict:
+    return {
+        "job_id": job_id, "user_id": 7, "chat_id": 7, "status_message_id": 11,
+        "lock_token": "token", "lock_slot": 0, "url": "https://youtu.be/dQw4w9WgXcQ", "format": "mp3",
+    }
+
+
+async def run_worker(redis, handler, until):
+    """Крутит воркер, пока не выполнится условие."""
+    task = asyncio.create_task(JobWorker(redis, "worker-1", handler, concurrency=2).run())
+    try:
+        for _ in range(200):
+            await asyncio.sleep(0.01)
+            if until():
+                return
+        raise AssertionError("условие не выполнилось")
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+@pytest.mark.asyncio
+async def test_job_acked_after_success():
+    """Тест: успешно выполненная задача подтверждается и завершается событием done."""
+    redis = FakeStreams()
+    message_id = await redis.xadd(JOBS_STREAM, {"job": json.dumps(make_job())})
+    handled = []
+
+    async def handler(job, reporter):
+        handled.append(job["job_id"])
+        await reporter.progress("50%")
+
+    await run_worker(redis, handler, lambda: redis.acked)
+
+    assert handled == ["job-1"]
+    assert redis.acked == [(JOBS_STREAM, WORKERS_GROUP, message_id)]
+    assert [event["type"] for event in redis.events()] == ["progress", "done"]
+    assert message_id not in redis.hashes[JOB_ATTEMPTS_KEY]
+
+
+@pytest.mark.asyncio
+async def test_worker_releases_user_lock(release_lock):
+    """Тест: блокировку пользователя снимает по токену воркер, а не фронтенд, получивший done."""
+    redis = FakeStreams()
+    await redis.xadd(JOBS_STREAM, {"job": json.dumps(dict(make_job(), lock_slot=2))})
+
+    async def handler(job, reporter):
+        release_lock.assert_not_awaited()
+
+    await run_worker(redis, handler, lambda: redis.acked)
+
+    release_lock.assert_awaited_once_with(7, "token", 2)
+
+
+@pytest.mark.asyncio
+async def test_failed_job_stays_pending():
+    """Тест: задача с исключением в обработчике не подтверждается и ждёт повторной выдачи."""
+    redis = FakeStreams()
+    message_id = await redis.xadd(JOBS_STREAM, {"job": json.dumps(make_job())})
+    failures = []
+
+    async def handler(job, reporter):
+        failures.append(job["job_id"])
+        raise RuntimeError("yt-dlp упал")
+
+    await run_worker(redis, handler, lambda: failures)
+
+    assert redis.acked == []
+    assert (JOBS_STREAM, WORKERS_GROUP, message_id) in redis.pending
+    assert redis.events() == []
+
+
+@pytest.mark.asyncio
+async def test_idle_job_of_dead_worker_is_reclaimed():
+    """Тест: задача умершего воркера, простаивающая дольше CLAIM_IDLE_MS, забирается и выполняется."""
+    redis = FakeStreams()
+    message_id = await redis.xadd(JOBS_STREAM, {"job": json.dumps(make_job())})
+    await redis.xreadgroup(WORKERS_GROUP, "dead-worker", {JOBS_STREAM: ">"}, count=1)
+    redis.pending[JOBS_STREAM, WORKERS_GROUP, message_id][1] -= job_queue.CLAIM_IDLE_MS / 1000 + 1
+    handled = []
+
+    async def handler(job, reporter):
+        handled.append(job["job_id"])
+
+    await run_worker(redis, handler, lambda: redis.acked)
+
+    assert handled == ["job-1"]
+    assert redis.acked == [(JOBS_STREAM, WORKERS_GROUP, message_id)]
+
+
+@pytest.mark.asyncio
+async def test_job_dead_lettered_after_max_attempts(release_lock):
+    """Тест: после JOB_MAX_ATTEMPTS задача уходит в поток мёртвых, а пользователь получает error и done."""
+    redis = FakeStreams()
+    message_id = await redis.xadd(JOBS_STREAM, {"job": json.dumps(make_job())})
+    redis.hashes[JOB_ATTEMPTS_KEY][message_id] = JOB_MAX_ATTEMPTS
+    handled = []
+
+    async def handler(job, reporter):
+        handled.append(job["job_id"])
+
+    await run_worker(redis, handler, lambda: redis.acked)
+
+    assert handled == []
+    [(_, dead_fields)] = redis.streams[DEAD_JOBS_STREAM]
+    assert json.loads(dead_fields[b"job"])["job_id"] == "job-1"
+    assert [event["type"] for event in redis.events()] == ["error", "done"]
+    release_lock.assert_awaited_once_with(7, "token", 0)
+    assert redis.acked == [(JOBS_STREAM, WORKERS_GROUP, message_id)]
+
+
+@pytest.mark.asyncio
+async def test_retryable_failure_stays_pending(release_lock):
+    """Тест: временный сбой оставляет задачу на повтор, не сообщая пользователю об ошибке."""
+    redis = FakeStreams()
+    message_id = await redis.xadd(JOBS_STREAM, {"job": json.dumps(make_job())})
+    failures = []
+
+    async def handler(job, reporter):
+        failures.append(job["job_id"])
+        raise RetryableJobError("Unable to download webpage")
+
+    await run_worker(redis, handler, lambda: redis.events())
+
+    assert failures == ["job-1"]
+    assert redis.acked == []
+    assert (JOBS_STREAM, WORKERS_GROUP, message_id) in redis.pending
+    assert [event["type"] for event in redis.events()] == ["progress"]
+    release_lock.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_retryable_failure_on_last_attempt_is_dead_lettered(release_lock):
+    """Тест: временный сбой на последней попытке сразу уводит задачу в поток мёртвых с текстом ошибки."""
+    redis = FakeStreams()
+    message_id = await redis.xadd(JOBS_STREAM, {"job": json.dumps(make_job())})
+    redis.hashes[JOB_ATTEMPTS_KEY][message_id] = JOB_MAX_ATTEMPTS - 1
+
+    async def handler(job, reporter):
+        raise RetryableJobError("Ошибка доступа к видео")
+
+    await run_worker(redis, handler, lambda: redis.acked)
+
+    assert len(redis.streams[DEAD_JOBS_STREAM]) == 1
+    events = redis.events()
+    assert [event["type"] for event in events] == ["error", "done"]
+    assert events[0]["text"] == "Ошибка доступа к видео"
+    release_lock.assert_awaited_once_with(7, "token", 0)
+    assert redis.acked == [(JOBS_STREAM, WORKERS_GROUP, message_id)]
+
+
+@pytest.mark.asyncio
+async def test_consume_events_applies_and_acks(monkeypatch):
+    """Тест: события воркеров применяются по порядку и подтверждаются, даже если обработчик упал."""
+    redis = FakeStreams()
+    monkeypatch.setattr(job_queue, "redis_client", redis)
+    for event_type in ("progress", "error", "done"):
+        await redis.xadd(EVENTS_STREAM, {"event": json.dumps(dict(make_job(), type=event_type))})
+    applied = []
+
+    async def handler(event):
+        applied.append(event["type"])
+        if event["type"] == "error":
+            raise RuntimeError("чат недоступен")
+
+    task = asyncio.create_task(job_queue.consume_events("frontend-1", handler))
+    for _ in range(200):
+        await asyncio.sleep(0.01)
+        if len(redis.acked) == 3:
+            break
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    assert applied == ["progress", "error", "done"]
+    assert [group for _, group, _ in redis.acked] == [FRONTEND_GROUP] * 3
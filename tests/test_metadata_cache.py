@@ -0,0 +1,102 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock
+
+import pytest
+
+from metadata_cache import MetadataCache, extract_video_id
+
+
+@pytest.fixture
+def mock_redis():
+    """Фикстура асинхронного клиента Redis без сохранённых значений."""
+    mock = AsyncMock()
+    mock.get.return_value = None
+    mock.set.return_value = True
+    return mock
+
+
+def make_info(expire: int) -> dict:
+    return {
+        "id": "dQw4w9WgXcQ",
+        "formats": [{"format_id": "18", "url": f"https://r1.googlevideo.com/videoplayback?expire={expire}"}],
+    }
+
+
+@pytest.mark.parametrize("url", [
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://youtube.com/watch?feature=share&v=dQw4w9WgXcQ",
+    "https://youtu.be/dQw4w9WgXcQ?t=10",
+    "https://www.youtube.com/shorts/dQw4w9WgXcQ",
+])
+def test_extract_video_id(url):
+    """Тест нормализации ссылок к ID видео."""
+    assert extract_video_id(url) == "dQw4w9WgXcQ"
+
+
+def test_extract_video_id_unknown():
+    """Тест ссылки без ID видео."""
+    assert extract_video_id("https://example.com/") is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_probes_share_one_extraction(mock_redis):
+    """Тест: одновременные запросы одного видео выполняют одну экстракцию."""
+    cache = MetadataCache(mock_redis, ttl=3600, lru_size=8)
+    calls = 0
+
+    async def extractor(url):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return make_info(int(time.time()) + 6 * 3600)
+
+    results = await asyncio.gather(*(
+        cache.get_info("https://youtu.be/dQw4w9WgXcQ", extractor) for _ in range(5)
+    ))
+
+    assert calls == 1
+    assert all(r["id"] == "dQw4w9WgXcQ" for r in results)
+    # Каждый вызывающий получает собственную копию
+    assert len({id(r) for r in results}) == 5
+
+
+@pytest.mark.asyncio
+async def test_local_cache_hit_skips_redis(mock_redis):
+    """Тест: повторный запрос обслуживается из локального LRU."""
+    cache = MetadataCache(mock_redis, ttl=3600, lru_size=8)
+    extractor = AsyncMock(return_value=make_info(int(time.time()) + 6 * 3600))
+
+    await cache.get_info("https://youtu.be/dQw4w9WgXcQ", extractor)
+    mock_redis.get.reset_mock()
+    await cache.get_info("https://www.youtube.com/watch?v=dQw4w9WgXcQ", extractor)
+
+    extractor.assert_awaited_once()
+    mock_redis.get.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_ttl_bounded_by_format_url_expiry(mock_redis):
+    """Тест: TTL не превышает срок жизни ссылок на форматы."""
+    cache = MetadataCache(mock_redis, ttl=24 * 3600, lru_size=8)
+    extractor = AsyncMock(return_value=make_info(int(time.time()) + 3600))
+
+    await cache.get_info("https://youtu.be/dQw4w9WgXcQ", extractor)
+
+    stored = [c for c in mock_redis.set.call_args_list if c.args[0] == "video_meta:dQw4w9WgXcQ"]
+    assert len(stored) == 1
+    assert 0 < stored[0].kwargs["ex"] <= 1800
+
+
+@pytest.mark.asyncio
+async def test_corrupt_redis_entry_is_a_miss(mock_redis):
+    """Тест: повреждённая запись в Redis удаляется, и выполняется новая экстракция."""
+    mock_redis.get.return_value = b"not zlib"
+    cache = MetadataCache(mock_redis, ttl=3600, lru_size=8)
+    extractor = AsyncMock(return_value=make_info(int(time.time()) + 6 * 3600))
+
+    info = await cache.get_info("https://youtu.be/dQw4w9WgXcQ", extractor)
+
+    assert info["id"] == "dQw4w9WgXcQ"
+    extractor.assert_awaited_once()
+    mock_redis.delete.assert_any_await("video_meta:dQw4w9WgXcQ")
@@ -0,0 +1,60 @@
+from unittest.mock import MagicMock
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from prometheus_client import CollectorRegistry, generate_latest
+
+from clients.pg_client import LatencyHistogram
+from download_scheduler import DownloadScheduler
+from metrics import PipelineCollector, create_metrics_app
+
+
+def make_collector():
+    scheduler = DownloadScheduler(download=4, postprocess=2, upload=3)
+    scheduler.stages["download"].active = 2
+
+    acquire = LatencyHistogram()
+    acquire.observe(0.002)
+    query = LatencyHistogram()
+    query.observe(0.003)
+    query.observe(0.2)
+    db = MagicMock()
+    db.stats.return_value = {
+        "pool": {"size": 5, "idle": 3, "in_use": 2, "min": 2, "max": 10},
+        "saturated_acquires": 1,
+        "acquire": acquire,
+        "queries": {"SELECT * FROM users WHERE user_id = $1": query},
+    }
+    governor = MagicMock(queued=4, coalesced_total=7, retry_after_total=0)
+    return PipelineCollector(scheduler, db, governor)
+
+
+def test_collector_exports_stages_and_postgres():
+    """Тест: коллектор отдаёт загрузку этапов, очередь Telegram и гистограммы Postgres."""
+    registry = CollectorRegistry()
+    registry.register(make_collector())
+
+    assert registry.get_sample_value("ytbot_stage_active", {"stage": "download"}) == 2
+    assert registry.get_sample_value("ytbot_stage_concurrency", {"stage": "upload"}) == 3
+    assert registry.get_sample_value("ytbot_telegram_queued") == 4
+    assert registry.get_sample_value("ytbot_telegram_coalesced_total") == 7
+    assert registry.get_sample_value("ytbot_postgres_pool_connections", {"state": "in_use"}) == 2
+    labels = {"query": "SELECT * FROM users WHERE user_id = $1"}
+    assert registry.get_sample_value("ytbot_postgres_query_seconds_count", labels) == 2
+    assert registry.get_sample_value("ytbot_postgres_query_seconds_bucket", dict(labels, le="0.005")) == 1
+    assert registry.get_sample_value("ytbot_postgres_query_seconds_bucket", dict(labels, le="+Inf")) == 2
+    assert registry.get_sample_value("ytbot_postgres_acquire_seconds_sum") == pytest.approx(0.002)
+    assert b"ytbot_stage_queued" in generate_latest(registry)
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint():
+    """Тест: эндпоинт /metrics отдаёт метрики в текстовом формате Prometheus."""
+    async with TestClient(TestServer(create_metrics_app())) as client:
+        response = await client.get("/metrics")
+        body = await response.text()
+
+    assert response.status == 200
+    assert response.content_type == "text/plain"
+    assert "ytbot_download_seconds" in body
+    assert "ytbot_redis_command_seconds" in body
@@ -0,0 +1,88 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from clients.pg_client import AsyncPostgresClient, LatencyHistogram
+
+
+@pytest.fixture
+def client():
+    """Фикстура клиента Postgres с замоканным пулом."""
+    db = AsyncPostgresClient("postgresql://test", min_size=1, max_size=2)
+    conn = AsyncMock()
+    conn.fetch.return_value = [{"user_id": 1}]
+    conn.get_server_pid = MagicMock(return_value=101)
+    conn.add_termination_listener = MagicMock()
+    db.pool = MagicMock()
+    db.pool.acquire = AsyncMock(return_value=conn)
+    db.pool.release = AsyncMock()
+    db.pool.get_size.return_value = 2
+    db.pool.get_idle_size.return_value = 1
+    return db
+
+
+def test_histogram_quantiles():
+    """Тест оценки квантилей по корзинам гистограммы."""
+    histogram = LatencyHistogram()
+    for seconds in [0.0005] * 90 + [0.2] * 10:
+        histogram.observe(seconds)
+
+    assert histogram.count == 100
+    assert histogram.quantile(0.5) == 0.001
+    assert histogram.quantile(0.95) == 0.2
+
+
+@pytest.mark.asyncio
+async def test_queries_are_timed_by_name(client):
+    """Тест: задержка зарегистрированного запроса учитывается под его именем."""
+    client.register_statements(get_user="SELECT 1 WHERE $1 = 1;")
+
+    await client.fetch("SELECT 1 WHERE $1 = 1;", (1,))
+    await client.execute("UPDATE users SET x = 1;", ())
+
+    assert client.query_latency["get_user"].count == 1
+    assert client.query_latency["UPDATE users SET x = 1;"].count == 1
+    assert client.pool.release.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_saturated_pool_is_counted(client):
+    """Тест: запрос соединения при исчерпанном пуле учитывается."""
+    client.pool.get_idle_size.return_value = 0
+
+    await client.fetch("SELECT 1;", ())
+
+    assert client.saturated_acquires == 1
+    assert client.stats()["pool"]["in_use"] == 2
+
+
+@pytest.mark.asyncio
+async def test_registered_queries_reuse_prepared_statements(client):
+    """Тест: зарегистрированный запрос готовится на соединении один раз и дальше выполняется по нему."""
+    client.register_statements(get_user="SELECT * FROM users WHERE user_id = $1;")
+    conn = await client.pool.acquire()
+    statement = conn.prepare.return_value
+
+    for user_id in (1, 2, 3):
+        await client.fetch("SELECT * FROM users WHERE user_id = $1;", (user_id,))
+    await client.execute("UPDATE users SET x = 1;", ())
+
+    conn.prepare.assert_awaited_once_with("SELECT * FROM users WHERE user_id = $1;")
+    assert [c.args for c in statement.fetch.await_args_list] == [(1,), (2,), (3,)]
+    conn.fetch.assert_not_awaited()
+    conn.execute.assert_awaited_once_with("UPDATE users SET x = 1;")
+
+
+@pytest.mark.asyncio
+async def test_new_connection_prepares_again(client):
+    """Тест: после закрытия соединения его подготовленные запросы забываются."""
+    client.register_statements(get_user="SELECT * FROM users WHERE user_id = $1;")
+    client._schema_ready = True
+    conn = await client.pool.acquire()
+
+    await client._init_connection(conn)
+    on_terminated = conn.add_termination_listener.call_args.args[0]
+    on_terminated(conn)
+    await client.fetch("SELECT * FROM users WHERE user_id = $1;", (1,))
+
+    assert conn.prepare.await_count == 2
@@ -0,0 +1,88 @@
+import asyncio
+import textwrap
+
+import pytest
+
+import process_pool
+from process_pool import WorkerError, YtdlpProcessPool
+
+SLOW_POSTPROCESS_WORKER = """
+import json, sys, time
+
+def send(message):
+    print(json.dumps(message), flush=True)
+
+for line in sys.stdin:
+    send({"type": "postprocess", "data": {"status": "started", "postprocessor": "ExtractAudio"}})
+    sys.stdin.readline()
+    time.sleep(0.2)
+    send({"type": "done", "summary": {"ext": "mp3"}, "reextracted": False})
+"""
+
+# Воркер запускает дочерний процесс, как yt-dlp запускает ffmpeg, и зависает
+HANGING_WORKER = """
+import os, subprocess, sys, time
+
+sys.stdin.readline()
+child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+with open(os.environ["CHILD_PID_FILE"], "w") as f:
+    f.write(str(child.pid))
+time.sleep(60)
+"""
+
+
+def use_worker_script(monkeypatch, tmp_path, source: str):
+    script = tmp_path / "worker.py"
+    script.write_text(textwrap.dedent(source))
+    monkeypatch.setattr(process_pool, "WORKER_SCRIPT", str(script))
+
+
+def alive(pid: int) -> bool:
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # Зомби уже не работает, его только не успели подобрать
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+async def ignore_postprocess(d):
+    pass
+
+
+@pytest.mark.asyncio
+async def test_postprocess_slot_wait_does_not_count(monkeypatch, tmp_path):
+    """Тест: ожидание слота постобработки не съедает лимит времени задачи."""
+    use_worker_script(monkeypatch, tmp_path, SLOW_POSTPROCESS_WORKER)
+    pool = YtdlpProcessPool(size=1, job_timeout=0.5)
+
+    async def wait_for_slot(d):
+        await asyncio.sleep(1)
+
+    try:
+        summary, reextracted = await pool.run({}, {}, "https://youtu.be/x", lambda d: None, wait_for_slot)
+    finally:
+        await pool.close()
+
+    assert summary == {"ext": "mp3"}
+    assert reextracted is False
+
+
+@pytest.mark.asyncio
+async def test_timeout_kills_worker_children(monkeypatch, tmp_path):
+    """Тест: по таймауту останавливается вся группа процессов воркера, включая ffmpeg."""
+    pid_file = tmp_path / "child.pid"
+    monkeypatch.setenv("CHILD_PID_FILE", str(pid_file))
+    use_worker_script(monkeypatch, tmp_path, HANGING_WORKER)
+    pool = YtdlpProcessPool(size=1, job_timeout=1)
+
+    # Пока жив дочерний процесс, он держит stdout воркера, и остановка воркера не завершается
+    with pytest.raises(WorkerError):
+        await asyncio.wait_for(pool.run({}, {}, "https://youtu.be/x", lambda d: None, ignore_postprocess), 10)
+
+    child = int(pid_file.read_text())
+    for _ in range(50):
+        if not alive(child):
+            break
+        await asyncio.sleep(0.05)
+    assert not alive(child)
@@ -1,9 +1,11 @@
-import time
-from unittest.mock import MagicMock
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
 
 import pytest
 
 from redis_lock import (
+    RELEASE_SCRIPT,
+    RENEW_SCRIPT,
     acquire_user_lock,
     get_all_locks,
     is_locked,
@@ -13,65 +15,168 @@ from redis_lock import (
 
 @pytest.fixture
 def mock_redis(mocker):
-    """Фикстура для мокирования клиента Redis."""
-    mock = MagicMock()
+    """Фикстура для мокирования асинхронного клиента Redis."""
+    mock = AsyncMock()
     mocker.patch("redis_lock.r", mock)
     return mock
 
 
-def test_acquire_user_lock_success(mock_redis):
+@pytest.mark.asyncio
+async def test_acquire_user_lock_success(mock_redis):
     """Тест успешного получения блокировки."""
     user_id = 123
-    mock_redis.setnx.return_value = True
+    mock_redis.set.return_value = True
 
-    result = acquire_user_lock(user_id, ttl=300)
+    lock = await acquire_user_lock(user_id, ttl_ms=300000)
 
-    assert result is True
-    mock_redis.setnx.assert_called_once_with(f"user_lock:{user_id}", int(time.time()))
-    mock_redis.expire.assert_called_once_with(f"user_lock:{user_id}", 300)
+    assert lock is not None
+    mock_redis.set.assert_awaited_once_with(f"user_lock:{user_id}", lock.token, nx=True, px=300000)
+    await lock.release()
 
 
-def test_acquire_user_lock_fail(mock_redis):
+@pytest.mark.asyncio
+async def test_acquire_user_lock_fail(mock_redis):
     """Тест неудачного получения блокировки."""
-    user_id = 123
-    mock_redis.setnx.return_value = False
+    mock_redis.set.return_value = None
+
+    assert await acquire_user_lock(123) is None
+
+
+@pytest.mark.asyncio
+async def test_acquire_takes_first_free_slot(mock_redis):
+    """Тест: при занятом первом слоте берётся следующий свободный."""
+    mock_redis.set.side_effect = [None, True]
+    mock_redis.eval.return_value = 1
+
+    lock = await acquire_user_lock(123, ttl_ms=300000, slots=3)
+
+    assert lock.slot == 1
+    assert mock_redis.set.await_args.args[0] == "user_lock:123:1"
+    await lock.release()
+    mock_redis.eval.assert_awaited_with(RELEASE_SCRIPT, 1, "user_lock:123:1", lock.token)
+
+
+@pytest.mark.asyncio
+async def test_acquire_fails_when_all_slots_taken(mock_redis):
+    """Тест: если все слоты заняты, блокировка не выдаётся."""
+    mock_redis.set.return_value = None
 
-    result = acquire_user_lock(user_id)
+    assert await acquire_user_lock(123, slots=3) is None
+    assert mock_redis.set.await_count == 3
 
-    assert result is False
-    mock_redis.expire.assert_not_called()
 
+@pytest.mark.asyncio
+async def test_tokens_are_unique(mock_redis):
+    """Тест: каждая блокировка получает свой токен владельца."""
+    mock_redis.set.return_value = True
 
-def test_release_user_lock(mock_redis):
-    """Тест снятия блокировки."""
+    first = await acquire_user_lock(1)
+    second = await acquire_user_lock(2)
+
+    assert first.token != second.token
+    await first.release()
+    await second.release()
+
+
+@pytest.mark.asyncio
+async def test_release_user_lock_checks_token(mock_redis):
+    """Тест снятия блокировки с проверкой владельца."""
     user_id = 123
-    release_user_lock(user_id)
-    mock_redis.delete.assert_called_once_with(f"user_lock:{user_id}")
+    mock_redis.eval.return_value = 0
+
+    released = await release_user_lock(user_id, "foreign-token")
+
+    assert released is False
+    mock_redis.eval.assert_awaited_once_with(RELEASE_SCRIPT, 1, f"user_lock:{user_id}", "foreign-token")
+
+
+@pytest.mark.asyncio
+async def test_lease_is_renewed_until_release(mock_redis):
+    """Тест: пока блокировка удерживается, аренда продлевается."""
+    mock_redis.set.return_value = True
+    mock_redis.eval.return_value = 1
+
+    lock = await acquire_user_lock(123, ttl_ms=30)
+    await asyncio.sleep(0.05)
+    renewals = [c for c in mock_redis.eval.await_args_list if c.args[0] == RENEW_SCRIPT]
+    await lock.release()
 
+    assert renewals
+    assert renewals[0].args[1:] == (1, "user_lock:123", lock.token, 30)
+    assert mock_redis.eval.await_args.args[0] == RELEASE_SCRIPT
 
-def test_get_all_locks(mock_redis):
+
+@pytest.mark.asyncio
+async def test_renewal_stops_when_lock_is_lost(mock_redis):
+    """Тест: продление прекращается, если блокировка принадлежит другому."""
+    mock_redis.set.return_value = True
+    mock_redis.eval.return_value = 0
+
+    lock = await acquire_user_lock(123, ttl_ms=30)
+    await asyncio.sleep(0.05)
+
+    assert lock._renew_task.done()
+    assert mock_redis.eval.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_get_all_locks(mocker):
     """Тест получения всех блокировок."""
-    mock_redis.scan_iter.return_value = [b"user_lock:1", b"user_lock:2"]
-    
-    locks = get_all_locks()
-    
+    async def scan_iter(match):
+        for key in (b"user_lock:1", b"user_lock:2"):
+            yield key
+
+    mock = MagicMock()
+    mock.scan_iter = MagicMock(side_effect=scan_iter)
+    mocker.patch("redis_lock.r", mock)
+
+    locks = await get_all_locks()
+
     assert locks == ["user_lock:1", "user_lock:2"]
-    mock_redis.scan_iter.assert_called_once_with(match="user_lock:*")
+    mock.scan_iter.assert_called_once_with(match="user_lock:*")
 
 
-def test_is_locked_true(mock_redis):
+@pytest.mark.asyncio
+async def test_is_locked_true(mock_redis):
     """Тест проверки наличия блокировки (когда она есть)."""
     user_id = 123
     mock_redis.exists.return_value = 1
 
-    assert is_locked(user_id) is True
-    mock_redis.exists.assert_called_once_with(f"user_lock:{user_id}")
+    assert await is_locked(user_id, slots=1) is True
+    mock_redis.exists.assert_awaited_once_with(f"user_lock:{user_id}")
 
 
-def test_is_locked_false(mock_redis):
+@pytest.mark.asyncio
+async def test_is_locked_false(mock_redis):
     """Тест проверки наличия блокировки (когда ее нет)."""
     user_id = 123
     mock_redis.exists.return_value = 0
 
-    assert is_locked(user_id) is False
-    mock_redis.exists.assert_called_once_with(f"user_lock:{user_id}")
+    assert await is_locked(user_id, slots=3) is False
+    mock_redis.exists.assert_awaited_once_with(
+        f"user_lock:{user_id}", f"user_lock:{user_id}:1", f"user_lock:{user_id}:2"
+    )
+
+
+@pytest.mark.asyncio
+async def test_is_locked_checks_every_slot(mock_redis):
+    """Тест: пользователь занят, даже если свободен только первый слот."""
+    held = {"user_lock:123:2"}
+    mock_redis.exists.side_effect = lambda *keys: sum(key in held for key in keys)
+
+    assert await is_locked(123, slots=3) is True
+    assert await is_locked(123, slots=2) is False
+
+
+@pytest.mark.asyncio
+async def test_done_callback_after_lock_released_elsewhere(mock_redis):
+    """Тест: когда блокировку снимают по токену в другом процессе, продление останавливается и вызывается колбэк."""
+    mock_redis.set.return_value = True
+    mock_redis.eval.return_value = 0
+    finished = []
+
+    lock = await acquire_user_lock(123, ttl_ms=30)
+    lock.add_done_callback(finished.append)
+    await asyncio.sleep(0.05)
+
+    assert finished == [lock]
@@ -0,0 +1,106 @@
+import asyncio
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import asyncssh
+import pytest
+
+from clients import storage_client as storage_module
+from clients.storage_client import StorageClient
+
+BLOCK = 4
+
+
+class FakeRemoteFile:
+    def __init__(self, sftp, path):
+        self.sftp = sftp
+        self.path = path
+
+    async def read(self, size, offset):
+        return bytes(self.sftp.files[self.path][offset:offset + size])
+
+    async def write(self, data, offset):
+        await self.sftp.on_write(self.path, offset)
+        content = self.sftp.files[self.path]
+        if len(content) < offset:
+            content.extend(b"\0" * (offset - len(content)))
+        content[offset:offset + len(data)] = data
+        self.sftp.writes.append(offset)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+class FakeSFTP:
+    """SFTP-клиент в памяти: записи могут завершаться не по порядку и падать."""
+
+    def __init__(self):
+        self.files: dict[str, bytearray] = {}
+        self.writes: list[int] = []
+        self.fail_at: int | None = None
+
+    async def on_write(self, path, offset):
+        if offset == self.fail_at:
+            # Блок завершается последним и с ошибкой: блоки после него уже записаны
+            self.fail_at = None
+            await asyncio.sleep(0.01)
+            raise asyncssh.SFTPFailure("connection reset")
+
+    async def stat(self, path):
+        if path not in self.files:
+            raise asyncssh.SFTPNoSuchFile(path)
+        return SimpleNamespace(size=len(self.files[path]))
+
+    def open(self, path, mode):
+        if "w" in mode and "+" not in mode:
+            self.files[path] = bytearray()
+        return FakeRemoteFile(self, path)
+
+    async def truncate(self, path, size):
+        del self.files[path][size:]
+
+    async def chmod(self, path, mode):
+        pass
+
+    async def posix_rename(self, old, new):
+        self.files[new] = self.files.pop(old)
+
+
+@pytest.fixture
+def sftp():
+    return FakeSFTP()
+
+
+@pytest.fixture
+def client(monkeypatch, sftp):
+    monkeypatch.setattr(storage_module, "STORAGE_BLOCK_SIZE", BLOCK)
+    monkeypatch.setattr(storage_module, "STORAGE_MAX_REQUESTS", 4)
+    client = StorageClient()
+    client.remote_path = "/storage"
+
+    @asynccontextmanager
+    async def open_sftp():
+        yield sftp
+
+    client.pool = SimpleNamespace(sftp=open_sftp)
+    return client
+
+
+@pytest.mark.asyncio
+async def test_upload_resumes_from_acknowledged_prefix(client, sftp, tmp_path):
+    """Тест: после сбоя блока посреди файла загрузка продолжается с непрерывного подтверждённого префикса."""
+    local = tmp_path / "video.mp4"
+    content = bytes(range(22))
+    local.write_bytes(content)
+    sftp.fail_at = BLOCK
+
+    url = await client.upload_file(str(local))
+
+    assert url.endswith("video.mp4")
+    assert bytes(sftp.files["/storage/video.mp4"]) == content
+    # Первая попытка записала всё, кроме блока 4; вторая начинается с него, а не с размера .part
+    assert sorted(sftp.writes[:5]) == [0, 8, 12, 16, 20]
+    assert sftp.writes[5:] == [4, 8, 12, 16, 20]
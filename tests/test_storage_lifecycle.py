@@ -0,0 +1,103 @@
+import time
+from datetime import timedelta
+from unittest.mock import AsyncMock
+
+import pytest
+
+from storage_lifecycle import ACCESS_GRACE_PERIOD, StorageLifecycleManager
+
+
+def make_rows(*items):
+    return [{"remote_name": name, "size": size} for name, size in items]
+
+
+@pytest.fixture
+def storage():
+    """Фикстура хранилища, на котором удаление всегда успешно."""
+    mock = AsyncMock()
+    mock.delete_files.side_effect = lambda names: list(names)
+    mock.list_files.return_value = []
+    return mock
+
+
+@pytest.fixture
+def objects():
+    """Фикстура индекса объектов хранилища."""
+    mock = AsyncMock()
+    mock.get_expired.return_value = []
+    mock.get_eviction_candidates.return_value = []
+    mock.get_known_names.return_value = set()
+    mock.get_stats.return_value = {"total_size": 0}
+    return mock
+
+
+def make_manager(storage, objects, quota_bytes=0, ttl=3600):
+    return StorageLifecycleManager(storage, objects, quota_bytes=quota_bytes, ttl=ttl, interval=60, batch_size=2)
+
+
+@pytest.mark.asyncio
+async def test_collect_deletes_expired_objects(storage, objects):
+    """Тест: объекты старше TTL удаляются с хранилища и из индекса."""
+    objects.get_expired.side_effect = [make_rows(("a.mp4", 10), ("b.mp4", 20)), make_rows(("c.mp4", 5)), []]
+
+    result = await make_manager(storage, objects).collect()
+
+    assert result["expired"] == 3
+    assert result["freed_bytes"] == 35
+    objects.delete_objects.assert_any_await(["a.mp4", "b.mp4"])
+    objects.delete_objects.assert_any_await(["c.mp4"])
+
+
+@pytest.mark.asyncio
+async def test_expiry_spares_recently_handed_out_objects(storage, objects):
+    """Тест: по TTL не удаляются объекты, ссылку на которые выдали в пределах ACCESS_GRACE_PERIOD."""
+    manager = make_manager(storage, objects, ttl=3600)
+
+    await manager.collect()
+
+    created_before, accessed_before, _ = objects.get_expired.await_args.args
+    assert created_before - accessed_before == ACCESS_GRACE_PERIOD - timedelta(seconds=3600)
+
+
+@pytest.mark.asyncio
+async def test_collect_evicts_until_under_quota(storage, objects):
+    """Тест: при превышении квоты вытесняются давно не использованные объекты."""
+    objects.get_stats.return_value = {"total_size": 150}
+    objects.get_eviction_candidates.return_value = make_rows(("old.mp4", 40), ("older.mp4", 30))
+
+    result = await make_manager(storage, objects, quota_bytes=100, ttl=0).collect()
+
+    assert result["evicted"] == 2
+    assert result["freed_bytes"] == 70
+    assert objects.get_eviction_candidates.await_args.args[0] == 50
+    objects.get_expired.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_failed_deletes_stay_in_index(storage, objects):
+    """Тест: файл, который не удалось удалить, остаётся в индексе."""
+    objects.get_expired.return_value = make_rows(("a.mp4", 10), ("b.mp4", 20))
+    storage.delete_files.side_effect = lambda names: names[:1]
+
+    result = await make_manager(storage, objects).collect()
+
+    assert result["expired"] == 1
+    objects.delete_objects.assert_awaited_once_with(["a.mp4"])
+
+
+@pytest.mark.asyncio
+async def test_sweep_removes_stale_unindexed_files(storage, objects):
+    """Тест: удаляются брошенные .part-файлы и старые файлы вне индекса."""
+    old = time.time() - 2 * 24 * 3600
+    storage.list_files.return_value = [
+        ("x_720_abc.mp4.part", 5, old),
+        ("temp_1_20240101.mp4", 7, old),
+        ("temp_2_20240101.mp4", 9, old),
+        ("fresh.mp4.part", 3, time.time()),
+    ]
+    objects.get_known_names.return_value = {"temp_2_20240101.mp4"}
+
+    result = await make_manager(storage, objects).collect()
+
+    assert result["orphans"] == 2
+    storage.delete_files.assert_awaited_once_with(["x_720_abc.mp4.part", "temp_1_20240101.mp4"])
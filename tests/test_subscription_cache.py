@@ -0,0 +1,48 @@
+from unittest.mock import AsyncMock
+
+import pytest
+
+from subscription_cache import SubscriptionCache
+
+
+@pytest.fixture
+def mock_redis():
+    """Фикстура асинхронного клиента Redis."""
+    mock = AsyncMock()
+    mock.get.return_value = None
+    return mock
+
+
+@pytest.mark.asyncio
+async def test_cached_results(mock_redis):
+    """Тест чтения положительного и отрицательного результата из кэша."""
+    cache = SubscriptionCache(mock_redis, positive_ttl=600, negative_ttl=30)
+
+    assert await cache.get(1) is None
+    mock_redis.get.return_value = b"1"
+    assert await cache.get(1) is True
+    mock_redis.get.return_value = b"0"
+    assert await cache.get(1) is False
+    mock_redis.get.assert_awaited_with("subscribed:1")
+
+
+@pytest.mark.asyncio
+async def test_negative_result_has_short_ttl(mock_redis):
+    """Тест: отрицательный результат хранится меньше положительного."""
+    cache = SubscriptionCache(mock_redis, positive_ttl=600, negative_ttl=30)
+
+    await cache.set(1, True)
+    mock_redis.set.assert_awaited_with("subscribed:1", b"1", ex=600)
+    await cache.set(1, False)
+    mock_redis.set.assert_awaited_with("subscribed:1", b"0", ex=30)
+
+
+@pytest.mark.asyncio
+async def test_redis_errors_are_not_fatal(mock_redis):
+    """Тест: недоступность Redis означает промах кэша, а не ошибку."""
+    mock_redis.get.side_effect = ConnectionError("redis is down")
+    mock_redis.delete.side_effect = ConnectionError("redis is down")
+    cache = SubscriptionCache(mock_redis, positive_ttl=600, negative_ttl=30)
+
+    assert await cache.get(1) is None
+    await cache.invalidate(1)
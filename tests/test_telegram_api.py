@@ -0,0 +1,70 @@
+from pathlib import Path
+
+import pytest
+from contextlib import asynccontextmanager
+from aiogram import Bot, types
+from aiogram.client.session.aiohttp import AiohttpSession
+
+from bench.fake_bot_api import FakeBotAPI
+import telegram_api
+from telegram_api import build_api_server, file_input
+
+
+@asynccontextmanager
+async def local_bot_api():
+    """Локальный сервер Bot API и подключённый к нему бот."""
+    api = FakeBotAPI()
+    await api.start()
+    bot = Bot(token="123:abc", session=AiohttpSession(api=build_api_server(api.url, is_local=True)))
+    try:
+        yield api, bot
+    finally:
+        await bot.session.close()
+        await api.stop()
+
+
+@pytest.fixture
+def media_file(tmp_path):
+    path = tmp_path / "temp_1_20240101.mp4"
+    path.write_bytes(b"\0" * 1024)
+    return path
+
+
+@pytest.mark.asyncio
+async def test_local_server_receives_file_path(media_file):
+    """Тест: в режиме path файл передаётся локальному серверу по пути, без загрузки."""
+    async with local_bot_api() as (fake_api, bot):
+        sent = await bot.send_video(1, file_input(bot, str(media_file), strategy="path"))
+
+    call = fake_api.calls[-1]
+    assert call["method"] == "sendVideo"
+    assert call["fields"]["video"] == media_file.as_uri()
+    assert call["uploads"] == {}
+    assert sent.video.file_id == "fake-file-1"
+
+
+@pytest.mark.asyncio
+async def test_upload_strategy_sends_multipart(media_file):
+    """Тест: в режиме upload файл загружается целиком."""
+    async with local_bot_api() as (fake_api, bot):
+        await bot.send_document(1, file_input(bot, str(media_file), strategy="upload"))
+
+    call = fake_api.calls[-1]
+    attachment = call["fields"]["document"].removeprefix("attach://")
+    assert call["uploads"][attachment] == media_file.read_bytes()
+
+
+def test_public_api_always_uploads(media_file):
+    """Тест: без локального сервера путь к файлу не передаётся."""
+    bot = Bot(token="123:abc")
+
+    assert isinstance(file_input(bot, str(media_file), strategy="path"), types.FSInputFile)
+
+
+def test_files_dir_maps_to_server_path(media_file, monkeypatch):
+    """Тест: путь к файлу переводится в каталог, смонтированный на сервере."""
+    monkeypatch.setattr(telegram_api, "DOWNLOAD_DIR", str(media_file.parent))
+    session = AiohttpSession(api=build_api_server("http://bot-api:8081", is_local=True, files_dir="/srv/downloads"))
+    bot = Bot(token="123:abc", session=session)
+
+    assert file_input(bot, str(media_file), strategy="path") == Path("/srv/downloads", media_file.name).as_uri()
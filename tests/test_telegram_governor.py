@@ -0,0 +1,186 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageText
+
+from telegram_governor import DELIVERY, PROGRESS, TAKE_TOKEN_SCRIPT, TelegramRateGovernor, TokenBucket
+
+
+def make_governor(global_rate=100.0, chat_rate=100.0, chat_burst=1, max_retries=3):
+    return TelegramRateGovernor(global_rate, chat_rate, chat_burst, max_retries)
+
+
+def recorder(sent, value):
+    async def call():
+        sent.append(value)
+        return value
+    return call
+
+
+def test_token_bucket_delay():
+    """Тест: после расхода токенов ожидание соответствует скорости пополнения."""
+    bucket = TokenBucket(rate=2.0, capacity=1)
+    now = time.monotonic()
+
+    assert bucket.delay(now) == 0
+    bucket.take(now)
+    assert bucket.delay(now) == pytest.approx(0.5, abs=0.01)
+    bucket.pause(3, now)
+    assert bucket.delay(now) == pytest.approx(3, abs=0.01)
+
+
+@pytest.mark.asyncio
+async def test_chat_rate_is_limited():
+    """Тест: вызовы в один чат идут не чаще заданной скорости."""
+    governor = make_governor(chat_rate=20.0)
+    sent = []
+
+    started = time.monotonic()
+    await asyncio.gather(*(governor.submit(1, recorder(sent, i)) for i in range(4)))
+
+    assert sent == [0, 1, 2, 3]
+    assert time.monotonic() - started >= 0.14
+    await governor.close()
+
+
+@pytest.mark.asyncio
+async def test_progress_edits_are_coalesced():
+    """Тест: из очереди правок одного сообщения отправляется только последняя."""
+    governor = make_governor(chat_rate=10.0)
+    sent = []
+    # Первый вызов расходует токен чата, остальные ждут в очереди
+    first = asyncio.create_task(governor.submit(1, recorder(sent, "start")))
+    await asyncio.sleep(0)
+    edits = [
+        asyncio.create_task(governor.submit(1, recorder(sent, f"{i}%"), PROGRESS, coalesce_key=(1, 10)))
+        for i in (10, 20, 30)
+    ]
+
+    results = await asyncio.gather(first, *edits)
+
+    assert sent == ["start", "30%"]
+    assert results == ["start", None, None, "30%"]
+    assert governor.coalesced_total == 2
+    await governor.close()
+
+
+@pytest.mark.asyncio
+async def test_delivery_overtakes_progress():
+    """Тест: отправка результата обгоняет ожидающие правки статуса."""
+    governor = make_governor(chat_rate=10.0)
+    sent = []
+    first = asyncio.create_task(governor.submit(1, recorder(sent, "start")))
+    await asyncio.sleep(0)
+    progress = asyncio.create_task(governor.submit(1, recorder(sent, "progress"), PROGRESS, coalesce_key=(1, 10)))
+    await asyncio.sleep(0)
+    delivery = asyncio.create_task(governor.submit(1, recorder(sent, "file"), DELIVERY))
+
+    await asyncio.gather(first, progress, delivery)
+
+    assert sent == ["start", "file", "progress"]
+    await governor.close()
+
+
+@pytest.mark.asyncio
+async def test_retry_after_reschedules_call():
+    """Тест: после RetryAfter вызов повторяется, а чат ставится на паузу."""
+    governor = make_governor()
+    attempts = []
+
+    async def flaky():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise TelegramRetryAfter(EditMessageText(text="x"), "Too Many Requests", retry_after=0.1)
+        return "ok"
+
+    assert await governor.submit(1, flaky) == "ok"
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.09
+    assert governor.retry_after_total == 1
+    await governor.close()
+
+
+@pytest.mark.asyncio
+async def test_retry_after_gives_up():
+    """Тест: после исчерпания повторов ошибка RetryAfter передаётся вызывающему."""
+    governor = make_governor(max_retries=1)
+
+    async def flooded():
+        raise TelegramRetryAfter(EditMessageText(text="x"), "Too Many Requests", retry_after=0.01)
+
+    with pytest.raises(TelegramRetryAfter):
+        await governor.submit(1, flooded)
+    await governor.close()
+
+
+@pytest.mark.asyncio
+async def test_errors_are_passed_to_caller():
+    """Тест: прочие ошибки Telegram возвращаются вызывающему без повторов."""
+    governor = make_governor()
+    calls = []
+
+    async def broken():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        await governor.submit(1, broken)
+    assert calls == [1]
+    await governor.close()
+
+
+class SharedBucketRedis:
+    """Redis в памяти, который выполняет TAKE_TOKEN_SCRIPT тем же алгоритмом, что и TokenBucket."""
+
+    def __init__(self):
+        self.buckets: dict[str, TokenBucket] = {}
+
+    async def eval(self, script, numkeys, key, rate, capacity):
+        assert script == TAKE_TOKEN_SCRIPT
+        bucket = self.buckets.setdefault(key, TokenBucket(rate, capacity))
+        now = time.monotonic()
+        wait = bucket.delay(now)
+        if wait <= 0:
+            bucket.take(now)
+        return str(wait).encode()
+
+
+@pytest.mark.asyncio
+async def test_global_rate_is_shared_between_processes():
+    """Тест: бот и воркеры вместе не превышают глобальный лимит, а не каждый по отдельности."""
+    redis = SharedBucketRedis()
+    # Два процесса: у каждого свой регулятор, но общее ведро в Redis
+    governors = [TelegramRateGovernor(10.0, 100.0, 1, 3, redis=redis) for _ in range(2)]
+    sent = []
+
+    started = time.monotonic()
+    await asyncio.gather(*(
+        governor.submit(chat_id, recorder(sent, chat_id))
+        for index, governor in enumerate(governors)
+        for chat_id in range(index * 8, index * 8 + 8)
+    ))
+    elapsed = time.monotonic() - started
+
+    # 10 вызовов уходят сразу, оставшиеся 6 - со скоростью 10 в секунду на оба процесса
+    assert len(sent) == 16
+    assert elapsed >= 0.5
+    for governor in governors:
+        await governor.close()
+
+
+@pytest.mark.asyncio
+async def test_local_bucket_when_redis_fails():
+    """Тест: без Redis вызовы идут по локальному глобальному лимиту."""
+    class BrokenRedis:
+        async def eval(self, *args):
+            raise ConnectionError("redis is down")
+
+    governor = TelegramRateGovernor(100.0, 100.0, 1, 3, redis=BrokenRedis())
+    sent = []
+
+    await asyncio.gather(*(governor.submit(chat_id, recorder(sent, chat_id)) for chat_id in range(3)))
+
+    assert sorted(sent) == [0, 1, 2]
+    await governor.close()
@@ -0,0 +1,122 @@
+import json
+import multiprocessing
+
+import pytest
+
+from tracing import STATUS_ERROR, DownloadTimeline, JsonlTracer, Trace, current_span, span
+
+
+def read_records(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+@pytest.mark.asyncio
+async def test_spans_are_nested_and_exported(tmp_path):
+    """Тест: этапы задачи записываются одной строкой JSONL с правильной вложенностью."""
+    path = tmp_path / "traces.jsonl"
+    tracer = JsonlTracer(str(path), 0)
+
+    async with tracer.trace("process_download", **{"job.id": "j1"}) as root:
+        with span("lock_acquire"):
+            pass
+        with pytest.raises(ValueError):
+            with span("download"):
+                with span("extract_info"):
+                    raise ValueError("boom")
+
+    [record] = read_records(path)
+    spans = {item["name"]: item for item in record["spans"]}
+    assert record["traceId"] == root.trace.trace_id
+    assert spans["lock_acquire"]["parentSpanId"] == root.span_id
+    assert spans["extract_info"]["parentSpanId"] == spans["download"]["spanId"]
+    assert spans["download"]["status"] == {"code": STATUS_ERROR, "message": "ValueError: boom"}
+    assert spans["process_download"]["attributes"] == {"job.id": "j1"}
+    assert current_span() is None
+
+
+def test_span_outside_trace_is_noop():
+    """Тест: вне трассы спаны ничего не записывают."""
+    with span("download") as item:
+        assert item is None
+
+
+@pytest.mark.asyncio
+async def test_download_timeline_records_fragments(tmp_path):
+    """Тест: хук yt-dlp создаёт спаны файлов, фрагментов и постобработки."""
+    path = tmp_path / "traces.jsonl"
+    tracer = JsonlTracer(str(path), 0)
+
+    async with tracer.trace("run_download_job"):
+        with span("download"):
+            timeline = DownloadTimeline()
+            for index in (1, 1, 2, 3):
+                timeline({"status": "downloading", "filename": "/tmp/a.f137.mp4", "fragment_index": index})
+            timeline({"status": "finished", "filename": "/tmp/a.f137.mp4", "total_bytes": 100})
+            timeline.postprocessor({"status": "started", "postprocessor": "Merger"})
+            timeline.postprocessor({"status": "finished", "postprocessor": "Merger"})
+            timeline.postprocessor({"status": "started", "postprocessor": "FixupM4a"})
+            timeline.postprocessor({"status": "finished", "postprocessor": "FixupM4a"})
+            timeline.postprocessor({"status": "started", "postprocessor": "MoveFiles"})
+            timeline.close()
+
+    [record] = read_records(path)
+    names = [item["name"] for item in record["spans"]]
+    spans = {item["spanId"]: item for item in record["spans"]}
+    fragments = [item for item in record["spans"] if item["name"] == "download_fragment"]
+    assert names.count("download_file") == 1
+    assert [item["attributes"]["fragment.index"] for item in fragments] == [1, 2, 3]
+    assert all(spans[item["parentSpanId"]]["name"] == "download_file" for item in fragments)
+    assert spans[fragments[0]["parentSpanId"]]["attributes"]["file.bytes"] == 100
+    assert "merge" in names
+    assert "convert" in names
+    assert "postprocess" in names
+
+
+@pytest.mark.asyncio
+async def test_slow_jobs_merge_processes(tmp_path):
+    """Тест: записи бота и воркера одной задачи объединяются по trace id."""
+    path = tmp_path / "traces.jsonl"
+    tracer = JsonlTracer(str(path), 0)
+
+    async with tracer.trace("process_download", **{"job.id": "slow"}) as bot_root:
+        with span("lock_acquire"):
+            pass
+    async with tracer.trace(
+        "run_download_job", trace_id=bot_root.trace.trace_id, parent_span_id=bot_root.span_id,
+        **{"job.outcome": "url"},
+    ):
+        with span("download"):
+            pass
+    async with tracer.trace("process_download", **{"job.id": "other"}):
+        pass
+
+    jobs = tracer.slow_jobs(5, 0)
+    assert [job["attributes"]["job.id"] for job in jobs] == ["other", "slow"]
+    assert jobs[1]["attributes"]["job.outcome"] == "url"
+    assert set(jobs[1]["stages"]) == {"lock_acquire", "download"}
+    assert tracer.slow_jobs(5, 60) == []
+
+
+def test_rotation_is_safe_across_processes(tmp_path):
+    """Тест: процессы, пишущие в общий файл, поворачивают его по одному разу на переполнение."""
+    path = tmp_path / "traces.jsonl"
+    max_bytes = 4096
+
+    def write_traces():
+        tracer = JsonlTracer(str(path), max_bytes)
+        for _ in range(100):
+            tracer.export(Trace("run_download_job", None, None, {}))
+
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=write_traces) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+        assert process.exitcode == 0
+
+    rotated = tmp_path / "traces.jsonl.1"
+    line_size = max(len(line) + 1 for line in rotated.read_text(encoding="utf-8").splitlines())
+    # Без общей блокировки второй процесс мог повернуть только что созданный короткий файл
+    assert max_bytes <= rotated.stat().st_size < max_bytes + line_size
+    assert all(record["spans"] for record in read_records(path) + read_records(rotated))
@@ -0,0 +1,119 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook import SECRET_HEADER, UpdateRouter, create_listener_app, serve_updates, shard_for, update_user_id
+
+
+def message_update(update_id, user_id):
+    return {
+        "update_id": update_id,
+        "message": {"message_id": update_id, "from": {"id": user_id}, "chat": {"id": user_id}, "text": "hi"},
+    }
+
+
+async def start_fake_worker(path, received):
+    async def handle(reader, writer):
+        while line := await reader.readline():
+            received.append(json.loads(line))
+    return await asyncio.start_unix_server(handle, path=path)
+
+
+def test_update_user_id():
+    """Тест: пользователь определяется по отправителю апдейта любого типа."""
+    assert update_user_id(message_update(1, 42)) == 42
+    assert update_user_id({"update_id": 2, "callback_query": {"id": "q", "from": {"id": 7}}}) == 7
+    assert update_user_id({"update_id": 3, "poll_answer": {"poll_id": "p", "user": {"id": 9}}}) == 9
+    assert update_user_id({"update_id": 4, "poll": {"id": "p"}}) is None
+
+
+def test_shard_for_is_stable():
+    """Тест: апдейты одного пользователя всегда попадают в один процесс."""
+    shards = {shard_for(message_update(update_id, 12345), 4) for update_id in range(10)}
+
+    assert len(shards) == 1
+    assert 0 <= shard_for({"update_id": 5, "my_chat_member": {"chat": {"id": -100123}}}, 4) < 4
+
+
+@pytest.mark.asyncio
+async def test_listener_routes_updates_by_user(tmp_path):
+    """Тест: приёмник раскладывает апдейты по процессам, сохраняя порядок для пользователя."""
+    paths = [str(tmp_path / f"w{i}.sock") for i in range(2)]
+    received = [[], []]
+    servers = [await start_fake_worker(path, box) for path, box in zip(paths, received)]
+    router = UpdateRouter(paths)
+
+    async with TestClient(TestServer(create_listener_app(router, "/webhook", "secret"))) as client:
+        for update_id, user_id in enumerate([1, 2, 1, 3, 1]):
+            response = await client.post(
+                "/webhook", json=message_update(update_id, user_id), headers={SECRET_HEADER: "secret"}
+            )
+            assert response.status == 200
+        await asyncio.sleep(0.05)
+
+    assert [u["update_id"] for u in received[1] if u["message"]["from"]["id"] == 1] == [0, 2, 4]
+    assert [u["update_id"] for u in received[0]] == [1]
+    assert router.routed == [1, 4]
+    for server in servers:
+        server.close()
+        await server.wait_closed()
+    await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_listener_rejects_and_reports_unavailable_worker(tmp_path):
+    """Тест: чужой секрет отклоняется, а недоступный обработчик даёт 503 для повтора доставки."""
+    router = UpdateRouter([str(tmp_path / "missing.sock")])
+
+    async with TestClient(TestServer(create_listener_app(router, "/webhook", "secret"))) as client:
+        forbidden = await client.post("/webhook", json=message_update(1, 1), headers={SECRET_HEADER: "wrong"})
+        unavailable = await client.post("/webhook", json=message_update(1, 1), headers={SECRET_HEADER: "secret"})
+
+    assert forbidden.status == 401
+    assert unavailable.status == 503
+
+
+@pytest.mark.asyncio
+async def test_serve_updates_feeds_dispatcher_in_order(tmp_path):
+    """Тест: обработчик передаёт апдейты диспетчеру в порядке поступления."""
+    path = str(tmp_path / "worker.sock")
+    dp = MagicMock()
+    dp.feed_raw_update = AsyncMock()
+    dp.emit_startup = AsyncMock()
+    dp.emit_shutdown = AsyncMock()
+    bot = MagicMock()
+
+    task = asyncio.create_task(serve_updates(dp, bot, path))
+    await asyncio.sleep(0.05)
+    router = UpdateRouter([path])
+    for update_id in range(3):
+        await router.route(message_update(update_id, 1))
+    await asyncio.sleep(0.05)
+    await router.close()
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    assert [c.args[1]["update_id"] for c in dp.feed_raw_update.await_args_list] == [0, 1, 2]
+    dp.emit_shutdown.assert_awaited_once()
+
+
+def test_update_worker_limits_split_between_processes(monkeypatch):
+    """Тест: процессы-обработчики делят лимиты бота, а не умножают их."""
+    import main
+
+    monkeypatch.setattr(main, "DOWNLOAD_CONCURRENCY", 8)
+    monkeypatch.setattr(main, "POSTPROCESS_CONCURRENCY", 2)
+    monkeypatch.setattr(main, "UPLOAD_CONCURRENCY", 4)
+    monkeypatch.setattr(main, "YTDLP_PROCESS_WORKERS", 8)
+
+    limits = main.update_worker_limits(4)
+
+    assert limits == {
+        "DOWNLOAD_CONCURRENCY": "2",
+        "POSTPROCESS_CONCURRENCY": "1",
+        "UPLOAD_CONCURRENCY": "1",
+        "YTDLP_PROCESS_WORKERS": "2",
+    }
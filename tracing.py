@@ -0,0 +1,326 @@
+import asyncio
+import contextvars
+import fcntl
+import json
+import logging
+import os
+import secrets
+import socket
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Optional
+
+from config import TRACE_FILE, TRACE_MAX_BYTES
+from ytdlp_worker import FFMPEG_POSTPROCESSORS
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "youtube_downloader_bot"
+# Коды статуса и вид спана в терминах OTLP
+STATUS_UNSET = "STATUS_CODE_UNSET"
+STATUS_ERROR = "STATUS_CODE_ERROR"
+SPAN_KIND_INTERNAL = "SPAN_KIND_INTERNAL"
+# Спаны задач целиком; их прямые потомки считаются этапами
+SPAN_KIND_SERVER = "SPAN_KIND_SERVER"
+# Сколько фрагментов одного файла попадает в трассу
+MAX_FRAGMENT_SPANS = 1000
+# Сколько байт с конца файла читается при поиске медленных задач
+TRACE_SCAN_BYTES = 8 * 1024 * 1024
+
+
+class Span:
+    """One timed operation; fields follow the OpenTelemetry span model."""
+
+    __slots__ = (
+        "trace", "span_id", "parent_span_id", "name", "kind", "start_ns", "end_ns", "attributes", "status", "message"
+    )
+
+    def __init__(
+        self, trace: "Trace", name: str, parent_span_id: Optional[str], attributes: dict,
+        kind: str = SPAN_KIND_INTERNAL,
+    ):
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = {k: v for k, v in attributes.items() if v is not None}
+        self.status = STATUS_UNSET
+        self.message = ""
+
+    def set_attribute(self, key: str, value: Any):
+        if value is not None:
+            self.attributes[key] = value
+
+    def end(self, error: Optional[BaseException] = None):
+        if self.end_ns is not None:
+            return
+        if error is not None:
+            self.status = STATUS_ERROR
+            self.message = f"{type(error).__name__}: {error}"
+        self.end_ns = time.time_ns()
+
+    def to_dict(self) -> dict:
+        record = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id or "",
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns or time.time_ns(),
+            "attributes": self.attributes,
+            "status": {"code": self.status},
+        }
+        if self.message:
+            record["status"]["message"] = self.message
+        return record
+
+
+class Trace:
+    """The spans one process recorded for one job."""
+
+    def __init__(self, name: str, trace_id: Optional[str], parent_span_id: Optional[str], attributes: dict):
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+        self.root = self.start_span(name, parent_span_id, attributes, SPAN_KIND_SERVER)
+
+    def start_span(
+        self, name: str, parent_span_id: Optional[str], attributes: dict, kind: str = SPAN_KIND_INTERNAL
+    ) -> Span:
+        span = Span(self, name, parent_span_id, attributes, kind)
+        # Спаны фрагментов создаются из потока yt-dlp
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = [span.to_dict() for span in self.spans]
+        return {
+            "resource": {"service.name": SERVICE_NAME, "host.name": socket.gethostname(), "process.pid": os.getpid()},
+            "traceId": self.trace_id,
+            "name": self.root.name,
+            "startTimeUnixNano": self.root.start_ns,
+            "endTimeUnixNano": self.root.end_ns,
+            "spans": spans,
+        }
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, _kind: str = SPAN_KIND_INTERNAL, **attributes):
+    """Times a block as a child of the current span; a no-op outside a trace."""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = parent.trace.start_span(name, parent.span_id, attributes, _kind)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.end(error=e)
+        raise
+    finally:
+        child.end()
+        _current_span.reset(token)
+
+
+class DownloadTimeline:
+    """
+    yt-dlp progress and postprocessor hook that records a span per
+    downloaded file, per fragment of it, and per postprocessor run.
+    """
+
+    def __init__(self):
+        self.parent = _current_span.get()
+        self._file: Optional[Span] = None
+        self._fragment: Optional[Span] = None
+        self._fragments = 0
+        self._postprocessor: Optional[Span] = None
+
+    def _start(self, name: str, parent: Span, **attributes) -> Span:
+        return self.parent.trace.start_span(name, parent.span_id, attributes)
+
+    def _finish_fragment(self):
+        if self._fragment is not None:
+            self._fragment.end()
+            self._fragment = None
+
+    def _finish_file(self, error: Optional[str] = None, **attributes):
+        self._finish_fragment()
+        if self._file is not None:
+            for key, value in attributes.items():
+                self._file.set_attribute(key, value)
+            self._file.end(RuntimeError(error) if error else None)
+            self._file = None
+
+    def __call__(self, d: dict):
+        if self.parent is None:
+            return
+        status = d.get('status')
+        filename = os.path.basename(d.get('filename') or '')
+        if status == 'downloading':
+            if self._file is None or self._file.attributes.get('file.name') != filename:
+                self._finish_file()
+                self._file = self._start("download_file", self.parent, **{'file.name': filename})
+                self._fragments = 0
+            index = d.get('fragment_index')
+            if index is not None and self._fragments < MAX_FRAGMENT_SPANS and (
+                self._fragment is None or self._fragment.attributes.get('fragment.index') != index
+            ):
+                self._finish_fragment()
+                self._fragments += 1
+                self._fragment = self._start(
+                    "download_fragment", self._file,
+                    **{'fragment.index': index, 'fragment.count': d.get('fragment_count')},
+                )
+        elif status == 'finished':
+            self._finish_file(**{'file.bytes': d.get('total_bytes') or d.get('downloaded_bytes')})
+        elif status == 'error':
+            self._finish_file(error=f"download of {filename} failed")
+
+    def postprocessor(self, d: dict):
+        if self.parent is None:
+            return
+        name = d.get('postprocessor') or ''
+        if d.get('status') == 'started':
+            self._finish_file()
+            if self._postprocessor is not None:
+                self._postprocessor.end()
+            # Хуки сообщают pp_key(): Merger, ExtractAudio, VideoConvertor...
+            if name == "Merger":
+                span_name = "merge"
+            elif name in FFMPEG_POSTPROCESSORS:
+                span_name = "convert"
+            else:
+                span_name = "postprocess"
+            self._postprocessor = self._start(span_name, self.parent, **{'postprocessor.name': name})
+        elif d.get('status') == 'finished' and self._postprocessor is not None:
+            self._postprocessor.end()
+            self._postprocessor = None
+
+    def close(self, error: Optional[BaseException] = None):
+        if self.parent is None:
+            return
+        self._finish_file(error=str(error) if error else None)
+        if self._postprocessor is not None:
+            self._postprocessor.end(error)
+            self._postprocessor = None
+
+
+def _tail_lines(path: str, max_bytes: int) -> list[str]:
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - max_bytes))
+        data = f.read()
+    lines = data.decode("utf-8", errors="replace").splitlines()
+    # Первая строка может быть обрезана посередине
+    return lines[1:] if size > max_bytes else lines
+
+
+class JsonlTracer:
+    """
+    Records a span timeline per download job and appends each finished
+    trace to a JSONL file, one OTLP-shaped record per line. The bot and the
+    workers write their parts of a job under the same trace id.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._write_lock = threading.Lock()
+
+    @asynccontextmanager
+    async def trace(self, name: str, trace_id: Optional[str] = None, parent_span_id: Optional[str] = None, **attributes):
+        """
+        Opens a trace for a job. Inside an already traced job of the same
+        trace this is just a child span.
+        """
+        current = _current_span.get()
+        if current is not None and trace_id in (None, current.trace.trace_id):
+            with span(name, SPAN_KIND_SERVER, **attributes) as child:
+                yield child
+            return
+
+        trace = Trace(name, trace_id, parent_span_id, attributes)
+        token = _current_span.set(trace.root)
+        try:
+            yield trace.root
+        except BaseException as e:
+            trace.root.end(error=e)
+            raise
+        finally:
+            trace.root.end()
+            _current_span.reset(token)
+            if self.path:
+                try:
+                    await asyncio.to_thread(self.export, trace)
+                except Exception as e:
+                    logger.warning(f"Не удалось записать трассу {trace.trace_id}: {e}")
+
+    def export(self, trace: Trace):
+        line = json.dumps(trace.to_dict(), ensure_ascii=False, separators=(",", ":")) + "\n"
+        # Файл общий для бота и воркеров: поворот и запись идут под блокировкой на уровне ОС
+        with self._write_lock, open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                os.replace(self.path, self.path + ".1")
+            # Одна запись в O_APPEND: строки бота и воркеров в общем файле не перемешиваются
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line.encode("utf-8"))
+            finally:
+                os.close(fd)
+
+    def slow_jobs(self, limit: int, min_seconds: float) -> list[dict]:
+        """
+        The latest `limit` jobs that took at least `min_seconds`, newest first.
+        Records of one job written by different processes are merged.
+        """
+        if not self.path or not os.path.exists(self.path):
+            return []
+        jobs: dict[str, dict] = {}
+        for line in _tail_lines(self.path, TRACE_SCAN_BYTES):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            job = jobs.setdefault(
+                record["traceId"], {"trace_id": record["traceId"], "spans": [], "attributes": {}, "stages": {}}
+            )
+            job["spans"].extend(record["spans"])
+            # Этапы - прямые потомки спанов задачи в каждой записи
+            job_span_ids = {item["spanId"] for item in record["spans"] if item["kind"] == SPAN_KIND_SERVER}
+            for item in record["spans"]:
+                if item["kind"] == SPAN_KIND_SERVER:
+                    job["attributes"].update(item["attributes"])
+                elif item["parentSpanId"] in job_span_ids:
+                    duration = (item["endTimeUnixNano"] - item["startTimeUnixNano"]) / 1e9
+                    job["stages"][item["name"]] = job["stages"].get(item["name"], 0.0) + duration
+
+        result = []
+        for job in jobs.values():
+            start = min(item["startTimeUnixNano"] for item in job["spans"])
+            end = max(item["endTimeUnixNano"] for item in job["spans"])
+            job["start_ns"] = start
+            job["duration"] = (end - start) / 1e9
+            if job["duration"] >= min_seconds:
+                result.append(job)
+        result.sort(key=lambda job: job["start_ns"], reverse=True)
+        return result[:limit]
+
+
+tracer = JsonlTracer(TRACE_FILE, TRACE_MAX_BYTES)
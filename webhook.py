@@ -0,0 +1,161 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# Предел длины одного апдейта в канале между приёмником и обработчиком
+UPDATE_LINE_LIMIT = 4 * 1024 * 1024
+
+
+def webhook_socket_path(socket_dir: str, index: int) -> str:
+    return os.path.join(socket_dir, f"bot-updates-{index}.sock")
+
+
+def update_user_id(update: dict) -> Optional[int]:
+    """Id of the user (or chat) an update belongs to, if the update has one."""
+    for key, payload in update.items():
+        if key == "update_id" or not isinstance(payload, dict):
+            continue
+        for field in ("from", "user", "chat"):
+            sender = payload.get(field)
+            if isinstance(sender, dict) and "id" in sender:
+                return sender["id"]
+    return None
+
+
+def shard_for(update: dict, workers: int) -> int:
+    """Picks the dispatcher process for an update; one user always maps to the same one."""
+    user_id = update_user_id(update)
+    key = user_id if user_id is not None else update.get("update_id", 0)
+    return key % workers
+
+
+async def serve_app(app: web.Application, host: str, port: int):
+    """Runs an aiohttp application until cancelled."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info(f"Приём обновлений на {host}:{port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def create_webhook_app(dp: Dispatcher, bot: Bot, path: str, secret_token: Optional[str]) -> web.Application:
+    """Single-process webhook: updates are handled right in the aiohttp server."""
+    app = web.Application()
+    SimpleRequestHandler(dp, bot, secret_token=secret_token).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+class UpdateRouter:
+    """
+    Forwards webhook updates to the dispatcher processes. Each process gets
+    one ordered unix-socket connection, and updates are sharded by user, so
+    the updates of one user are handled by one process in arrival order.
+    """
+
+    def __init__(self, socket_paths: list[str]):
+        self.socket_paths = socket_paths
+        self._writers: list[Optional[asyncio.StreamWriter]] = [None] * len(socket_paths)
+        self._locks = [asyncio.Lock() for _ in socket_paths]
+        self.routed = [0] * len(socket_paths)
+
+    async def _writer(self, index: int) -> asyncio.StreamWriter:
+        writer = self._writers[index]
+        if writer is None or writer.is_closing():
+            _, writer = await asyncio.open_unix_connection(self.socket_paths[index])
+            self._writers[index] = writer
+        return writer
+
+    async def route(self, update: dict) -> int:
+        index = shard_for(update, len(self.socket_paths))
+        line = json.dumps(update, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        async with self._locks[index]:
+            try:
+                writer = await self._writer(index)
+                writer.write(line)
+                await writer.drain()
+            except OSError:
+                self._writers[index] = None
+                raise
+        self.routed[index] += 1
+        return index
+
+    async def close(self):
+        for writer in self._writers:
+            if writer is not None:
+                writer.close()
+        self._writers = [None] * len(self.socket_paths)
+
+
+def create_listener_app(router: UpdateRouter, path: str, secret_token: Optional[str]) -> web.Application:
+    """Multi-process webhook: the listener only validates updates and routes them."""
+
+    async def handle(request: web.Request) -> web.Response:
+        if secret_token and request.headers.get(SECRET_HEADER) != secret_token:
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        try:
+            await router.route(update)
+        except OSError as e:
+            # Telegram повторит доставку, когда обработчик снова будет доступен
+            logger.error(f"Не удалось передать обновление {update.get('update_id')} обработчику: {e}")
+            return web.Response(status=503)
+        return web.Response()
+
+    async def on_cleanup(app: web.Application):
+        await router.close()
+
+    app = web.Application()
+    app.router.add_post(path, handle)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+async def serve_updates(dp: Dispatcher, bot: Bot, socket_path: str):
+    """
+    Dispatcher-process side: reads updates from the listener and starts
+    handling them in the order they arrive, like long polling does.
+    """
+    tasks: set[asyncio.Task] = set()
+
+    async def feed(update: dict):
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception as e:
+            logger.error(f"Ошибка обработки обновления {update.get('update_id')}: {e}", exc_info=True)
+
+    async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while line := await reader.readline():
+                task = asyncio.create_task(feed(json.loads(line)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            writer.close()
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = await asyncio.start_unix_server(handle_connection, path=socket_path, limit=UPDATE_LINE_LIMIT)
+    logger.info(f"Обработчик обновлений слушает {socket_path}")
+    await dp.emit_startup(bot=bot)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await dp.emit_shutdown(bot=bot)
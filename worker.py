@@ -0,0 +1,53 @@
+import asyncio
+import logging
+import os
+import socket
+
+from audio import db, logger, run_download_job, ytdlp_pool, telegram_governor
+from clients.redis_client import redis_client
+from clients.storage_client import storage_client
+from config import WORKER_CONCURRENCY, METRICS_HOST, METRICS_PORT
+from download_scheduler import download_scheduler
+from job_queue import JobWorker
+from metrics import register_pipeline_collector, start_metrics_server
+
+
+async def main():
+    logger.info("Воркер загрузок запущен!")
+    try:
+        await db.connect()
+        await db.init_db()
+        await db.warm_up()
+    except Exception as e:
+        logger.critical(f"Ошибка подключения к БД: {e}")
+        return
+
+    # Соединения с хранилищем поднимаются в фоне и не задерживают запуск
+    storage_warmup = asyncio.create_task(storage_client.warm_up())
+    register_pipeline_collector(download_scheduler, db, telegram_governor)
+    metrics_server = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+
+    worker = JobWorker(
+        redis_client,
+        consumer=f"{socket.gethostname()}-{os.getpid()}",
+        handler=run_download_job,
+        concurrency=WORKER_CONCURRENCY,
+    )
+    try:
+        await worker.run()
+    finally:
+        if ytdlp_pool is not None:
+            await ytdlp_pool.close()
+        storage_warmup.cancel()
+        await telegram_governor.close()
+        if metrics_server is not None:
+            await metrics_server.cleanup()
+        await storage_client.close()
+        await db.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logging.info("Воркер остановлен")
@@ -0,0 +1,94 @@
+"""
+yt-dlp download step, usable both in-process and as a pool worker.
+
+Started as `python ytdlp_worker.py`, the module serves download jobs over
+stdin/stdout as JSON lines (see process_pool.YtdlpProcessPool).
+"""
+import json
+import logging
+import os
+import sys
+
+from yt_dlp import YoutubeDL, postprocessor
+from yt_dlp.postprocessor import FFmpegPostProcessor
+from yt_dlp.utils import DownloadError, ExtractorError
+
+logger = logging.getLogger(__name__)
+
+# Поля прогресса yt-dlp, которые передаются из процесса-воркера
+PROGRESS_FIELDS = (
+    'status', 'filename', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate',
+    'elapsed', 'eta', 'speed', 'fragment_index', 'fragment_count',
+    '_percent_str', '_speed_str', '_eta_str',
+)
+
+# Хуки постобработки сообщают pp_key(): имя класса без префикса FFmpeg и суффикса PP
+# (ExtractAudio, Merger, FixupM4a, VideoConvertor...)
+FFMPEG_POSTPROCESSORS = frozenset(
+    cls.pp_key() for cls in vars(postprocessor).values()
+    if isinstance(cls, type) and issubclass(cls, FFmpegPostProcessor) and cls is not FFmpegPostProcessor
+)
+
+
+def is_ffmpeg_start(d: dict) -> bool:
+    """Whether a postprocessor hook reports the start of an ffmpeg-based postprocessor."""
+    return d['status'] == 'started' and d['postprocessor'] in FFMPEG_POSTPROCESSORS
+
+
+def run_ytdlp(ydl_opts: dict, info: dict, url: str) -> tuple[dict, bool]:
+    """
+    Downloads from an already extracted info dict, re-extracting the URL if
+    the cached format URLs no longer work.
+
+    Returns a short summary of the result and whether re-extraction happened.
+    """
+    reextracted = False
+    with YoutubeDL(ydl_opts) as ydl:
+        try:
+            # Скачиваем по уже извлечённым форматам, без повторной экстракции
+            result = ydl.process_ie_result(info, download=True)
+        except (DownloadError, ExtractorError) as e:
+            logger.warning(f"Скачивание по кэшированным метаданным не удалось ({e}), повторная экстракция")
+            result = ydl.extract_info(url)
+            reextracted = True
+
+    requested = (result.get('requested_downloads') or [{}])[0]
+    summary = {
+        'title': result.get('title'),
+        'ext': result.get('ext'),
+        'filepath': requested.get('filepath'),
+        'format_id': requested.get('format_id'),
+    }
+    return summary, reextracted
+
+
+def _serve():
+    # stdout остаётся каналом протокола, весь прочий вывод уходит в stderr
+    protocol_out = os.fdopen(os.dup(sys.stdout.fileno()), 'w', buffering=1, encoding='utf-8')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    def send(message: dict):
+        protocol_out.write(json.dumps(message, separators=(',', ':')) + '\n')
+
+    def progress_hook(d):
+        send({'type': 'progress', 'data': {k: d.get(k) for k in PROGRESS_FIELDS}})
+
+    def postprocessor_hook(d):
+        send({'type': 'postprocess', 'data': {'status': d['status'], 'postprocessor': d['postprocessor']}})
+        if is_ffmpeg_start(d):
+            # Ждём, пока родитель выделит слот постобработки
+            json.loads(sys.stdin.readline())
+
+    for line in sys.stdin:
+        job = json.loads(line)
+        ydl_opts = dict(job['opts'], progress_hooks=[progress_hook], postprocessor_hooks=[postprocessor_hook])
+        try:
+            summary, reextracted = run_ytdlp(ydl_opts, job['info'], job['url'])
+            send({'type': 'done', 'summary': summary, 'reextracted': reextracted})
+        except Exception as e:
+            send({'type': 'error', 'message': str(e)})
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    _serve()